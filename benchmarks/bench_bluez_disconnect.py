@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Exercise the BlueZ disconnect path against a private dbus-daemon
+
+Starts a throw-away bus with a mock `org.bluez` service exposing one
+Device1 object, then measures how long `disconnect_device` blocks the
+caller and how long until the completion callback runs. Also checks the
+error reply for an unknown device and the timeout of a service which
+never answers:
+
+    python3 benchmarks/bench_bluez_disconnect.py [count]
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from eventloop import EventLoop  # noqa: E402
+from jeepney import HeaderFields  # noqa: E402
+
+from gamepad.bluez import BluezClient, BluezError, DBusConnection, device_path  # noqa: E402
+
+BUS_CONFIG = """<!DOCTYPE busconfig PUBLIC "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+  <type>session</type>
+  <listen>unix:path={path}</listen>
+  <auth>EXTERNAL</auth>
+  <policy context="default">
+    <allow send_destination="*"/>
+    <allow receive_sender="*"/>
+    <allow own="*"/>
+  </policy>
+</busconfig>
+"""
+
+DEVICE = "AA:BB:CC:DD:EE:FF"
+SILENT_DEVICE = "AA:BB:CC:DD:EE:00"
+
+
+class MockBluez(object):
+    """org.bluez replacement answering Device1.Disconnect on its own thread"""
+
+    def __init__(self, address):
+        self.loop = EventLoop()
+        self.conn = DBusConnection(address)
+        self.conn.connect()
+        self.conn.on_method_call = self.on_method_call
+        self.loop.register(self.conn, self.conn.handle_events)
+        self.calls = 0
+
+        acquired = []
+        self.conn.call("org.freedesktop.DBus", "/org/freedesktop/DBus", "org.freedesktop.DBus",
+                       "RequestName", "su", ("org.bluez", 0), callback=acquired.append)
+        while not acquired:
+            self.loop.run_once()
+
+        self.thread = threading.Thread(target=self.loop.run, daemon=True)
+        self.thread.start()
+
+    def on_method_call(self, msg):
+        fields = msg.header.fields
+        path = fields[HeaderFields.path]
+        if fields.get(HeaderFields.interface) != "org.bluez.Device1" or fields[HeaderFields.member] != "Disconnect":
+            self.conn.error(msg, "org.freedesktop.DBus.Error.UnknownMethod")
+        elif path == device_path(DEVICE):
+            self.calls += 1
+            self.conn.reply(msg)
+        elif path == device_path(SILENT_DEVICE):
+            pass  # Never answers
+        else:
+            self.conn.error(msg, "org.freedesktop.DBus.Error.UnknownObject", path)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def run_until(loop, results, count):
+    while len(results) < count:
+        loop.run_once()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    if not shutil.which("dbus-daemon"):
+        sys.exit("dbus-daemon not found")
+
+    tmpdir = tempfile.mkdtemp()
+    config = os.path.join(tmpdir, "bus.conf")
+    with open(config, "w") as fp:
+        fp.write(BUS_CONFIG.format(path=os.path.join(tmpdir, "bus")))
+    daemon = subprocess.Popen(["dbus-daemon", "--nofork", "--print-address", f"--config-file={config}"],
+                              stdout=subprocess.PIPE)
+    address = daemon.stdout.readline().decode().strip()
+
+    try:
+        mock = MockBluez(address)
+        loop = EventLoop()
+        client = BluezClient(loop, loop.tasks, address, timeout=0.2)
+
+        blocked, completed, results = [], [], []
+        for _ in range(count):
+            start = time.perf_counter()
+            client.disconnect_device(DEVICE, callback=results.append)
+            blocked.append(time.perf_counter() - start)
+            run_until(loop, results, len(blocked))
+            completed.append(time.perf_counter() - start)
+        # The first call includes connecting to the bus
+        connect, blocked, completed = blocked[0], blocked[1:], completed[1:]
+
+        assert all(error is None for error in results), results
+        assert mock.calls == count
+        print(f"connect + first call: {connect * 1e3:8.3f} ms")
+        print(f"call blocks loop:     p50 {percentile(blocked, 50) * 1e6:7.1f} us"
+              f"  p99 {percentile(blocked, 99) * 1e6:7.1f} us")
+        print(f"completion:           p50 {percentile(completed, 50) * 1e6:7.1f} us"
+              f"  p99 {percentile(completed, 99) * 1e6:7.1f} us")
+
+        results.clear()
+        client.disconnect_device("11:22:33:44:55:66", callback=results.append)
+        run_until(loop, results, 1)
+        assert isinstance(results[0], BluezError), results
+        assert results[0].name == "org.freedesktop.DBus.Error.UnknownObject"
+        print(f"unknown device:       {results[0]}")
+
+        results.clear()
+        start = time.perf_counter()
+        client.disconnect_device(SILENT_DEVICE, callback=results.append)
+        run_until(loop, results, 1)
+        assert isinstance(results[0], TimeoutError), results
+        print(f"silent device:        {results[0]} ({(time.perf_counter() - start) * 1e3:.0f} ms)")
+
+        start = time.perf_counter()
+        subprocess.run(["true"])
+        print(f"for comparison, spawning a process: {(time.perf_counter() - start) * 1e3:.3f} ms")
+
+        client.close()
+        mock.stop()
+    finally:
+        daemon.terminate()
+        daemon.wait()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
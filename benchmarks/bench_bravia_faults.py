@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Check Bravia call latency against a stub TV that delays, drops or resets connections
+
+Every scenario prints how long the calls took and how many requests reached
+the stub. Timeouts are shortened so the run takes a few seconds:
+
+    python3 benchmarks/bench_bravia_faults.py [calls]
+"""
+
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import tv.bravia  # noqa: E402
+from tv.bravia import Bravia, BraviaError, BraviaUnavailable  # noqa: E402
+from tv.breaker import CircuitBreaker  # noqa: E402
+
+COMMAND_TIMEOUT = 0.2
+RESET_TIMEOUT = 0.5
+
+IRCC_RESPONSE = (
+    b'<?xml version="1.0"?>'
+    b'<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">'
+    b'<s:Body><u:X_SendIRCCResponse xmlns:u="urn:schemas-sony-com:service:IRCC:1"/></s:Body>'
+    b'</s:Envelope>')
+
+IRCC_FAULT = (
+    b'<?xml version="1.0"?>'
+    b'<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">'
+    b'<s:Body><s:Fault><faultcode>s:Client</faultcode><faultstring>UPnPError</faultstring>'
+    b'<detail><UPnPError xmlns="urn:schemas-upnp-org:control-1-0">'
+    b'<errorCode>800</errorCode><errorDescription>Not Supported</errorDescription>'
+    b'</UPnPError></detail></s:Fault></s:Body></s:Envelope>')
+
+
+class StubTV(object):
+    """What the stub does with the next requests: ok, delay, drop, reset or fault"""
+
+    def __init__(self):
+        self.mode = "ok"
+        self.failures = None  # Requests left to fail before answering again, None for all
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def next_action(self, method):
+        with self.lock:
+            self.requests.append(method)
+            if self.mode == "ok" or self.failures == 0:
+                return "ok"
+            if self.failures is not None:
+                self.failures -= 1
+            return self.mode
+
+
+def make_handler(stub):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            ircc = self.path.endswith("/IRCC")
+            request = None if ircc else json.loads(body)
+            action = stub.next_action("IRCC" if ircc else request["method"])
+
+            if action == "delay":
+                time.sleep(COMMAND_TIMEOUT * 3)
+            elif action == "drop":
+                self.close_connection = True
+                return
+            elif action == "reset":
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                self.close_connection = True
+                return
+
+            status = 200
+            if ircc:
+                data = IRCC_RESPONSE
+                if action == "fault":
+                    status, data = 500, IRCC_FAULT
+            elif action == "fault":
+                data = json.dumps({"id": request["id"], "error": [7, "Illegal State"]}).encode()
+            elif request["method"] == "getPowerStatus":
+                data = json.dumps({"id": request["id"], "result": [{"status": "active"}]}).encode()
+            elif request["method"] == "getRemoteControllerInfo":
+                data = json.dumps({"id": request["id"], "result": [
+                    {}, [{"name": "Display", "value": "AAAAAQAAAAEAAAA6Aw=="}]]}).encode()
+            else:
+                data = json.dumps({"id": request["id"], "result": [{}]}).encode()
+
+            try:
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            except OSError:
+                pass  # The client gave up waiting
+
+    return StubHandler
+
+
+def timed(func):
+    start = time.perf_counter()
+    try:
+        result, error = func(), None
+    except BraviaError as err:
+        result, error = None, err
+    return time.perf_counter() - start, result, error
+
+
+def scenario(name, stub, bravia, mode, calls, func, failures=None):
+    bravia._breaker = CircuitBreaker("TV", tv.bravia.BREAKER_THRESHOLD, RESET_TIMEOUT)
+    with stub.lock:
+        stub.mode, stub.failures = mode, failures
+        stub.requests.clear()
+    results = [timed(func) for _ in range(calls)]
+    with stub.lock:
+        stub.mode = "ok"
+        requests = len(stub.requests)
+    times = sorted(elapsed for elapsed, _, _ in results)
+    errors = [type(error).__name__ for _, _, error in results if error is not None]
+    print(f"{name:34} max {times[-1] * 1e3:7.1f} ms  p50 {times[len(times) // 2] * 1e3:7.2f} ms  "
+          f"{requests:3} requests  {len(errors):3} errors"
+          + (f" ({', '.join(sorted(set(errors)))})" if errors else ""))
+    return results, requests
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    tv.bravia.COMMAND_TIMEOUT = COMMAND_TIMEOUT
+    tv.bravia.CONNECT_TIMEOUT = COMMAND_TIMEOUT
+
+    stub = StubTV()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/sony".format(server.server_address[1])
+
+    bravia = Bravia(url, auth_psk="1234")
+    # Let the background refresh of the constructor finish first
+    deadline = time.monotonic() + 5
+    while "getContentList" not in stub.requests:
+        assert time.monotonic() < deadline, stub.requests
+        time.sleep(0.01)
+    with bravia._catalog_lock:
+        pass
+    bravia.refresh()
+
+    ircc = lambda: bravia.send_ircc_command("Display")  # noqa: E731
+    power = lambda: bravia.get_power_status()  # noqa: E731
+    bound = tv.bravia.CONNECT_TIMEOUT + COMMAND_TIMEOUT
+
+    results, requests = scenario("ok", stub, bravia, "ok", calls, ircc)
+    assert requests == calls and all(error is None for _, _, error in results)
+
+    for mode in ("delay", "drop", "reset"):
+        results, requests = scenario(f"{mode}, IRCC", stub, bravia, mode, calls, ircc)
+        assert all(isinstance(error, BraviaUnavailable) for _, _, error in results)
+        assert max(elapsed for elapsed, _, _ in results) < bound + 0.1
+        # The breaker stops sending after the threshold
+        assert requests == tv.bravia.BREAKER_THRESHOLD, requests
+
+    # One reset, the read is retried and succeeds, the command is not retried
+    results, requests = scenario("reset once, getPowerStatus", stub, bravia, "reset", 1, power, failures=1)
+    assert results[0][1] == "active" and requests == 2
+    results, requests = scenario("reset once, IRCC", stub, bravia, "reset", 1, ircc, failures=1)
+    assert isinstance(results[0][2], BraviaUnavailable) and requests == 1
+
+    # Errors of a reachable TV are not retried and do not open the breaker
+    results, requests = scenario("SOAP fault, IRCC", stub, bravia, "fault", calls, ircc)
+    assert all(error is not None and error.code == "800" and not isinstance(error, BraviaUnavailable)
+               for _, _, error in results)
+    assert requests == calls and not bravia._breaker.is_open
+
+    # The TV comes back, the first call after the reset timeout probes it
+    scenario("reset until breaker opens", stub, bravia, "reset", calls, ircc)
+    breaker = bravia._breaker
+    assert breaker.is_open
+    with stub.lock:
+        stub.requests.clear()
+    time.sleep(RESET_TIMEOUT)
+    assert timed(ircc)[2] is None and not breaker.is_open and len(stub.requests) == 1
+    print("TV back: one probe closed the breaker")
+
+    bravia.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Load test the Bravia client against the TV emulator
+
+Measures plain client throughput, then sends bursts of button presses
+through a CommandDispatcher like the service does and reports throughput,
+p50/p99 latency, dropped commands and errors. The emulator's volume is
+checked against the presses that succeeded, and the power notification
+channel is exercised at the end:
+
+    python3 benchmarks/bench_bravia_load.py [--latency lognormal:8:0.5]
+        [--error-rate 0.01] [--reset-rate 0.01] [--bursts 20] [--burst-size 10]
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tv.bravia import Bravia, POOL_SIZE  # noqa: E402
+from tv.dispatcher import CommandDispatcher, CommandDropped  # noqa: E402
+from tv.emulator import BraviaEmulator, parse_latency  # noqa: E402
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else 0.0
+
+
+def report(name, samples, wall, errors=0, dropped=0):
+    print(f"{name:24} {len(samples) / wall:8.1f} ops/s  p50 {percentile(samples, 0.5) * 1e3:7.2f} ms  "
+          f"p99 {percentile(samples, 0.99) * 1e3:7.2f} ms  {errors:3} errors  {dropped:3} dropped")
+
+
+def client_throughput(tv, calls, threads):
+    samples = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(count):
+        nonlocal errors
+        for _ in range(count):
+            start = time.perf_counter()
+            try:
+                tv.send_ircc_command("Display")
+            except Exception:
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                samples.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=worker, args=(calls // threads,)) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    report(f"client, {threads} thread(s)", samples, time.perf_counter() - start, errors)
+
+
+def bursts(tv, emulator, count, size, interval):
+    """Press VolumeUp `size` times every `interval` seconds, `count` times"""
+    dispatcher = CommandDispatcher().start()
+    samples = []
+    errors = dropped = 0
+    done = threading.Semaphore(0)
+    lock = threading.Lock()
+    volume = emulator.state.volume = 0
+
+    def submit():
+        start = time.perf_counter()
+
+        def on_done(result, error):
+            nonlocal errors, dropped
+            with lock:
+                if error is None:
+                    samples.append(time.perf_counter() - start)
+                elif isinstance(error, CommandDropped):
+                    dropped += 1
+                else:
+                    errors += 1
+            done.release()
+
+        dispatcher.submit(tv.send_ircc_command, "VolumeUp", callback=on_done)
+
+    start = time.perf_counter()
+    for _ in range(count):
+        for _ in range(size):
+            submit()
+            time.sleep(interval)
+        time.sleep(0.2)
+    for _ in range(count * size):
+        done.acquire()
+    wall = time.perf_counter() - start
+    dispatcher.stop()
+
+    report(f"bursts of {size}", samples, wall, errors, dropped)
+    # Errors injected by the emulator happen before the volume changes
+    assert emulator.state.volume == min(volume + len(samples), emulator.state.max_volume), \
+        (emulator.state.volume, volume, len(samples))
+    print(f"emulator volume {volume} -> {emulator.state.volume} matches the {len(samples)} presses that succeeded")
+
+
+def notifications(tv):
+    statuses = []
+    changed = threading.Event()
+    tv.add_power_listener(lambda status: (statuses.append(status), changed.set()))
+    tv.start_notifications()
+    deadline = time.monotonic() + 5
+    while not tv.has_power_notifications:
+        assert time.monotonic() < deadline, "no notification channel"
+        time.sleep(0.01)
+
+    for on in (False, True):
+        changed.clear()
+        # Bypass the client's optimistic update, only the TV may report the change
+        tv._call("system", "setPowerStatus", status=on)
+        assert changed.wait(5), statuses
+    tv.stop_notifications()
+    print(f"power notifications received: {statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", default="lognormal:8:0.5", help="see tv.emulator.parse_latency")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reset-rate", type=float, default=0.0)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--bursts", type=int, default=10)
+    parser.add_argument("--burst-size", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=20, help="ms between presses of a burst")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    emulator = BraviaEmulator(
+        latency=parse_latency(args.latency, random.Random(args.seed)),
+        error_rate=args.error_rate, reset_rate=args.reset_rate, seed=args.seed).start()
+    tv = Bravia(emulator.url, auth_psk=emulator.psk)
+    tv.refresh()
+
+    print(f"emulator latency {args.latency} ms, error rate {args.error_rate}, reset rate {args.reset_rate}")
+    client_throughput(tv, args.calls, 1)
+    client_throughput(tv, args.calls, POOL_SIZE)
+    bursts(tv, emulator, args.bursts, args.burst_size, args.interval / 1e3)
+    if not (args.error_rate or args.reset_rate):
+        notifications(tv)
+    print(f"emulator: {emulator.requests} requests, {emulator.errors} errors, {emulator.resets} resets")
+
+    tv.close()
+    emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Compare per-command round-trip time of one-shot requests vs the pooled Bravia session
+
+Runs against a local stub server, no TV needed. Reading the app and
+channel lists from the stub is checked first, and any warning logged by
+the client fails the run:
+
+    python3 benchmarks/bench_bravia_session.py [iterations]
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests  # noqa: E402
+
+from tv.bravia import Bravia, IRCC_ENVELOPE, IRCC_HEADERS  # noqa: E402
+
+
+IRCC_RESPONSE = (
+    b'<?xml version="1.0"?>'
+    b'<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+    b's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+    b'<s:Body><u:X_SendIRCCResponse xmlns:u="urn:schemas-sony-com:service:IRCC:1"/></s:Body>'
+    b'</s:Envelope>')
+
+# Lists are wrapped in another list, like a real TV answers them
+APPS = [[{"title": "Stub App", "uri": "com.example.stub", "icon": ""}]]
+CHANNELS = [[{"title": "Stub One", "uri": "tv:dvbt?trip=1.1.1&srvName=Stub One", "dispNum": "001", "index": 0,
+              "programMediaType": "tv"}]]
+
+
+class Warnings(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.endswith("/IRCC"):
+            data = IRCC_RESPONSE
+        else:
+            request = json.loads(body)
+            if request["method"] == "getSystemInformation":
+                result = [{"product": "TV", "name": "BRAVIA", "model": "STUB", "generation": "0", "serial": "0"}]
+            elif request["method"] == "getRemoteControllerInfo":
+                result = [{"bundled": True, "type": "RM-J1100"}, [{"name": "Display", "value": "AAAAAQAAAAEAAAA6Aw=="}]]
+            elif request["method"] == "getApplicationList":
+                result = APPS
+            elif request["method"] == "getContentList":
+                result = CHANNELS
+            else:
+                result = []
+            data = json.dumps({"id": request["id"], "result": result}).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def one_shot_ircc(url, psk, ircc_code):
+    """Previous behavior: a new connection per command"""
+    headers = dict(IRCC_HEADERS)
+    headers["X-Auth-PSK"] = psk
+    payload = IRCC_ENVELOPE.format(ircc_code=ircc_code)
+    requests.post(url + "/IRCC", headers=headers, data=payload)
+
+
+def measure(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples
+
+
+def report(name, samples):
+    avg = sum(samples) / len(samples)
+    p50 = samples[len(samples) // 2]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{name:<12} avg {avg * 1000:7.3f} ms  p50 {p50 * 1000:7.3f} ms  p99 {p99 * 1000:7.3f} ms")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    warnings = Warnings()
+    logging.getLogger("tv").addHandler(warnings)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/sony".format(server.server_address[1])
+
+    tv = Bravia(url, auth_psk="1234")
+    tv.refresh()
+    ircc_code = tv.remote_info["Display"]
+    # The client refreshes in the background too, wait for that one to finish
+    while not tv.refresh_catalog():
+        time.sleep(0.01)
+    assert tv.catalog.find("app", "stub")["uri"] == "com.example.stub"
+    assert tv.catalog.find("channel", "1")["title"] == "Stub One"
+
+    report("one-shot", measure(lambda: one_shot_ircc(url, "1234", ircc_code), iterations))
+    report("session", measure(lambda: tv.send_ircc_command("Display"), iterations))
+
+    tv.close()
+    server.shutdown()
+    if warnings.messages:
+        sys.exit("Warnings logged:\n" + "\n".join(warnings.messages))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Check the app/channel catalog against a stub TV whose lists change
+
+Refreshes the catalog from a local stub server, measures name lookups,
+then changes the stub's apps and channels and verifies that a refresh
+drops removed entries, picks up new ones and that a name the TV rejects
+triggers a refresh. Finally the catalog is loaded from the cache with the
+TV unreachable:
+
+    python3 benchmarks/bench_catalog.py [lookups]
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tv.bravia import Bravia, CONTENT_PAGE_SIZE  # noqa: E402
+from tv.catalog import Catalog  # noqa: E402
+
+
+class StubTV(object):
+    def __init__(self):
+        self.apps = {}
+        self.channels = []
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def handle(self, method, params):
+        with self.lock:
+            self.calls.append(method)
+            if method == "getSystemInformation":
+                return [{"product": "TV", "name": "BRAVIA", "model": "STUB", "generation": "0", "serial": "1"}]
+            if method == "getRemoteControllerInfo":
+                return [{"bundled": True, "type": "RM-J1100"}, []]
+            if method == "getApplicationList":
+                return [[{"title": title, "uri": uri, "icon": ""} for title, uri in self.apps.items()]]
+            if method == "getContentList":
+                start, count = params.get("stIdx", 0), params.get("cnt", 50)
+                page = self.channels[start:start + count]
+                return [[{"title": title, "uri": f"tv:dvbt?trip=1.2.{n}", "dispNum": f"{n:03d}", "index": n}
+                         for n, title in page]]
+            if method == "setActiveApp":
+                if params["uri"] not in self.apps.values():
+                    raise KeyError(params["uri"])
+                return []
+            if method == "setPlayContent":
+                return []
+            raise KeyError(method)
+
+
+def make_handler(tv):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            try:
+                reply = {"id": request["id"], "result": tv.handle(request["method"], request["params"][0])}
+            except KeyError:
+                reply = {"id": request["id"], "error": [3, "Illegal Argument"]}
+            data = json.dumps(reply).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return StubHandler
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def measure(catalog, kind, name, lookups):
+    catalog = Catalog.from_dict(catalog.to_dict())  # Nothing memoized yet
+    start = time.perf_counter()
+    catalog.find(kind, name)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(lookups):
+        catalog.find(kind, name)
+    return first, (time.perf_counter() - start) / lookups
+
+
+def main():
+    lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    tv = StubTV()
+    tv.apps = {f"App {n}": f"com.example.app{n}" for n in range(60)}
+    tv.apps.update({"Netflix": "com.netflix", "YouTube": "com.youtube", "Prime Video": "com.amazon"})
+    # More than one page of channels
+    tv.channels = [(n, f"Channel {n}") for n in range(1, CONTENT_PAGE_SIZE + 50)]
+    tv.channels[0] = (1, "BBC One")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(tv))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/sony".format(server.server_address[1])
+
+    tmpdir = tempfile.mkdtemp()
+    cache_file = os.path.join(tmpdir, "bravia.json")
+    try:
+        bravia = Bravia(url, "1234", cache_file=cache_file)
+        wait_for(lambda: len(bravia.catalog) == len(tv.apps) + len(tv.channels))
+        assert tv.calls.count("getContentList") == 2, tv.calls
+        catalog = bravia.catalog
+
+        for kind, name, expected in [
+                ("app", "Netflix", "com.netflix"),
+                ("app", "you", "com.youtube"),
+                ("app", "prime vidoe", "com.amazon"),
+                ("app", "com.netflix", "com.netflix"),
+                ("channel", "bbc one", "tv:dvbt?trip=1.2.1"),
+                ("channel", "1", "tv:dvbt?trip=1.2.1"),
+                ("channel", "Channel 220", "tv:dvbt?trip=1.2.220")]:
+            assert catalog.find(kind, name)["uri"] == expected, (name, catalog.find(kind, name))
+            first, cached = measure(catalog, kind, name, lookups)
+            print(f"{kind:8} {name!r:16} first {first * 1e6:8.1f} us  memoized {cached * 1e6:6.3f} us")
+
+        # Unchanged lists keep the index
+        assert bravia.refresh_catalog()
+        assert bravia.catalog is catalog
+
+        # Netflix is uninstalled, a new app appears and a channel is renamed
+        with tv.lock:
+            del tv.apps["Netflix"]
+            tv.apps["Disney+"] = "com.disney"
+            tv.channels[0] = (1, "BBC One HD")
+            del tv.channels[-10:]
+        assert bravia.refresh_catalog()
+        catalog = bravia.catalog
+        assert catalog.find("app", "com.netflix") is None
+        assert catalog.find("app", "disney")["uri"] == "com.disney"
+        assert catalog.find("channel", "BBC One HD")["uri"] == "tv:dvbt?trip=1.2.1"
+        assert len(catalog.entries("channel")) == len(tv.channels)
+        print("refresh after catalog change: removed entries dropped, new ones found")
+
+        # An entry the TV rejects triggers a refresh in the background
+        with tv.lock:
+            del tv.apps["YouTube"]
+        calls = tv.calls.count("getApplicationList")
+        try:
+            bravia.launch_app("YouTube")
+        except Exception as err:
+            print(f"launching a removed app fails: {err}")
+        else:
+            raise AssertionError("launching a removed app succeeded")
+        wait_for(lambda: bravia.catalog.find("app", "com.youtube") is None)
+        assert tv.calls.count("getApplicationList") == calls + 1
+        print("rejected entry refreshed the catalog")
+        bravia.close()
+
+        # Everything is resolved from the cache file with the TV gone
+        server.shutdown()
+        offline = Bravia(url, "1234", cache_file=cache_file)
+        assert offline.catalog.find("app", "disney")["uri"] == "com.disney"
+        assert offline.catalog.find("app", "com.youtube") is None
+        print("catalog loaded from the cache without the TV")
+        offline.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
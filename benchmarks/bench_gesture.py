@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Check gesture recognition and measure how close to the threshold long presses fire
+
+Scripted press sequences are run on a virtual clock to check taps, holds,
+double taps and chords. Long presses are then timed on the real event
+loop, and the per-event cost of the recognizer is measured:
+
+    python3 benchmarks/bench_gesture.py [long presses] [hold seconds]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from evdev import ecodes  # noqa: E402
+
+from eventloop import EventLoop  # noqa: E402
+from gesture import Chord, DoubleTap, GestureRecognizer, LongPress, Tap  # noqa: E402
+from tasks import Tasks  # noqa: E402
+
+A, B, C = ecodes.BTN_SOUTH, ecodes.BTN_EAST, ecodes.BTN_TL
+
+
+class VirtualClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+GESTURES = [
+    Tap(A, "tap A"),
+    LongPress(A, 0.5, "hold A"),
+    Tap(B, "tap B"),
+    DoubleTap(B, "double B"),
+    Chord([A, C], "chord A+C"),
+]
+
+# (seconds from the previous step, button, value), and the gestures expected
+SCRIPTS = [
+    ("short press is a tap", [(0, A, 1), (0.1, A, 0)], ["tap A"]),
+    ("long press is a hold, not a tap", [(0, A, 1), (0.6, A, 0)], ["hold A"]),
+    ("tap waits for the double tap window", [(0, B, 1), (0.1, B, 0), (0.5, None, None)], ["tap B"]),
+    ("two quick presses are a double tap", [(0, B, 1), (0.1, B, 0), (0.1, B, 1), (0.1, B, 0), (0.5, None, None)],
+     ["double B"]),
+    ("two slow presses are two taps", [(0, B, 1), (0.1, B, 0), (0.4, B, 1), (0.1, B, 0), (0.5, None, None)],
+     ["tap B", "tap B"]),
+    ("buttons pressed together are a chord", [(0, A, 1), (0.03, C, 1), (0.7, A, 0), (0, C, 0)], ["chord A+C"]),
+    ("buttons pressed apart are not", [(0, A, 1), (0.2, C, 1), (0.1, C, 0), (0, A, 0)], ["tap A"]),
+]
+
+
+def check_scripts():
+    for name, steps, expected in SCRIPTS:
+        clock = VirtualClock()
+        tasks = Tasks(clock=clock)
+        fired = []
+        recognizer = GestureRecognizer(tasks, lambda gesture: fired.append(gesture.action), GESTURES)
+        for delay, button, value in steps:
+            # Let the timers due in between fire at their own deadline
+            target = clock.now + delay
+            while tasks.timeout() is not None and clock.now + tasks.timeout() <= target:
+                clock.now += tasks.timeout()
+                tasks.do()
+            clock.now = target
+            if button is not None:
+                recognizer.on_key(button, value)
+        assert fired == expected, (name, fired, expected)
+        print(f"ok  {name}: {fired}")
+
+
+def measure_long_press(presses, duration):
+    loop = EventLoop()
+    tasks = loop.tasks
+    errors = []
+    pressed_at = {}
+
+    def on_gesture(gesture):
+        errors.append(tasks.clock() - (pressed_at["t"] + duration))
+        loop.stop()
+
+    recognizer = GestureRecognizer(tasks, on_gesture, [LongPress(ecodes.BTN_SELECT, duration, "hold")])
+    for _ in range(presses):
+        pressed_at["t"] = tasks.clock()
+        recognizer.on_key(ecodes.BTN_SELECT, 1)
+        loop.run()
+        recognizer.on_key(ecodes.BTN_SELECT, 0)
+    loop.close()
+
+    errors.sort()
+    print(f"{presses} long presses of {duration:.2f} s fired {errors[len(errors) // 2] * 1e3:.3f} ms "
+          f"(p50) / {errors[-1] * 1e3:.3f} ms (max) after the threshold")
+
+
+def measure_cost(events=200000):
+    tasks = Tasks()
+    recognizer = GestureRecognizer(tasks, lambda gesture: None, GESTURES)
+    for button, label in ((ecodes.BTN_DPAD_UP, "button without gestures"), (B, "button with tap/double tap")):
+        start = time.perf_counter()
+        for i in range(events // 2):
+            recognizer.on_key(button, 1)
+            recognizer.on_key(button, 0)
+        elapsed = time.perf_counter() - start
+        print(f"on_key, {label:28} {elapsed / events * 1e9:8.0f} ns/event")
+
+
+def main():
+    presses = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+
+    check_scripts()
+    measure_long_press(presses, duration)
+    measure_cost()
+
+
+if __name__ == "__main__":
+    main()
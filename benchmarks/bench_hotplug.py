@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Check the hotplug debouncing of GamepadMonitor and time a plug storm
+
+Scripted uevents from fake udev devices are fed through the monitor on a
+virtual clock, and the connect/disconnect callbacks that result are
+compared with the expected ones. The Gamepad and GamepadInfo classes are
+replaced so nothing is opened. Then a storm of uevents is timed:
+
+    python3 benchmarks/bench_hotplug.py [storm uevents]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import gamepad  # noqa: E402
+from gamepad import DEBOUNCE_DELAY, GamepadMonitor  # noqa: E402
+from tasks import Tasks  # noqa: E402
+
+PAD = "/sys/devices/pad0/input/input10/event10"
+OTHER = "/sys/devices/pad1/input/input11/event11"
+BROKEN = "/sys/devices/pad2/input/input12/event12"
+KEYBOARD = "/sys/devices/kbd/input/input3/event3"
+
+
+class VirtualClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDevice(object):
+    """The parts of pyudev.Device the monitor looks at"""
+
+    def __init__(self, sys_path, action, joystick=True, subsystem="input"):
+        self.sys_path = sys_path
+        self.action = action
+        self.subsystem = subsystem
+        self.device_node = "/dev/input/" + os.path.basename(sys_path)
+        # Like with the udev tag missing, a remove carries no properties
+        self.properties = {"ID_INPUT_JOYSTICK": "1"} if joystick and action != "remove" else {}
+
+
+class FakeInfo(object):
+    created = 0
+
+    def __init__(self, device):
+        FakeInfo.created += 1
+
+
+class FakeGamepad(object):
+    def __init__(self, device, info):
+        if device.sys_path == BROKEN:
+            raise OSError("No such device")
+        self.sys_path = device.sys_path
+
+
+# (seconds from the previous step, sys_path, action), and the callbacks expected
+SCRIPTS = [
+    ("add is reported after the window", [(0, PAD, "add")], ["+pad0"]),
+    ("duplicate adds connect once", [(0, PAD, "add"), (0.01, PAD, "add"), (0.02, PAD, "add")], ["+pad0"]),
+    ("remove of a device never reported is ignored", [(0, OTHER, "remove")], []),
+    ("add/remove inside the window is nothing", [(0, PAD, "add"), (0.02, PAD, "remove")], []),
+    ("remove/add of a device never reported is a connect", [(0, PAD, "add"), (0.02, PAD, "remove"),
+                                                            (0.01, PAD, "add")], ["+pad0"]),
+    ("add/remove/add of a connected pad is one reconnect",
+     [(0, PAD, "add"), (0.1, PAD, "add"), (0.01, PAD, "remove"), (0.01, PAD, "add"), (0.01, PAD, "remove"),
+      (0.01, PAD, "add")], ["+pad0", "-pad0", "+pad0"]),
+    ("remove/add/remove of a connected pad is one disconnect",
+     [(0, PAD, "add"), (0.1, PAD, "remove"), (0.01, PAD, "add"), (0.01, PAD, "remove")], ["+pad0", "-pad0"]),
+    ("two pads in one window", [(0, PAD, "add"), (0.01, OTHER, "add")], ["+pad0", "+pad1"]),
+    ("bursts apart are reported apart", [(0, PAD, "add"), (0.1, PAD, "remove"), (0.1, PAD, "add")],
+     ["+pad0", "-pad0", "+pad0"]),
+    ("a node that cannot be opened is skipped", [(0, BROKEN, "add")], []),
+    ("other input devices are ignored", [(0, KEYBOARD, "add")], []),
+]
+
+
+def run_script(steps, enumerated=()):
+    clock = VirtualClock()
+    tasks = Tasks(clock=clock)
+    calls = []
+    monitor = GamepadMonitor(lambda pad: calls.append("+" + pad.sys_path.split("/")[3]),
+                             lambda device: calls.append("-" + device.sys_path.split("/")[3]),
+                             tasks, use_tag=False)
+    for sys_path in enumerated:
+        monitor._connect(FakeDevice(sys_path, "add"))
+    for delay, sys_path, action in steps + [(1.0, None, None)]:
+        # Let the debounce timers due in between fire at their own deadline
+        target = clock.now + delay
+        while tasks.timeout() is not None and clock.now + tasks.timeout() <= target:
+            clock.now += tasks.timeout()
+            tasks.do()
+        clock.now = target
+        if sys_path is not None:
+            monitor._handle_device(FakeDevice(sys_path, action, joystick=sys_path != KEYBOARD))
+    return calls, monitor
+
+
+def check_scripts():
+    for name, steps, expected in SCRIPTS:
+        calls, _ = run_script(steps)
+        assert calls == expected, (name, calls, expected)
+        print(f"ok  {name}: {calls}")
+
+    # Startup enumeration races the add uevent of the same pad
+    calls, _ = run_script([(0, PAD, "add")], enumerated=[PAD])
+    assert calls == ["+pad0"], calls
+    print(f"ok  add racing the startup enumeration is dropped: {calls}")
+
+    # Reconnects reuse the udev metadata
+    FakeInfo.created = 0
+    calls, _ = run_script([(0, PAD, "add"), (0.1, PAD, "remove"), (0.1, PAD, "add"), (0.1, PAD, "remove"),
+                           (0.1, PAD, "add")])
+    assert calls == ["+pad0", "-pad0", "+pad0", "-pad0", "+pad0"] and FakeInfo.created == 1, \
+        (calls, FakeInfo.created)
+    print("ok  reconnects reuse the cached GamepadInfo")
+
+    # Battery uevents go straight through
+    changed = []
+    monitor = GamepadMonitor(None, None, Tasks(clock=VirtualClock()), on_battery_changed=changed.append,
+                             use_tag=False)
+    monitor._handle_device(FakeDevice("/sys/class/power_supply/ps-controller-battery", "change",
+                                      subsystem="power_supply"))
+    assert len(changed) == 1
+    print("ok  battery changes are reported right away")
+
+
+def measure_storm(uevents):
+    clock = VirtualClock()
+    tasks = Tasks(clock=clock)
+    calls = []
+    monitor = GamepadMonitor(lambda pad: calls.append("+"), lambda device: calls.append("-"), tasks, use_tag=False)
+    monitor._connect(FakeDevice(PAD, "add"))
+    devices = [FakeDevice(PAD, "remove" if i % 2 == 0 else "add") for i in range(uevents)]
+    start = time.perf_counter()
+    for device in devices:
+        monitor._handle_device(device)
+    elapsed = time.perf_counter() - start
+    clock.now += DEBOUNCE_DELAY
+    tasks.do()
+    print(f"{uevents} uevents in one window: {elapsed / uevents * 1e9:.0f} ns/uevent, "
+          f"reported as {''.join(calls[1:])}")
+
+
+def main():
+    uevents = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    gamepad.Gamepad = FakeGamepad
+    gamepad.GamepadInfo = FakeInfo
+
+    check_scripts()
+    measure_storm(uevents)
+
+
+if __name__ == "__main__":
+    main()
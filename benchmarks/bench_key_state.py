@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Per-event cost of is_pressed() with the EVIOCGKEY ioctl vs the tracked key state
+
+Creates a virtual gamepad through uinput, needs access to /dev/uinput:
+
+    sudo python3 benchmarks/bench_key_state.py [iterations]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pyudev  # noqa: E402
+from evdev import UInput, ecodes  # noqa: E402
+
+from gamepad import Gamepad  # noqa: E402
+
+
+KEYS = [ecodes.BTN_SOUTH, ecodes.BTN_EAST, ecodes.BTN_NORTH, ecodes.BTN_WEST,
+        ecodes.BTN_TR2, ecodes.BTN_SELECT, ecodes.BTN_START, ecodes.BTN_MODE]
+
+
+def measure(name, func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<16} {elapsed / iterations * 1e6:8.3f} us/event")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with UInput({ecodes.EV_KEY: KEYS}, name="bench-gamepad") as ui:
+        time.sleep(0.5)  # Let udev settle
+        udev_device = pyudev.Devices.from_device_file(pyudev.Context(), ui.device.path)
+        gamepad = Gamepad(udev_device)
+
+        ui.write(ecodes.EV_KEY, ecodes.BTN_TR2, 1)
+        ui.syn()
+        time.sleep(0.1)
+        list(gamepad.read())
+
+        device = gamepad._device
+
+        # One R2 check and the two long-press checks, as done for every event
+        def ioctl_per_event():
+            keys = device.active_keys()
+            ecodes.BTN_TR2 in keys
+            ecodes.BTN_SELECT in device.active_keys()
+            ecodes.BTN_MODE in device.active_keys()
+
+        def tracked_per_event():
+            gamepad.is_pressed(ecodes.BTN_TR2)
+            gamepad.is_pressed(ecodes.BTN_SELECT)
+            gamepad.is_pressed(ecodes.BTN_MODE)
+
+        assert gamepad.is_pressed(ecodes.BTN_TR2)
+        measure("EVIOCGKEY ioctl", ioctl_per_event, iterations)
+        measure("tracked state", tracked_per_event, iterations)
+
+
+if __name__ == "__main__":
+    main()
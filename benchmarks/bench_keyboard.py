@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Compare the cost of writing HID reports with open/close per report vs a persistent fd
+
+A temporary file stands in for /dev/hidg0:
+
+    python3 benchmarks/bench_keyboard.py [iterations]
+"""
+
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from keyboard import Keyboard  # noqa: E402
+
+
+def open_per_report(device_node, button=0, media_key=0, modifier=0):
+    """Previous behavior of Keyboard.press()"""
+    report = struct.pack(
+        Keyboard._EVENT_FORMAT, modifier, media_key, button, 0, 0, 0, 0, 0)
+    with open(device_node, 'rb+') as fd:
+        fd.write(report)
+        fd.flush()
+
+
+def measure(name, func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<16} {elapsed / iterations * 1e6:8.2f} us/press+release")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.NamedTemporaryFile() as tmp:
+        kbd = Keyboard(tmp.name)
+
+        def old_press_release():
+            open_per_report(tmp.name, Keyboard.KEY_UP)
+            open_per_report(tmp.name)
+
+        def new_press_release():
+            kbd.press(Keyboard.KEY_UP)
+            kbd.release()
+
+        measure("open per report", old_press_release, iterations // 2)
+        measure("persistent fd", new_press_release, iterations // 2)
+        kbd.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Measure macro latency with overlapping and one-by-one TV calls
+
+Runs a macro whose last REST steps are marked parallel against a fake TV
+whose calls take a fixed time, once with as many dispatcher workers as the
+service runs macros with and once with a single worker, which is what
+sending the calls one after the other costs. Also checks that the IRCC
+step never overlaps another call:
+
+    python3 benchmarks/bench_macro.py [TV latency ms] [runs]
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from eventloop import EventLoop  # noqa: E402
+from keymap import compile_macro  # noqa: E402
+from macro import MacroRunner  # noqa: E402
+from tv.bravia import MACRO_WORKERS  # noqa: E402
+from tv.dispatcher import CommandDispatcher  # noqa: E402
+
+MACRO = [
+    {"key": "KEY_ESC"},
+    {"delay": 0.05},
+    {"ircc": "Input"},
+    {"rest": "set_content", "params": {"uri": "extInput:hdmi?port=2"}},
+    {"rest": "set_audio_volume", "params": {"volume": 12}, "parallel": True},
+    {"rest": "set_active_app", "params": {"uri": "com.example.app"}, "parallel": True},
+    {"key": "KEY_RETURN", "hold": 0.1},
+]
+
+
+class SlowTV(object):
+    def __init__(self, latency):
+        self.latency = latency
+        self.active = []
+        self.max_active = 0
+        self.ircc_overlaps = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            with self._lock:
+                self.active.append(method)
+                self.max_active = max(self.max_active, len(self.active))
+                if len(self.active) > 1 and "send_ircc_command" in self.active:
+                    self.ircc_overlaps += 1
+            time.sleep(self.latency)
+            with self._lock:
+                self.active.remove(method)
+        return call
+
+
+def run(workers, latency, runs):
+    loop = EventLoop()
+    dispatcher = CommandDispatcher(max_depth=16, workers=workers).start()
+    tv = SlowTV(latency)
+    totals = []
+    keys = []
+    hold_error = 0.0
+    runner = MacroRunner(
+        loop, dispatcher, tv,
+        lambda action: keys.append(time.monotonic()),
+        lambda action: keys.append(time.monotonic()),
+        lambda name, seconds: totals.append(seconds))
+    macro = compile_macro("bench", MACRO)
+
+    for _ in range(runs):
+        keys.clear()
+        run = runner.run(macro)
+        while runner.is_running("bench"):
+            loop.run_once()
+        assert run.error is None
+        # Press and release of the last key, which is held for 100 ms
+        hold_error = max(hold_error, abs((keys[3] - keys[2]) - 0.1))
+
+    dispatcher.stop()
+    loop.close()
+    assert not tv.ircc_overlaps, "IRCC call overlapped another"
+    return totals, tv.max_active, hold_error
+
+
+def main():
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.03
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    for workers in (MACRO_WORKERS, 1):
+        totals, overlap, hold_error = run(workers, latency, runs)
+        totals.sort()
+        print(f"{workers} worker(s): macro p50 {totals[len(totals) // 2] * 1e3:7.1f} ms  "
+              f"max {totals[-1] * 1e3:7.1f} ms  {overlap} calls in flight  "
+              f"hold error {hold_error * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Drive several uinput virtual gamepads through one Application
+
+Checks that every gamepad keeps its own key and modifier state, and
+reports the CPU cost per event as gamepads are added. Needs access to
+/dev/uinput:
+
+    sudo python3 benchmarks/bench_multi_gamepad.py [max gamepads (1-4)] [rounds]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pyudev  # noqa: E402
+from evdev import UInput, ecodes  # noqa: E402
+
+from bench_replay import ImmediateDispatcher, RecordingKeyboard  # noqa: E402
+from eventloop import EventLoop  # noqa: E402
+from gamepad import Gamepad  # noqa: E402
+from keyboard import Keyboard  # noqa: E402
+from main import Application  # noqa: E402
+
+
+BUTTONS = [ecodes.BTN_DPAD_UP, ecodes.BTN_DPAD_DOWN, ecodes.BTN_DPAD_LEFT, ecodes.BTN_DPAD_RIGHT,
+           ecodes.BTN_SOUTH, ecodes.BTN_EAST, ecodes.BTN_NORTH, ecodes.BTN_WEST,
+           ecodes.BTN_TL, ecodes.BTN_TR2, ecodes.BTN_SELECT, ecodes.BTN_START, ecodes.BTN_MODE]
+
+
+def create_gamepads(count):
+    devices = [UInput({ecodes.EV_KEY: BUTTONS}, name=f"virtual-gamepad-{i}") for i in range(count)]
+    time.sleep(0.5)  # Let udev settle
+    context = pyudev.Context()
+    gamepads = [Gamepad(pyudev.Devices.from_device_file(context, ui.device.path)) for ui in devices]
+    return devices, gamepads
+
+
+def press(ui, code, value):
+    ui.write(ecodes.EV_KEY, code, value)
+    ui.syn()
+
+
+def run_until(loop, predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    task = loop.tasks.call_later(timeout, lambda: None)  # Bounds the select() timeout
+    while not predicate() and time.monotonic() < deadline:
+        loop.run_once()
+    task.cancel()
+    return predicate()
+
+
+def make_app():
+    loop = EventLoop()
+    kbd = RecordingKeyboard(time.monotonic)
+    app = Application(kbd=kbd, loop=loop, tv_queue=ImmediateDispatcher())
+    return app, loop, kbd
+
+
+def check_isolation():
+    """R2 held on one gamepad must not change the layer of another"""
+    app, loop, kbd = make_app()
+    devices, gamepads = create_gamepads(2)
+    try:
+        for gamepad in gamepads:
+            app.on_gamepad_connected(gamepad)
+
+        press(devices[0], ecodes.BTN_TR2, 1)
+        press(devices[1], ecodes.BTN_DPAD_UP, 1)
+        press(devices[0], ecodes.BTN_DPAD_UP, 1)
+        run_until(loop, lambda: len(kbd.output) >= 2)
+
+        # Slots 2-7 of the last report hold the keyboard keys
+        held = set(bytes.fromhex(kbd.output[-1][2])[2:]) - {0}
+        ok = held == {Keyboard.KEY_UP, Keyboard.KEY_VOLUME_UP}
+        print(f"isolation: {'OK' if ok else 'FAILED'} {[entry[2] for entry in kbd.output]}")
+        return ok
+    finally:
+        for ui in devices:
+            ui.close()
+        loop.close()
+
+
+def measure(count, rounds):
+    app, loop, kbd = make_app()
+    devices, gamepads = create_gamepads(count)
+    try:
+        for gamepad in gamepads:
+            app.on_gamepad_connected(gamepad)
+
+        events = 0
+        cpu_start = time.process_time()
+        for n in range(rounds):
+            for value in (1, 0):
+                before = len(kbd.output)
+                # Each gamepad uses a different D-Pad key so each changes the report
+                for i, ui in enumerate(devices):
+                    press(ui, BUTTONS[i], value)
+                events += 2 * count  # Key event and SYN_REPORT
+                # Every gamepad changes the shared report once
+                if not run_until(loop, lambda: len(kbd.output) >= before + count):
+                    print("Timed out waiting for reports")
+                    return
+        cpu = time.process_time() - cpu_start
+        print(f"{count} gamepads: {cpu / events * 1e6:7.2f} us CPU/event ({events} events)")
+    finally:
+        for ui in devices:
+            ui.close()
+        loop.close()
+
+
+def main():
+    max_count = min(int(sys.argv[1]) if len(sys.argv) > 1 else 4, 4)
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    ok = check_isolation()
+    count = 1
+    while count <= max_count:
+        measure(count, rounds)
+        count *= 2
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
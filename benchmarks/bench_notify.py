@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Check the power notification channel against a scripted stub server
+
+Each connection the notifier opens is served by the next script: subscribe
+and push notifications between malformed messages, close the channel, stop
+answering pings, and finally refuse the power notification. Checks that
+the right callbacks run, that the notifier survives bad messages, and how
+long it takes to notice a dead channel and reconnect:
+
+    python3 benchmarks/bench_notify.py [keepalive seconds]
+"""
+
+import base64
+import hashlib
+import json
+import os
+import queue
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tv.emulator import NotificationSocket  # noqa: E402
+from tv.notify import WS_GUID, PowerNotifier  # noqa: E402
+
+
+class StubConnection(object):
+    """Server side of one notification WebSocket"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+        self.wfile = sock.makefile("wb")
+        key = None
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            if name.lower() == "sec-websocket-key":
+                key = value.strip()
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        self.wfile.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                          f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        self.wfile.flush()
+        self.ws = NotificationSocket(self)
+
+    def recv_json(self):
+        """Next text message, pings are answered on the way"""
+        while True:
+            opcode, payload = self.ws.recv()
+            if opcode == 0x1:
+                return json.loads(payload)
+            if opcode == 0x8:
+                raise ConnectionError("client closed the channel")
+
+    def subscribe(self, enabled):
+        request = self.recv_json()
+        assert request["method"] == "switchNotifications", request
+        wanted = [n["name"] for n in request["params"][0]["enabled"]]
+        self.send({"id": request["id"], "result": [{
+            "enabled": [{"name": name, "version": "1.0"} for name in wanted if name in enabled]}]})
+        return wanted
+
+    def send(self, message):
+        self.ws.send(message if isinstance(message, str) else json.dumps(message))
+
+    def close(self):
+        self.ws.close()
+        self.sock.close()
+
+
+def power(status):
+    return {"method": "notifyPowerStatus", "params": [{"status": status}], "version": "1.0"}
+
+
+MALFORMED = [
+    "not json",
+    "[1, 2]",
+    '"text"',
+    json.dumps({"method": "notifyPowerStatus", "params": []}),
+    json.dumps({"method": "notifyPowerStatus", "params": [{}]}),
+    json.dumps({"method": "notifyVolumeInformation", "params": None}),
+]
+
+
+def main():
+    keepalive = float(sys.argv[1]) if len(sys.argv) > 1 else 0.2
+
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(4)
+    server.settimeout(10)
+    url = "http://127.0.0.1:{}/sony".format(server.getsockname()[1])
+
+    statuses = queue.Queue()
+    volumes = queue.Queue()
+    notifier = PowerNotifier(url, "1234", statuses.put, keepalive=keepalive, on_volume=volumes.put)
+    notifier.start()
+
+    def accept():
+        conn, _ = server.accept()
+        return StubConnection(conn)
+
+    # Subscribe, survive malformed messages between the good ones
+    conn = accept()
+    wanted = conn.subscribe({"notifyPowerStatus", "notifyVolumeInformation"})
+    assert wanted == ["notifyPowerStatus", "notifyVolumeInformation"], wanted
+    for message in MALFORMED:
+        conn.send(message)
+    conn.send(power("standby"))
+    conn.send({"method": "notifyVolumeInformation", "params": [{"target": "speaker", "volume": 7}],
+               "version": "1.0"})
+    assert statuses.get(timeout=5) == "standby"
+    assert volumes.get(timeout=5)["volume"] == 7
+    assert notifier.connected and notifier.volume_enabled
+    print(f"subscribed, {len(MALFORMED)} malformed messages skipped, notifications delivered")
+
+    # The TV closes the channel, the notifier comes back
+    start = time.monotonic()
+    conn.close()
+    conn = accept()
+    print(f"reconnected {(time.monotonic() - start) * 1e3:.0f} ms after the channel was closed")
+    conn.subscribe({"notifyPowerStatus"})
+    conn.send(power("active"))
+    assert statuses.get(timeout=5) == "active"
+    assert not notifier.volume_enabled
+
+    # The TV stops answering: no pong within keepalive after the ping
+    start = time.monotonic()
+    opcode, _ = conn.ws.recv()
+    assert opcode == 0x9, opcode
+    pinged = time.monotonic() - start
+    stale = conn
+    conn = accept()
+    detected = time.monotonic() - start
+    stale.close()
+    print(f"ping after {pinged * 1e3:.0f} ms idle, dead channel replaced after {detected * 1e3:.0f} ms "
+          f"(keepalive {keepalive * 1e3:.0f} ms)")
+    assert detected < 2 * keepalive + 1.5, detected  # Plus the reconnect backoff
+
+    # A TV without power notifications ends the thread
+    conn.subscribe(set())
+    notifier._thread.join(5)
+    assert not notifier._thread.is_alive() and not notifier.supported
+    conn.close()
+    server.close()
+    print("unsupported notifications stop the notifier")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Measure auto-repeat timing against a fake HID node
+
+Holds a key for a few seconds in the real event loop and compares the
+time every repeat report was written with its ideal schedule. Exits with
+an error when the p99 jitter exceeds the limit:
+
+    python3 benchmarks/bench_repeat.py [hold seconds] [max p99 jitter ms]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from eventloop import EventLoop  # noqa: E402
+from keyboard import Keyboard  # noqa: E402
+from keymap import KeyAction  # noqa: E402
+from repeat import AutoRepeat, RepeatConfig  # noqa: E402
+
+
+class TimedKeyboard(Keyboard):
+    def __init__(self, device_node):
+        super().__init__(device_node)
+        self.writes = []
+
+    def write(self, report):
+        super().write(report)
+        self.writes.append((time.monotonic(), report))
+
+
+def ideal_schedule(start, config, until):
+    deadline = start + config.delay
+    first = deadline
+    schedule = []
+    while deadline <= until:
+        schedule.append(deadline)
+        deadline += config.interval(deadline - first)
+    return schedule
+
+
+def main():
+    hold = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    max_jitter = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.005
+
+    config = RepeatConfig(delay=0.4, rate=8, max_rate=25, accel_time=2.0)
+    action = KeyAction(Keyboard.KEY_DOWN, repeat=config)
+
+    with tempfile.NamedTemporaryFile() as node:
+        kbd = TimedKeyboard(node.name)
+        loop = EventLoop()
+
+        def emit(action):
+            kbd.release()
+            kbd.press(action.button, action.media_key, action.modifier)
+
+        repeat = AutoRepeat(loop.tasks, loop.tasks.clock, emit)
+        start = loop.tasks.clock()
+        kbd.press(action.button, action.media_key, action.modifier)
+        repeat.start("key", action, config)
+        loop.tasks.call_later(hold, loop.stop)
+        loop.run()
+        repeat.stop_all()
+        loop.close()
+        kbd.close()
+
+    # Each repeat is a release/press pair, the press marks the repeat time
+    press = kbd.report(Keyboard.KEY_DOWN)
+    actual = [ts for ts, report in kbd.writes[1:] if report == press]
+    expected = ideal_schedule(start, config, start + hold)
+
+    # The last repeat may race with the end of the hold
+    if abs(len(actual) - len(expected)) > 1:
+        print(f"Expected {len(expected)} repeats, got {len(actual)}")
+        sys.exit(1)
+
+    jitter = sorted(abs(a - e) for a, e in zip(actual, expected))
+    p50 = jitter[len(jitter) // 2]
+    p99 = jitter[min(len(jitter) - 1, int(len(jitter) * 0.99))]
+    print(f"{len(actual)} repeats in {hold:.1f} s  jitter p50 {p50 * 1000:.3f} ms  "
+          f"p99 {p99 * 1000:.3f} ms  max {jitter[-1] * 1000:.3f} ms")
+
+    if p99 > max_jitter:
+        print(f"FAIL: p99 jitter above {max_jitter * 1000:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Replay gamepad traces through Application and measure throughput
+
+Keyboard and Bravia are replaced by recording stand-ins, so no controller,
+USB gadget or TV is needed:
+
+    python3 benchmarks/bench_replay.py [--trace FILE] [--realtime] [--repeat N]
+                                       [--save-output FILE] [--check FILE]
+
+Without --trace a synthetic, seeded trace is generated. As fast as possible
+replay runs the scheduler on a virtual clock, so long presses fire at the
+same point in the stream as they would in real time.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from evdev import InputEvent, ecodes  # noqa: E402
+
+from eventloop import EventLoop  # noqa: E402
+from gamepad.trace import ReplayGamepad, read_trace, split_frames  # noqa: E402
+from keyboard import Keyboard  # noqa: E402
+from main import Application  # noqa: E402
+from tasks import Tasks  # noqa: E402
+
+
+class VirtualClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingKeyboard(Keyboard):
+    def __init__(self, clock):
+        super().__init__(device_node=None)
+        self.clock = clock
+        self.output = []
+
+    def write(self, report):
+        self.output.append((self.clock(), "hid", report.hex()))
+        self._last_report = report
+
+
+class RecordingTV(object):
+    def __init__(self, clock, output):
+        self.clock = clock
+        self.output = output
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            self.output.append((self.clock(), "tv", method, list(args), kwargs))
+            return "active" if method == "get_power_status" else None
+        return call
+
+    def invoke(self, method, *args, **kwargs):
+        return getattr(self, method)(*args, **kwargs)
+
+
+class ImmediateDispatcher(object):
+    def start(self):
+        return self
+
+    def stop(self, timeout=None):
+        pass
+
+    def submit(self, func, *args, deadline=None, callback=None, **kwargs):
+        result = func(*args, **kwargs)
+        if callback is not None:
+            callback(result, None)
+
+
+class ReplayLoop(EventLoop):
+    """Runs callbacks from the dispatchers right away, they all complete inline"""
+
+    def call_soon_threadsafe(self, func, *args):
+        func(*args)
+
+
+def synthetic_trace(frames=20000, seed=1):
+    buttons = [ecodes.BTN_DPAD_UP, ecodes.BTN_DPAD_DOWN, ecodes.BTN_DPAD_LEFT, ecodes.BTN_DPAD_RIGHT,
+               ecodes.BTN_SOUTH, ecodes.BTN_EAST, ecodes.BTN_NORTH, ecodes.BTN_WEST,
+               ecodes.BTN_TL, ecodes.BTN_START]
+    rnd = random.Random(seed)
+    ts = 1_000_000.0
+    events = []
+
+    def frame(*keys):
+        for code, value in keys:
+            sec = int(ts)
+            events.append(InputEvent(sec, int((ts - sec) * 1e6), ecodes.EV_KEY, code, value))
+        sec = int(ts)
+        events.append(InputEvent(sec, int((ts - sec) * 1e6), ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+
+    while len(events) < frames * 2:
+        choice = rnd.random()
+        if choice < 0.01:
+            # Long press SELECT twice, lock and unlock
+            for _ in range(2):
+                frame((ecodes.BTN_SELECT, 1))
+                ts += 1.2
+                frame((ecodes.BTN_SELECT, 0))
+                ts += 0.3
+        elif choice < 0.2:
+            button = rnd.choice(buttons)
+            frame((ecodes.BTN_TR2, 1))
+            ts += 0.05
+            frame((button, 1))
+            ts += rnd.uniform(0.05, 0.2)
+            frame((button, 0))
+            ts += 0.05
+            frame((ecodes.BTN_TR2, 0))
+        else:
+            button = rnd.choice(buttons)
+            frame((button, 1))
+            ts += rnd.uniform(0.03, 0.2)
+            frame((button, 0))
+        ts += rnd.uniform(0.05, 0.5)
+
+    return events
+
+
+def replay(events, realtime=False):
+    clock = time.monotonic if realtime else VirtualClock()
+    kbd = RecordingKeyboard(clock)
+    tv = RecordingTV(clock, kbd.output)
+    loop = ReplayLoop(Tasks(clock=clock))
+    app = Application(tv=tv, kbd=kbd, loop=loop, tv_queue=ImmediateDispatcher(),
+                      macro_queue=ImmediateDispatcher())
+
+    gamepad = ReplayGamepad()
+    pad = app.on_gamepad_connected(gamepad)
+
+    frames = list(split_frames(events))
+    t0 = events[0].timestamp()
+    start = clock()
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    for frame in frames:
+        offset = frame[-1].timestamp() - t0
+        if realtime:
+            target = start + offset
+            while True:
+                now = time.monotonic()
+                if now >= target:
+                    break
+                timeout = loop.tasks.timeout()
+                time.sleep(min(target - now, timeout if timeout is not None else target - now))
+                loop.tasks.do()
+        else:
+            clock.now = start + offset
+        loop.tasks.do()
+        gamepad.feed(frame)
+        app.on_gamepad_readable(pad)
+
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    app.on_gamepad_disconnected(None)
+    loop.close()
+    gamepad.close()
+    return kbd.output, wall, cpu
+
+
+def output_digest(output):
+    # Timestamps are left out so real time and fast replays compare equal
+    content = json.dumps([entry[1:] for entry in output], sort_keys=True)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trace", help="trace recorded with `python3 -m gamepad.trace record`")
+    parser.add_argument("--realtime", action="store_true", help="replay at the original speed")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save-output", help="write the produced HID/TV output as JSON")
+    parser.add_argument("--check", help="compare the produced output with a saved JSON file")
+    args = parser.parse_args()
+
+    events = read_trace(args.trace) if args.trace else synthetic_trace()
+    key_events = sum(1 for e in events if e.type == ecodes.EV_KEY)
+    print(f"{len(events)} events ({key_events} key events)")
+
+    for i in range(1 if args.realtime else args.repeat):
+        output, wall, cpu = replay(events, realtime=args.realtime)
+        print(f"run {i + 1}: {len(events) / wall:10.0f} events/s  "
+              f"{cpu / len(events) * 1e6:7.2f} us CPU/event  "
+              f"{len(output)} outputs  digest {output_digest(output)[:12]}")
+
+    if args.save_output:
+        with open(args.save_output, "w") as fp:
+            json.dump([entry[1:] for entry in output], fp)
+
+    if args.check:
+        with open(args.check) as fp:
+            expected = json.load(fp)
+        actual = json.loads(json.dumps([entry[1:] for entry in output]))
+        if actual != expected:
+            for n, (a, e) in enumerate(zip(actual, expected)):
+                if a != e:
+                    print(f"Output differs at #{n}: {a} != {e}")
+                    break
+            else:
+                print(f"Output length differs: {len(actual)} != {len(expected)}")
+            sys.exit(1)
+        print("Output matches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Measure service startup: import time and time to the first HID report
+
+Starts the service in a child process with a gamepad whose button is
+already pressed and times, from the moment the process was spawned, when
+the imports are done, when the first keyboard report is written and when
+the deferred initialization (dispatchers, control socket, TV client) has
+finished. The same is measured with everything set up before the loop
+runs, which is how the service used to start. The TV is unreachable and
+the keyboard writes to nothing, so no hardware is needed:
+
+    python3 benchmarks/bench_startup.py [runs]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+PHASES = ("interpreter", "imports", "application", "first report", "initialized")
+IMPORT_TOP = 8
+
+
+def child(spawned, eager, tmpdir):
+    marks = {"interpreter": time.monotonic() - spawned}
+    if eager:
+        import requests  # noqa: F401
+
+    from evdev import InputEvent, ecodes
+
+    import main as service
+    from gamepad.trace import ReplayGamepad
+    from keyboard import Keyboard
+    from tv.bravia import Bravia
+    marks["imports"] = time.monotonic() - spawned
+
+    class PipeGamepad(ReplayGamepad):
+        """Makes its fd readable for every fed frame, like an input device"""
+
+        def feed(self, events):
+            super().feed(events)
+            os.write(self._pipe_w, b"\0")
+
+        def read(self):
+            os.read(self._pipe_r, 1)
+            yield from super().read()
+
+    def mark(name):
+        marks.setdefault(name, time.monotonic() - spawned)
+        if "first report" in marks and "initialized" in marks:
+            app.stop(None, None)
+
+    class FirstReportKeyboard(Keyboard):
+        def __init__(self):
+            super().__init__(device_node=None)
+
+        def write(self, report):
+            self._last_report = report
+            mark("first report")
+
+    service.CONTROL_SOCKET = os.path.join(tmpdir, "control.sock")
+    tvs = []
+
+    def tv_factory():
+        tv = Bravia("http://127.0.0.1:9/sony", "1234", cache_file=os.path.join(tmpdir, "bravia.json"))
+        tvs.append(tv)
+        return tv
+
+    app = service.Application(kbd=FirstReportKeyboard(), tv_factory=tv_factory)
+    marks["application"] = time.monotonic() - spawned
+
+    gamepad = PipeGamepad()
+    pad = app.on_gamepad_connected(gamepad)
+    ts = time.time()
+    sec, usec = int(ts), int((ts - int(ts)) * 1e6)
+    gamepad.feed([InputEvent(sec, usec, ecodes.EV_KEY, ecodes.BTN_DPAD_UP, 1),
+                  InputEvent(sec, usec, ecodes.EV_SYN, ecodes.SYN_REPORT, 0)])
+
+    start_deferred = app.start_deferred
+
+    def deferred():
+        start_deferred()
+        mark("initialized")
+
+    if eager:
+        deferred()
+        app.start_deferred = lambda: None
+    else:
+        app.start_deferred = deferred
+    app.start()
+
+    app.on_gamepad_disconnected(pad.gamepad._udev_device)
+    for tv in tvs:
+        tv.close()
+    print(json.dumps(marks))
+
+
+def run_child(eager):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        args = [sys.executable, os.path.abspath(__file__), "--child", repr(time.monotonic()),
+                "eager" if eager else "deferred", tmpdir]
+        proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=30)
+    if proc.returncode != 0:
+        sys.exit(proc.stderr)
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def import_times(runs):
+    """Cumulative import time of `main` and of its slowest imports, best of `runs`"""
+    best = {}
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                              cwd=root, stderr=subprocess.PIPE, text=True, check=True)
+        # Imports are listed before the module importing them, the direct
+        # imports of main are the ones one level deep right before it
+        children = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            name, ms = name.strip(), int(cumulative) / 1e3
+            if depth == 1:
+                children.append((name, ms))
+            elif depth == 0:
+                if name == "main":
+                    for child_name, child_ms in children + [(name, ms)]:
+                        best[child_name] = min(best.get(child_name, float("inf")), child_ms)
+                children = []
+    return best
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(float(sys.argv[2]), sys.argv[3] == "eager", sys.argv[4])
+        return
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    times = import_times(runs)
+    print(f"import main: {times.pop('main'):6.1f} ms, slowest direct imports:")
+    for name, ms in sorted(times.items(), key=lambda item: -item[1])[:IMPORT_TOP]:
+        print(f"  {name:24} {ms:6.1f} ms")
+
+    print("\nms after spawn (median of {})  ".format(runs) + "".join(f"{p:>14}" for p in PHASES))
+    for eager in (False, True):
+        results = [run_child(eager) for _ in range(runs)]
+        medians = [sorted(r[p] for r in results)[runs // 2] * 1e3 for p in PHASES]
+        print(f"{'eager' if eager else 'deferred':30}" + "".join(f"{m:14.1f}" for m in medians))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Compare volume presses sent one by one with coalesced absolute calls
+
+A burst of presses is sent to the TV emulator twice: as one IRCC
+VolumeUp/VolumeDown per press, the way the R2 bindings used to work, and
+through a VolumeController that sums the presses and sets the level with
+setAudioVolume. Reports round trips and the time until the TV reached the
+final level, then checks the key fallback while the TV is unreachable:
+
+    python3 benchmarks/bench_volume.py [--latency lognormal:100:0.3] [--presses 10] [--interval 30]
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from eventloop import EventLoop  # noqa: E402
+from tv.bravia import Bravia  # noqa: E402
+from tv.dispatcher import CommandDispatcher  # noqa: E402
+from tv.emulator import REMOTE_CODES, BraviaEmulator, parse_latency  # noqa: E402
+from volume import VolumeController  # noqa: E402
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def ircc_presses(tv, emulator, presses, interval, steps):
+    dispatcher = CommandDispatcher().start()
+    start_volume = emulator.state.volume
+    start_requests = emulator.requests
+    target = start_volume + presses * steps
+    start = time.perf_counter()
+    for _ in range(presses):
+        dispatcher.submit(tv.send_ircc_command, "VolumeUp" if steps > 0 else "VolumeDown")
+        time.sleep(interval)
+    wait_for(lambda: emulator.state.volume == target)
+    elapsed = time.perf_counter() - start
+    dispatcher.stop()
+    print(f"IRCC per press       {emulator.requests - start_requests:3} requests  "
+          f"{start_volume} -> {emulator.state.volume} in {elapsed * 1e3:7.1f} ms")
+
+
+def coalesced_presses(tv, emulator, presses, interval, steps):
+    loop = EventLoop()
+    dispatcher = CommandDispatcher().start()
+    fallback = []
+    volume = VolumeController(loop, dispatcher, tv, fallback.append)
+    thread = threading.Thread(target=loop.run)
+    thread.start()
+
+    start_volume = emulator.state.volume
+    start_requests = emulator.requests
+    target = start_volume + presses * steps
+    start = time.perf_counter()
+    for _ in range(presses):
+        loop.call_soon_threadsafe(volume.change, steps)
+        time.sleep(interval)
+    wait_for(lambda: emulator.state.volume == target)
+    elapsed = time.perf_counter() - start
+    wait_for(lambda: volume.volume == target)
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    dispatcher.stop()
+    assert not fallback, fallback
+    print(f"coalesced            {emulator.requests - start_requests:3} requests  "
+          f"{start_volume} -> {emulator.state.volume} in {elapsed * 1e3:7.1f} ms  ({volume.calls} calls)")
+
+
+def fallback_when_unavailable(presses):
+    # Nothing listens on the port, the breaker opens after the first calls
+    tv = Bravia("http://127.0.0.1:9", auth_psk="1234")
+    for _ in range(3):
+        try:
+            tv.get_volume_information()
+        except Exception:
+            pass
+    assert not tv.is_available
+
+    loop = EventLoop()
+    dispatcher = CommandDispatcher().start()
+    fallback = []
+    volume = VolumeController(loop, dispatcher, tv, fallback.append)
+    for _ in range(presses):
+        volume.change(1)
+    dispatcher.stop()
+    loop.close()
+    tv.close()
+    assert fallback == [1] * presses and volume.calls == 0, (fallback, volume.calls)
+    print(f"TV unavailable: {presses} presses went to the key fallback without a call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", default="lognormal:100:0.3", help="see tv.emulator.parse_latency")
+    parser.add_argument("--presses", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=30, help="ms between presses")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    emulator = BraviaEmulator(latency=parse_latency(args.latency, random.Random(args.seed)), seed=args.seed).start()
+    emulator.state.volume = 20
+    tv = Bravia(emulator.url, auth_psk=emulator.psk)
+    tv.refresh()
+    tv.start_notifications()
+    wait_for(lambda: tv.has_power_notifications)
+
+    print(f"emulator latency {args.latency} ms, {args.presses} presses {args.interval:.0f} ms apart")
+    ircc_presses(tv, emulator, args.presses, args.interval / 1e3, 1)
+    coalesced_presses(tv, emulator, args.presses, args.interval / 1e3, -1)
+    ircc_presses(tv, emulator, args.presses, args.interval / 1e3, -1)
+    coalesced_presses(tv, emulator, args.presses, args.interval / 1e3, 1)
+
+    # Volume changed by keys is reported by the TV, the cache follows it
+    emulator.ircc(REMOTE_CODES["VolumeUp"])
+    wait_for(lambda: tv.get_volume_information(max_age=60)["volume"] == emulator.state.volume, 5)
+    print(f"volume notification kept the cache at {emulator.state.volume}")
+
+    tv.stop_notifications()
+    tv.close()
+    emulator.stop()
+    fallback_when_unavailable(args.presses)
+
+
+if __name__ == "__main__":
+    main()
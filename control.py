@@ -0,0 +1,120 @@
+import logging
+import os
+import socket
+
+log = logging.getLogger("control")
+
+# Idle connections are closed after this many seconds
+CONNECTION_TIMEOUT = 5.0
+MAX_LINE = 1024
+
+
+class ControlServer(object):
+    """Local Unix socket to query and control the running service
+
+    Each connection sends a single command line and receives a text reply,
+    e.g. `echo stats | socat - UNIX-CONNECT:/run/gamepad-remote.sock`.
+    The socket and the accepted connections are serviced from the main
+    event loop without blocking it, a slow client only holds its own
+    connection.
+    """
+
+    def __init__(self, path, loop):
+        self.path = path
+        self._loop = loop
+        self._commands = {}
+        self._sock = None
+        self._connections = {}
+
+    def add_command(self, name, handler, help=""):
+        """`handler(*args)` returns the reply text"""
+        self._commands[name] = (handler, help)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self._sock.listen(4)
+        self._sock.setblocking(False)
+        log.info(f"Listening on {self.path}")
+        return self
+
+    def close(self):
+        for conn in list(self._connections):
+            self._close_connection(conn)
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def _help(self):
+        return "".join(
+            f"{name:<12} {help}\n" for name, (_, help) in sorted(self._commands.items()))
+
+    def execute(self, line):
+        words = line.split()
+        if not words or words[0] == "help":
+            return self._help()
+        handler, _ = self._commands.get(words[0], (None, None))
+        if handler is None:
+            return f"Unknown command '{words[0]}'\n"
+        try:
+            return handler(*words[1:])
+        except Exception as err:
+            log.exception(f"Control command '{line}' failed")
+            return f"Error: {err}\n"
+
+    def handle_events(self):
+        try:
+            conn, _ = self._sock.accept()
+        except BlockingIOError:
+            return
+
+        conn.setblocking(False)
+        timeout = self._loop.tasks.call_later(CONNECTION_TIMEOUT, self._on_timeout, conn)
+        self._connections[conn] = [b"", timeout]
+        self._loop.register(conn, lambda: self._on_readable(conn))
+
+    def _on_readable(self, conn):
+        state = self._connections[conn]
+        try:
+            data = conn.recv(MAX_LINE)
+        except BlockingIOError:
+            return
+        except OSError as err:
+            log.warning(f"Control connection failed: {err}")
+            self._close_connection(conn)
+            return
+
+        state[0] += data
+        # Wait for a whole line, or the end of what the client sends
+        if data and b"\n" not in state[0] and len(state[0]) < MAX_LINE:
+            return
+        line = state[0].split(b"\n", 1)[0].decode(errors="replace").strip()
+        try:
+            # Replies fit in the socket buffer, a client that does not read
+            # them is not waited for
+            conn.sendall(self.execute(line).encode())
+        except OSError as err:
+            log.warning(f"Control connection failed: {err}")
+        self._close_connection(conn)
+
+    def _on_timeout(self, conn):
+        log.warning("Closing idle control connection")
+        self._connections[conn][1] = None
+        self._close_connection(conn)
+
+    def _close_connection(self, conn):
+        _, timeout = self._connections.pop(conn)
+        if timeout is not None:
+            timeout.cancel()
+        self._loop.unregister(conn)
+        conn.close()
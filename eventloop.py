@@ -0,0 +1,86 @@
+import collections
+import logging
+import os
+import selectors
+
+from tasks import Tasks
+
+log = logging.getLogger("eventloop")
+
+
+class EventLoop(object):
+    """Single threaded loop multiplexing file descriptors and timers
+
+    The loop blocks in the selector until a registered file becomes
+    readable or the next scheduled task is due, so it does not wake up
+    while idle.
+    """
+
+    def __init__(self, tasks=None):
+        self.tasks = tasks if tasks is not None else Tasks()
+        self._selector = selectors.DefaultSelector()
+        self._stopped = False
+        self._pending = collections.deque()
+
+        # Self-pipe to interrupt select() from signal handlers
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, self._on_wakeup)
+
+    def register(self, fileobj, callback):
+        self._selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    def unregister(self, fileobj):
+        try:
+            self._selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    def is_registered(self, fileobj):
+        try:
+            self._selector.get_key(fileobj)
+            return True
+        except (KeyError, ValueError):
+            return False
+
+    def _on_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 64):
+                pass
+        except BlockingIOError:
+            pass
+
+        while self._pending:
+            func, args = self._pending.popleft()
+            func(*args)
+
+    def call_soon_threadsafe(self, func, *args):
+        """Run `func(*args)` on the loop thread, may be called from any thread"""
+        self._pending.append((func, args))
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def stop(self):
+        self._stopped = True
+        self.wakeup()
+
+    def run_once(self):
+        for key, _ in self._selector.select(self.tasks.timeout()):
+            key.data()
+        self.tasks.do()
+
+    def run(self):
+        self._stopped = False
+        while not self._stopped:
+            self.run_once()
+
+    def close(self):
+        self._selector.close()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
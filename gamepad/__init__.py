@@ -1,32 +1,151 @@
+import collections
 import logging
+import os
 import pyudev
 
-from .ds4 import Gamepad
+from .ds4 import Gamepad, GamepadInfo
 
 
 log = logging.getLogger("gamepad")
 
 
-def get_gamepad_observer(on_gamepad_connected, on_gamepad_disconnected):
-    log.debug("get_gamepad_observer()")
+# Tag set by services/70-gamepad.rules, lets the kernel drop uevents of every
+# other input device and power supply before they reach our socket
+UDEV_TAG = "gamepad_remote"
+UDEV_RULES_FILE = "/etc/udev/rules.d/70-gamepad.rules"
 
-    def callback(device):
+# Window in which add/remove uevents of one device are merged
+DEBOUNCE_DELAY = 0.05
+INFO_CACHE_SIZE = 16
+
+
+class GamepadMonitor(object):
+    """Reports gamepad hotplug events, serviced from the main event loop
+
+    Uevents are collected per sys_path for `debounce` seconds and only the net
+    result is reported: an add/remove/add burst turns into a single reconnect,
+    a remove/add of a device we never reported is a plain connect, and
+    duplicate adds are ignored.
+    """
+
+    def __init__(self, on_gamepad_connected, on_gamepad_disconnected, tasks,
+                 on_battery_changed=None, debounce=DEBOUNCE_DELAY, use_tag=None):
+        self._on_gamepad_connected = on_gamepad_connected
+        self._on_gamepad_disconnected = on_gamepad_disconnected
+        self._on_battery_changed = on_battery_changed
+        self._tasks = tasks
+        self._debounce = debounce
+        self._context = pyudev.Context()
+        self._monitor = pyudev.Monitor.from_netlink(self._context)
+        self._monitor.filter_by('input')
+        if on_battery_changed is not None:
+            self._monitor.filter_by('power_supply')
+        if use_tag is None:
+            use_tag = os.path.exists(UDEV_RULES_FILE)
+        self._use_tag = use_tag
+        if use_tag:
+            self._monitor.filter_by_tag(UDEV_TAG)
+
+        self._connected = {}
+        self._pending = {}
+        self._flush_task = None
+        self._info_cache = collections.OrderedDict()
+
+    def fileno(self):
+        return self._monitor.fileno()
+
+    def start(self):
+        # Start listening before enumerating so nothing plugged in meanwhile
+        # is missed; the duplicate add is dropped by the debouncing
+        self._monitor.start()
+
+        devices = self._context.list_devices(subsystem="input", ID_INPUT_JOYSTICK=1)
+        if self._use_tag:
+            # Reads the tag's directory instead of the database of every input device
+            devices = devices.match_tag(UDEV_TAG)
+        for device in devices:
+            if self._is_gamepad(device):
+                self._connect(device)
+
+    def _is_gamepad(self, device):
         if not (device.device_node and "event" in device.device_node):
+            return False
+        return str(device.properties.get("ID_INPUT_JOYSTICK", 0)) == "1"
+
+    def _get_info(self, device):
+        info = self._info_cache.get(device.sys_path)
+        if info is None:
+            info = GamepadInfo(device)
+            self._info_cache[device.sys_path] = info
+            while len(self._info_cache) > INFO_CACHE_SIZE:
+                self._info_cache.popitem(last=False)
+        else:
+            self._info_cache.move_to_end(device.sys_path)
+        return info
+
+    def _connect(self, device):
+        try:
+            gamepad = Gamepad(device, self._get_info(device))
+        except OSError as err:
+            # The node is already gone again, its remove event is on its way
+            log.warning(f"Failed to open {device.device_node}: {err}")
+            self._info_cache.pop(device.sys_path, None)
+            return
+        self._connected[device.sys_path] = device
+        self._on_gamepad_connected(gamepad)
+
+    def _disconnect(self, sys_path):
+        device = self._connected.pop(sys_path)
+        self._on_gamepad_disconnected(device)
+
+    def _handle_device(self, device):
+        if device.subsystem == "power_supply":
+            if device.action == "change" and self._on_battery_changed is not None:
+                self._on_battery_changed(device)
+            return
+        if device.action not in ("add", "remove"):
             return
-        if not (str(device.properties.get("ID_INPUT_JOYSTICK", 0)) == "1"):
+        if device.action == "add" and not self._is_gamepad(device):
             return
-        if device.action == "add":
-            on_gamepad_connected(Gamepad(device))
-        if device.action == "remove":
-            on_gamepad_disconnected(device)
+        # A remove only carries the properties when the tag matched, so
+        # rather look it up in what we reported
+        if device.action == "remove" and not (
+                device.sys_path in self._connected or device.sys_path in self._pending):
+            return
+
+        pending = self._pending.get(device.sys_path)
+        if pending is None:
+            self._pending[device.sys_path] = [device.action == "remove", device.action, device]
+        else:
+            pending[0] = pending[0] or device.action == "remove"
+            pending[1] = device.action
+            pending[2] = device
+        if self._flush_task is None:
+            self._flush_task = self._tasks.call_later(self._debounce, self.flush)
+
+    def flush(self):
+        """Report the net result of the uevents collected so far"""
+        self._flush_task = None
+        pending, self._pending = self._pending, {}
+
+        for sys_path, (removed, action, device) in pending.items():
+            connected = sys_path in self._connected
+            if connected and (removed or action == "remove"):
+                log.debug(f"{sys_path} removed")
+                self._disconnect(sys_path)
+                connected = False
+            if action == "add" and not connected:
+                log.debug(f"{sys_path} added")
+                self._connect(device)
 
-    context = pyudev.Context()
+    def handle_events(self):
+        while True:
+            device = self._monitor.poll(timeout=0)
+            if device is None:
+                break
+            self._handle_device(device)
 
-    for device in context.list_devices(subsystem="input", ID_INPUT_JOYSTICK=1):
-        if device.device_node:
-            on_gamepad_connected(Gamepad(device))
-            break
 
-    monitor = pyudev.Monitor.from_netlink(context)
-    monitor.filter_by('input')
-    return pyudev.MonitorObserver(monitor, callback=callback)
+def get_gamepad_monitor(on_gamepad_connected, on_gamepad_disconnected, tasks, on_battery_changed=None):
+    log.debug("get_gamepad_monitor()")
+    return GamepadMonitor(on_gamepad_connected, on_gamepad_disconnected, tasks, on_battery_changed)
@@ -0,0 +1,234 @@
+import logging
+import socket
+
+from jeepney import DBusAddress, HeaderFields, MessageType, Parser, new_error, new_method_call, new_method_return
+from jeepney.auth import BEGIN, Authenticator
+from jeepney.bus import get_bus
+from jeepney.bus_messages import message_bus
+
+log = logging.getLogger("gamepad.bluez")
+
+
+BLUEZ_SERVICE = "org.bluez"
+DEVICE_INTERFACE = "org.bluez.Device1"
+DISCONNECT_TIMEOUT = 5
+
+
+class BluezError(Exception):
+    """Error reply of a D-Bus call"""
+
+    def __init__(self, name, message=""):
+        super().__init__(f"{name}: {message}" if message else name)
+        self.name = name
+
+
+class DBusConnection(object):
+    """D-Bus connection driven by the event loop
+
+    jeepney does the authentication and the wire format, this only moves
+    bytes. The socket is non-blocking from the start and `handle_events` is
+    meant to be called from the event loop when it becomes readable.
+    `connect` only sends the AUTH line, the rest of the handshake is driven
+    by `handle_events`. Calls made before the bus accepted us are queued
+    and go out right after BEGIN, behind the Hello.
+    """
+
+    def __init__(self, address=None):
+        self._address = address or "SYSTEM"
+        self._sock = None
+        self._auth = None
+        self._parser = None
+        self._serial = 0
+        self._pending = {}
+        self._outbox = []
+        self.unique_name = None
+        self.on_method_call = None
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def connect(self):
+        """Start connecting, raises OSError if the bus cannot be reached"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.setblocking(False)
+            # Connecting a Unix socket completes or fails right away
+            sock.connect(get_bus(self._address))
+            auth = Authenticator()
+            sock.sendall(auth.data_to_send())
+        except Exception:
+            sock.close()
+            raise
+        self._sock = sock
+        self._auth = auth
+        self._parser = Parser()
+        self.send(message_bus.Hello(), callback=self._on_hello)
+
+    def _on_hello(self, reply):
+        if reply is None:
+            return
+        if reply.header.message_type == MessageType.error:
+            log.warning(f"D-Bus Hello failed: {reply.header.fields.get(HeaderFields.error_name)}")
+            return
+        self.unique_name = reply.body[0]
+        log.debug(f"Connected to D-Bus as {self.unique_name}")
+
+    def close(self):
+        """Close the connection, pending callbacks are invoked with None"""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self._auth = self._parser = None
+        self._outbox = []
+        pending, self._pending = self._pending, {}
+        for callback in pending.values():
+            callback(None)
+
+    def send(self, msg, callback=None):
+        """Send a jeepney Message, `callback(reply)` runs from `handle_events`
+
+        The reply is an error or method return Message, or None if the
+        connection got lost first. Returns the serial of the message.
+        """
+        self._serial += 1
+        data = msg.serialise(serial=self._serial)
+        if self._auth is None:
+            self._sock.sendall(data)
+        else:
+            self._outbox.append(data)
+        if callback is not None:
+            self._pending[self._serial] = callback
+        return self._serial
+
+    def call(self, destination, path, interface, member, signature=None, args=(), callback=None):
+        return self.send(new_method_call(DBusAddress(path, destination, interface), member, signature, args),
+                         callback)
+
+    def cancel(self, serial):
+        self._pending.pop(serial, None)
+
+    def reply(self, call, signature=None, args=()):
+        self.send(new_method_return(call, signature, args))
+
+    def error(self, call, name, text=""):
+        self.send(new_error(call, name, "s", (text,)))
+
+    def _authenticate(self, data):
+        """Feed the server's AUTH answer, sends BEGIN and the queued messages once accepted"""
+        try:
+            self._auth.feed(data)
+        except ValueError as err:
+            raise ConnectionError(f"D-Bus authentication failed: {err}")
+        if self._auth.authenticated:
+            outbox, self._outbox = self._outbox, []
+            self._sock.sendall(BEGIN + b"".join(outbox))
+            self._auth = None
+
+    def handle_events(self):
+        """Read and dispatch everything available, raises OSError on connection loss"""
+        messages = []
+        while True:
+            try:
+                data = self._sock.recv(4096)
+            except BlockingIOError:
+                break
+            if not data:
+                raise ConnectionError("D-Bus connection closed")
+            if self._auth is not None:
+                # Nothing else comes before our BEGIN
+                self._authenticate(data)
+            else:
+                messages.extend(self._parser.feed(data))
+
+        for msg in messages:
+            msg_type = msg.header.message_type
+            if msg_type in (MessageType.method_return, MessageType.error):
+                callback = self._pending.pop(msg.header.fields.get(HeaderFields.reply_serial), None)
+                if callback is not None:
+                    callback(msg)
+            elif msg_type == MessageType.method_call and self.on_method_call is not None:
+                self.on_method_call(msg)
+
+
+def device_path(address, adapter="hci0"):
+    return "/org/bluez/{}/dev_{}".format(adapter, address.upper().replace(":", "_"))
+
+
+class BluezClient(object):
+    """Issue BlueZ requests from the event loop without blocking it
+
+    The system bus is connected on first use and registered with `loop`,
+    the D-Bus handshake then completes on the loop like any reply.
+    """
+
+    def __init__(self, loop, tasks, address=None, timeout=DISCONNECT_TIMEOUT):
+        self._loop = loop
+        self._tasks = tasks
+        self._address = address
+        self._timeout = timeout
+        self._conn = None
+
+    def _get_connection(self):
+        if self._conn is None:
+            conn = DBusConnection(self._address)
+            conn.connect()
+            self._loop.register(conn, self._handle_events)
+            self._conn = conn
+        return self._conn
+
+    def _handle_events(self):
+        try:
+            self._conn.handle_events()
+        except OSError as err:
+            log.warning(f"Lost the D-Bus connection: {err}")
+            self.close()
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._loop.unregister(conn)
+            conn.close()
+
+    def disconnect_device(self, address, adapter="hci0", callback=None):
+        """Ask BlueZ to disconnect a device
+
+        Returns immediately, `callback(error)` runs on the loop once BlueZ
+        replied, with error None on success, BluezError for an error reply or
+        TimeoutError after `timeout` seconds.
+        """
+        path = device_path(address, adapter)
+        log.info(f"Disconnecting {path}")
+
+        def complete(error):
+            if error is not None:
+                log.warning(f"Failed to disconnect {address}: {error}")
+            if callback is not None:
+                callback(error)
+
+        def on_reply(reply):
+            timeout_task.cancel()
+            if reply is None:
+                complete(ConnectionError("D-Bus connection closed"))
+            elif reply.header.message_type == MessageType.error:
+                complete(BluezError(reply.header.fields.get(HeaderFields.error_name), (reply.body or ("",))[0]))
+            else:
+                complete(None)
+
+        def on_timeout():
+            conn.cancel(serial)
+            complete(TimeoutError(f"No reply from BlueZ after {self._timeout}s"))
+
+        try:
+            conn = self._get_connection()
+            serial = conn.call(BLUEZ_SERVICE, path, DEVICE_INTERFACE, "Disconnect",
+                               callback=on_reply)
+        except OSError as err:
+            self.close()
+            complete(err)
+            return
+
+        timeout_task = self._tasks.call_later(self._timeout, on_timeout)
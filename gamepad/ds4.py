@@ -1,53 +1,145 @@
+import fcntl
 import logging
-import os
 import pyudev
 import select
-import subprocess
+import struct
 import time
 
-from evdev import InputDevice, ecodes, categorize
+from evdev import InputDevice, InputEvent, ecodes, categorize
+
+from .led import LedWriter
 
 
 log = logging.getLogger("gamepad.ds4")
 
 
-class Gamepad(object):
-    def __init__(self, udev_device):
-        log.debug(f"Initializing device {udev_device.device_node}")
-        self._udev_device = udev_device
-        self._device = InputDevice(udev_device.device_node)
-        self._state = {}
+# _IOW('E', 0xa0, int), selects the clock of the event timestamps
+EVIOCSCLOCKID = 0x400445a0
 
-        self._leds = []
-        self._battery = None
+# D-Pad buttons reported through the hat axes, indexed by the sign of the value
+HAT_BUTTONS = {
+    ecodes.ABS_HAT0X: {-1: ecodes.BTN_DPAD_LEFT, 1: ecodes.BTN_DPAD_RIGHT},
+    ecodes.ABS_HAT0Y: {-1: ecodes.BTN_DPAD_UP, 1: ecodes.BTN_DPAD_DOWN},
+}
+
+
+class GamepadInfo(object):
+    """Static description of a gamepad parsed from udev
+
+    Walking the hid parent is comparatively slow, the monitor caches these by
+    sys_path so repeated uevents for the same device do not redo the work.
+    """
+
+    def __init__(self, udev_device):
+        self.device_node = udev_device.device_node
+        self.touchpad_node = None
+        self.battery = None
+        self.leds = []
+        self.bt_mac_address = None
+        self.bt_adapter = "hci0"
 
         hid_device = udev_device.find_parent("hid")
 
         self.is_bluetooth = (udev_device.properties.get("ID_BUS") == "bluetooth")
-        if self.is_bluetooth:
+        if self.is_bluetooth and hid_device is not None:
             self.bt_mac_address = hid_device.properties.get("HID_UNIQ")
             log.info(f"Bluetooth addr: {self.bt_mac_address}")
+            host = udev_device.find_parent("bluetooth", "host")
+            if host is not None:
+                self.bt_adapter = host.sys_name
 
-        for child in hid_device.children:
+        for child in (hid_device.children if hid_device else ()):
+            if (child.subsystem == "input" and child.device_node and "event" in child.device_node
+                    and child.properties.get("ID_INPUT_TOUCHPAD") == "1"):
+                log.info(f"Found touchpad {child.device_node}")
+                self.touchpad_node = child.device_node
             if child.subsystem == "power_supply":
                 log.info(f"Found power supply {child.sys_name}")
-                self._battery = child
+                self.battery = child
             if child.subsystem == "leds":
                 log.info(f"Found led {child.sys_name}")
-                self._leds.append(child)
+                self.leds.append(child)
+
+
+def _use_monotonic_clock(device):
+    """Stamp events with CLOCK_MONOTONIC, returns the clock matching the timestamps"""
+    try:
+        fcntl.ioctl(device.fd, EVIOCSCLOCKID, struct.pack("i", time.CLOCK_MONOTONIC))
+    except OSError as err:
+        log.warning(f"Event timestamps stay on the wall clock: {err}")
+        return time.time
+    return time.monotonic
+
+
+class Gamepad(object):
+    def __init__(self, udev_device, info=None):
+        log.debug(f"Initializing device {udev_device.device_node}")
+        if info is None:
+            info = GamepadInfo(udev_device)
+        self._udev_device = udev_device
+        self._device = InputDevice(udev_device.device_node)
+        # Event timestamps are compared with this, the wall clock may be
+        # stepped by NTP at any time
+        self.clock = _use_monotonic_clock(self._device)
+
+        # Pressed keys as seen in the event stream, only resynced from the
+        # kernel after a SYN_DROPPED
+        self._pressed = set()
+        self._hat = {}
+        self._syn_dropped = False
+        self.resync()
+
+        self._leds = LedWriter(info.leds)
+        self._battery = info.battery
+        self._touchpad_node = info.touchpad_node
+        self.touchpad = None
+
+        self.is_bluetooth = info.is_bluetooth
+        self.bt_mac_address = info.bt_mac_address
+        self.bt_adapter = info.bt_adapter
 
     def __repr__(self):
         return '{}({})'.format(self.__class__.__name__, self._device)
 
+    def fileno(self):
+        return self._device.fd
+
+    @property
+    def uniq(self):
+        """Unique identifier of the gamepad, the MAC address for bluetooth gamepads"""
+        return self._device.uniq
+
+    def abs_range(self, code):
+        """(min, max) of an absolute axis, None if the gamepad does not have it"""
+        try:
+            info = self._device.absinfo(code)
+        except OSError:
+            return None
+        return info.min, info.max
+
+    def open_touchpad(self):
+        """Open the touchpad device which belongs to this gamepad, if any"""
+        if self.touchpad is None and self._touchpad_node:
+            self.touchpad = InputDevice(self._touchpad_node)
+        return self.touchpad
+
+    def close_touchpad(self):
+        if self.touchpad is not None:
+            self.touchpad.close()
+            self.touchpad = None
+
+    def read_touchpad(self):
+        try:
+            return list(self.touchpad.read())
+        except BlockingIOError:
+            return []
+
     def set_led_colors(self, red=0, green=0, blue=0):
-        log.info(f"Setting LED colors to 0x{red:02x}{green:02x}{blue:02x}")
-        for led in self._leds:
-            if os.path.basename(led.sys_path).endswith("red"):
-                open(os.path.join(led.sys_path, "brightness"), "w").write(f"{red}\n")
-            if os.path.basename(led.sys_path).endswith("green"):
-                open(os.path.join(led.sys_path, "brightness"), "w").write(f"{green}\n")
-            if os.path.basename(led.sys_path).endswith("blue"):
-                open(os.path.join(led.sys_path, "brightness"), "w").write(f"{blue}\n")
+        log.debug(f"Setting LED colors to 0x{red:02x}{green:02x}{blue:02x}")
+        self._leds.write(red, green, blue)
+
+    def close_leds(self):
+        self._leds.close()
 
     @property
     def has_battery(self):
@@ -67,71 +159,110 @@ class Gamepad(object):
         else:
             return self._battery.properties.get("POWER_SUPPLY_STATUS")
 
-    def disconnect(self):
+    def is_battery(self, device):
+        return self._battery is not None and self._battery.sys_path == device.sys_path
+
+    def update_battery(self, device):
+        """Take the battery state from a power_supply change uevent"""
+        self._battery = device
+
+    def disconnect(self, bluez, callback=None):
+        """Disconnect a bluetooth gamepad through BlueZ without waiting for it
+
+        `callback(error)` is invoked from the event loop once BlueZ replied.
+        """
         log.debug("disconnect()")
 
         if not self.is_bluetooth:
             return  # We can only disconnect bluetooth gamepad
 
-        proc = subprocess.Popen(
-            "/usr/bin/bluetoothctl", stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        try:
-            log.debug("Sending disconnect signal via bluetoothctl")
-            proc.communicate(
-                "disconnect {}\nexit\n".format(self.bt_mac_address).encode(),
-                timeout=5)
-        except subprocess.TimeoutExpired:
-            proc.kill()
-            proc.communicate()
+        bluez.disconnect_device(self.bt_mac_address, self.bt_adapter, callback)
 
-        log.info("Gamepad disconnected")
+    def resync(self):
+        """Reload the key state from the kernel, returns the keys released meanwhile"""
+        previous = self._pressed
+        self._pressed = set(self._device.active_keys())
+        self._hat = {}
+        capabilities = self._device.capabilities().get(ecodes.EV_ABS, [])
+        for axis, buttons in HAT_BUTTONS.items():
+            if any(code == axis for code, _ in capabilities):
+                value = self._device.absinfo(axis).value
+                if value:
+                    self._hat[axis] = buttons[(value > 0) - (value < 0)]
+                    self._pressed.add(self._hat[axis])
+        return sorted(previous - self._pressed)
 
     def get_active_keys(self):
-        return self._device.active_keys()
-
-    def is_pressed(self, key, min_duration=None):
-        if key in self.get_active_keys():
-            if min_duration:
-                if key in self._state.keys():
-                    now = time.time()
-                    ts, event = self._state[key]
-                    if (now - ts) >= min_duration:
-                        del self._state[key]
-                        return True
-                else:
-                    return False
-            else:
-                return True
+        return self._pressed
+
+    def is_pressed(self, key):
+        """Long presses are recognized by the GestureRecognizer"""
+        return key in self._pressed
+
+    def _translate_hat(self, event):
+        """Convert a hat axis event into D-Pad button events"""
+        buttons = HAT_BUTTONS[event.code]
+        sec, usec = event.sec, event.usec
+        events = []
+
+        released = self._hat.pop(event.code, None)
+        if released is not None:
+            events.append(InputEvent(sec, usec, ecodes.EV_KEY, released, 0))
+        if event.value:
+            pressed = buttons[(event.value > 0) - (event.value < 0)]
+            self._hat[event.code] = pressed
+            events.append(InputEvent(sec, usec, ecodes.EV_KEY, pressed, 1))
 
-        return False
+        return events
 
     def read(self):
-        r, _, _ = select.select([self._device], [], [], 0.5)
-        if self._device not in r:
+        """Read all pending events, does not block when there is nothing to read"""
+        try:
+            events = list(self._device.read())
+        except BlockingIOError:
             return
 
-        for event in self._device.read():
-            if event.code in (ecodes.ABS_HAT0X, ecodes.ABS_HAT0Y):
-                event.type = ecodes.EV_KEY
-                if event.code == ecodes.ABS_HAT0X:
-                    event.code = (event.value < 0) and ecodes.BTN_DPAD_LEFT or ecodes.BTN_DPAD_RIGHT
-                elif event.code == ecodes.ABS_HAT0Y:
-                    event.code = (event.value < 0) and ecodes.BTN_DPAD_UP or ecodes.BTN_DPAD_DOWN
-                event.value = abs(event.value)
+        debug = log.isEnabledFor(logging.DEBUG)
 
-            if event.type == ecodes.EV_KEY:
-                if event.value == 1:
-                    self._state[event.code] = event.timestamp(), event
-                if event.value == 0 and event.code in self._state.keys():
-                    del self._state[event.code]
+        for event in events:
+            if event.type == ecodes.EV_SYN:
+                if event.code == ecodes.SYN_DROPPED:
+                    # Kernel buffer overrun, drop everything until the next
+                    # SYN_REPORT and then query the real state
+                    log.info("SYN_DROPPED received, resyncing key state")
+                    self._syn_dropped = True
+                    continue
+                if self._syn_dropped and event.code == ecodes.SYN_REPORT:
+                    # Report the releases lost in the overrun so nothing
+                    # stays held downstream, then end the frame as usual
+                    self._syn_dropped = False
+                    for code in self.resync():
+                        yield InputEvent(event.sec, event.usec, ecodes.EV_KEY, code, 0)
+                    yield event
+                    continue
+            if self._syn_dropped:
+                continue
+
+            if event.type == ecodes.EV_ABS and event.code in HAT_BUTTONS:
+                translated = self._translate_hat(event)
+            else:
+                translated = (event,)
+
+            for event in translated:
+                if event.type == ecodes.EV_KEY:
+                    if event.value == 1:
+                        self._pressed.add(event.code)
+                    elif event.value == 0:
+                        self._pressed.discard(event.code)
 
-            if event.type in (ecodes.EV_KEY,):
-                log.debug(categorize(event))
+                    if debug:
+                        log.debug(categorize(event))
 
-            yield event
+                yield event
 
     def __iter__(self):
         while True:
+            select.select([self._device], [], [])
             for event in self.read():
                 if event: yield event
 
@@ -0,0 +1,145 @@
+import logging
+import os
+
+log = logging.getLogger("gamepad.led")
+
+
+class LedWriter(object):
+    """Writes the light bar colour through cached sysfs `brightness` files
+
+    The files are opened once and a channel is only written when its value
+    changes, so repeatedly setting the same colour costs nothing.
+    """
+
+    CHANNELS = ("red", "green", "blue")
+
+    def __init__(self, leds):
+        self._files = {}
+        for led in leds:
+            for channel in self.CHANNELS:
+                if os.path.basename(led.sys_path).endswith(channel):
+                    self._files[channel] = os.path.join(led.sys_path, "brightness")
+        self._fds = {}
+        self._values = {}
+
+    def write(self, red=0, green=0, blue=0):
+        for channel, value in zip(self.CHANNELS, (red, green, blue)):
+            if self._values.get(channel) == value or channel not in self._files:
+                continue
+            try:
+                fd = self._fds.get(channel)
+                if fd is None:
+                    fd = self._fds[channel] = os.open(self._files[channel], os.O_WRONLY)
+                os.pwrite(fd, b"%d\n" % value, 0)
+            except OSError as err:
+                # The gamepad is most likely gone, try again from scratch next time
+                log.warning(f"Failed to set {channel} LED: {err}")
+                self.close()
+                return
+            self._values[channel] = value
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+        self._values.clear()
+
+
+class Animation(object):
+    """Keyframes of (duration, colour) played in order, optionally looping
+
+    A colour of None shows the base colour during that keyframe.
+    """
+
+    def __init__(self, frames, loop=True):
+        self.frames = tuple(frames)
+        self.loop = loop
+
+
+class LedAnimator(object):
+    """Plays light bar animations on top of a steady base colour
+
+    Timers are only scheduled at keyframe boundaries, there is no fixed frame
+    tick, and `write(red, green, blue)` is expected to skip unchanged values.
+    The active animation with the highest priority is the one shown.
+    """
+
+    def __init__(self, tasks, write):
+        self._tasks = tasks
+        self._write = write
+        self._base = (0, 0, 0)
+        self._animations = {}
+        self._current = None
+        self._frame = 0
+        self._task = None
+
+    @property
+    def base(self):
+        return self._base
+
+    def set_base(self, red=0, green=0, blue=0):
+        self._base = (red, green, blue)
+        self._show()
+
+    def play(self, name, animation, priority=0):
+        if self._animations.get(name) == (priority, animation):
+            return
+        self._animations[name] = (priority, animation)
+        if name == self._current:
+            self._current = None  # Restart it with the new keyframes
+        self._select()
+
+    def stop(self, name):
+        if self._animations.pop(name, None) is not None:
+            self._select()
+
+    def is_playing(self, name):
+        return name in self._animations
+
+    def stop_all(self):
+        self._animations.clear()
+        self._select()
+
+    def _select(self):
+        name = max(self._animations, key=lambda n: self._animations[n][0], default=None)
+        if name == self._current:
+            return
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._current = name
+        self._frame = 0
+        if name is not None:
+            self._step(self._tasks.clock())
+        else:
+            self._show()
+
+    def _show(self):
+        color = None
+        if self._current is not None:
+            _, animation = self._animations[self._current]
+            color = animation.frames[self._frame][1]
+        self._write(*(color if color is not None else self._base))
+
+    def _step(self, when):
+        _, animation = self._animations[self._current]
+        self._show()
+        duration = animation.frames[self._frame][0]
+        self._task = self._tasks.call_at(when + duration, self._next, when + duration)
+
+    def _next(self, when):
+        self._task = None
+        _, animation = self._animations[self._current]
+        self._frame += 1
+        if self._frame >= len(animation.frames):
+            if not animation.loop:
+                del self._animations[self._current]
+                self._select()
+                return
+            self._frame = 0
+        # Deadlines are absolute so the timing does not drift, unless we fell
+        # behind by more than the frame that is about to be shown
+        now = self._tasks.clock()
+        if now - when > animation.frames[self._frame][0]:
+            when = now
+        self._step(when)
@@ -0,0 +1,169 @@
+"""Record and replay gamepad event streams
+
+A trace is a small header followed by fixed size records of
+(timestamp, type, code, value) as yielded by `Gamepad.read()`.
+
+Record a session from the first connected gamepad with:
+
+    python3 -m gamepad.trace record session.trace
+"""
+
+import logging
+import os
+import struct
+import sys
+import time
+
+from evdev import InputEvent, ecodes
+
+log = logging.getLogger("gamepad.trace")
+
+
+MAGIC = b"GPTRACE1"
+RECORD = struct.Struct("<dHHi")
+
+
+class TraceWriter(object):
+    def __init__(self, filename):
+        self._fp = open(filename, "wb")
+        self._fp.write(MAGIC)
+        self.count = 0
+
+    def write(self, event):
+        self._fp.write(RECORD.pack(event.timestamp(), event.type, event.code, event.value))
+        self.count += 1
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_trace(filename):
+    """Return the list of events stored in a trace file"""
+    with open(filename, "rb") as fp:
+        data = fp.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{filename} is not a gamepad trace")
+
+    events = []
+    for ts, type_, code, value in RECORD.iter_unpack(data[len(MAGIC):]):
+        sec = int(ts)
+        events.append(InputEvent(sec, int(round((ts - sec) * 1e6)), type_, code, value))
+    return events
+
+
+def split_frames(events):
+    """Group events into SYN_REPORT terminated frames"""
+    frame = []
+    for event in events:
+        frame.append(event)
+        if event.type == ecodes.EV_SYN and event.code == ecodes.SYN_REPORT:
+            yield frame
+            frame = []
+    if frame:
+        yield frame
+
+
+class ReplayGamepad(object):
+    """Stand-in for `Gamepad` fed from a trace instead of an input device"""
+
+    is_bluetooth = False
+    uniq = ""
+    clock = staticmethod(time.time)
+    _udev_device = None
+    has_battery = False
+    battery_level = -1
+    battery_status = "No battery"
+
+    def __init__(self):
+        self._pending = []
+        self._pressed = set()
+        self._pipe_r, self._pipe_w = os.pipe()
+        self.led_colors = None
+        self.disconnected = False
+
+    def __repr__(self):
+        return "ReplayGamepad()"
+
+    def fileno(self):
+        return self._pipe_r
+
+    def close(self):
+        os.close(self._pipe_r)
+        os.close(self._pipe_w)
+
+    def feed(self, events):
+        self._pending.extend(events)
+
+    def abs_range(self, code):
+        return None
+
+    def open_touchpad(self):
+        return None
+
+    def close_touchpad(self):
+        pass
+
+    def set_led_colors(self, red=0, green=0, blue=0):
+        self.led_colors = (red, green, blue)
+
+    def close_leds(self):
+        pass
+
+    def is_battery(self, device):
+        return False
+
+    def disconnect(self, bluez=None, callback=None):
+        self.disconnected = True
+        if callback is not None:
+            callback(None)
+
+    def get_active_keys(self):
+        return self._pressed
+
+    def is_pressed(self, key):
+        return key in self._pressed
+
+    def read(self):
+        pending, self._pending = self._pending, []
+        for event in pending:
+            if event.type == ecodes.EV_KEY:
+                if event.value == 1:
+                    self._pressed.add(event.code)
+                elif event.value == 0:
+                    self._pressed.discard(event.code)
+            yield event
+
+
+def record(filename):
+    import select
+    from . import Gamepad
+
+    gamepad = Gamepad.get_gamepad()
+    if gamepad is None:
+        print("No gamepad found")
+        return 1
+
+    print(f"Recording {gamepad} to {filename}, press Ctrl+C to stop")
+    with TraceWriter(filename) as writer:
+        try:
+            while True:
+                select.select([gamepad], [], [])
+                for event in gamepad.read():
+                    writer.write(event)
+        except KeyboardInterrupt:
+            pass
+    print(f"Recorded {writer.count} events")
+    return 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != "record":
+        print(f"Usage: {sys.argv[0]} record <trace file>")
+        sys.exit(2)
+    sys.exit(record(sys.argv[2]))
@@ -0,0 +1,240 @@
+import logging
+
+log = logging.getLogger("gesture")
+
+
+DOUBLE_TAP_WINDOW = 0.3
+CHORD_WINDOW = 0.08
+
+
+class LongPress(object):
+    """Button held for `duration` seconds, fires while it is still held"""
+    __slots__ = ("button", "duration", "action")
+
+    def __init__(self, button, duration, action):
+        if duration <= 0:
+            raise ValueError("Long press duration must be > 0")
+        self.button = button
+        self.duration = duration
+        self.action = action
+
+    @property
+    def buttons(self):
+        return (self.button,)
+
+    def __repr__(self):
+        return f"LongPress({self.button}, {self.duration})"
+
+
+class Tap(object):
+    """Button released before any long press on it fired
+
+    With `max_duration` longer presses are not taps either. If the button
+    also has a DoubleTap the tap only fires once no second press followed.
+    """
+    __slots__ = ("button", "max_duration", "action")
+
+    def __init__(self, button, action, max_duration=None):
+        self.button = button
+        self.max_duration = max_duration
+        self.action = action
+
+    @property
+    def buttons(self):
+        return (self.button,)
+
+    def __repr__(self):
+        return f"Tap({self.button}, {self.max_duration})"
+
+
+class DoubleTap(object):
+    """Two short presses of a button, fires on the second press
+
+    Both presses and the gap between them must be shorter than `window`.
+    """
+    __slots__ = ("button", "window", "action")
+
+    def __init__(self, button, action, window=DOUBLE_TAP_WINDOW):
+        if window <= 0:
+            raise ValueError("Double tap window must be > 0")
+        self.button = button
+        self.window = window
+        self.action = action
+
+    @property
+    def buttons(self):
+        return (self.button,)
+
+    def __repr__(self):
+        return f"DoubleTap({self.button}, {self.window})"
+
+
+class Chord(object):
+    """Buttons pressed together, all within `window` seconds of each other"""
+    __slots__ = ("buttons", "window", "action")
+
+    def __init__(self, buttons, action, window=CHORD_WINDOW):
+        if len(set(buttons)) < 2:
+            raise ValueError("A chord needs at least two buttons")
+        self.buttons = tuple(buttons)
+        self.window = window
+        self.action = action
+
+    def __repr__(self):
+        return f"Chord({list(self.buttons)}, {self.window})"
+
+
+class _Button(object):
+    __slots__ = ("down", "up", "consumed", "tapped", "hold_tasks", "tap_task",
+                 "long_presses", "taps", "double_tap", "chords")
+
+    def __init__(self):
+        self.down = None
+        self.up = None
+        self.consumed = False
+        self.tapped = False  # Last press was short enough to start a double tap
+        self.hold_tasks = []
+        self.tap_task = None
+        self.long_presses = []
+        self.taps = []
+        self.double_tap = None
+        self.chords = []
+
+
+class GestureRecognizer(object):
+    """Long presses, taps, double taps and chords of one gamepad
+
+    Driven by the key events and by deadlines on the scheduler, nothing is
+    polled. A long press fires from its own timer at `duration` after the
+    press and a deferred tap at the end of the double tap window.
+    `on_gesture(gesture)` is called when one is recognized.
+
+    `on_key()` returns True when the event completes a gesture, or is the
+    release of a button whose press went into one, so the caller can skip
+    the plain binding of that event.
+    """
+
+    def __init__(self, tasks, on_gesture, gestures=()):
+        self._tasks = tasks
+        self._on_gesture = on_gesture
+        self._buttons = {}
+        for gesture in gestures:
+            self.add(gesture)
+
+    def __contains__(self, button):
+        return button in self._buttons
+
+    def add(self, gesture):
+        for button in gesture.buttons:
+            state = self._buttons.setdefault(button, _Button())
+            if isinstance(gesture, LongPress):
+                state.long_presses.append(gesture)
+            elif isinstance(gesture, Tap):
+                state.taps.append(gesture)
+            elif isinstance(gesture, DoubleTap):
+                if state.double_tap is not None:
+                    raise ValueError(f"Button {button} has two double taps")
+                state.double_tap = gesture
+            elif isinstance(gesture, Chord):
+                state.chords.append(gesture)
+            else:
+                raise TypeError(f"Unknown gesture {gesture!r}")
+
+    def reset(self):
+        """Forget pressed buttons and cancel the pending timers"""
+        for state in self._buttons.values():
+            self._cancel(state)
+            state.down = state.up = None
+            state.consumed = state.tapped = False
+
+    def _cancel(self, state):
+        for task in state.hold_tasks:
+            task.cancel()
+        state.hold_tasks = []
+        if state.tap_task is not None:
+            state.tap_task.cancel()
+            state.tap_task = None
+
+    def _fire(self, gesture):
+        log.debug(f"Recognized {gesture}")
+        self._on_gesture(gesture)
+
+    def on_key(self, button, value):
+        state = self._buttons.get(button)
+        if state is None or value == 2:
+            return False
+        if value:
+            return self._press(state)
+        return self._release(state)
+
+    def _press(self, state):
+        now = self._tasks.clock()
+        previous_up = state.up
+        state.down = now
+        state.up = None
+        state.consumed = False
+
+        if state.tap_task is not None:
+            # Second press within the window, the pending tap is not one
+            state.tap_task.cancel()
+            state.tap_task = None
+
+        double_tap = state.double_tap
+        if (double_tap is not None and state.tapped and previous_up is not None
+                and now - previous_up <= double_tap.window):
+            state.tapped = False
+            state.consumed = True
+            self._fire(double_tap)
+            return True
+
+        for chord in state.chords:
+            downs = [self._buttons[b].down for b in chord.buttons]
+            if all(down is not None for down in downs) and now - min(downs) <= chord.window:
+                for b in chord.buttons:
+                    other = self._buttons[b]
+                    other.consumed = True
+                    self._cancel(other)
+                self._fire(chord)
+                return True
+
+        for gesture in state.long_presses:
+            state.hold_tasks.append(
+                self._tasks.call_at(now + gesture.duration, self._on_hold, state, gesture))
+        return False
+
+    def _on_hold(self, state, gesture):
+        state.consumed = True
+        self._fire(gesture)
+
+    def _release(self, state):
+        if state.down is None:
+            return False  # Pressed before we started listening
+        now = self._tasks.clock()
+        duration = now - state.down
+        state.down = None
+        state.up = now
+        for task in state.hold_tasks:
+            task.cancel()
+        state.hold_tasks = []
+
+        if state.consumed:
+            state.consumed = False
+            state.tapped = False
+            return True
+
+        double_tap = state.double_tap
+        state.tapped = double_tap is not None and duration <= double_tap.window
+        taps = [tap for tap in state.taps if tap.max_duration is None or duration <= tap.max_duration]
+        if taps:
+            if state.tapped:
+                state.tap_task = self._tasks.call_at(now + double_tap.window, self._on_tap_timeout, state, taps)
+            else:
+                for tap in taps:
+                    self._fire(tap)
+        return False
+
+    def _on_tap_timeout(self, state, taps):
+        state.tap_task = None
+        state.tapped = False
+        for tap in taps:
+            self._fire(tap)
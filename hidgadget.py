@@ -0,0 +1,39 @@
+import errno
+import logging
+import os
+
+log = logging.getLogger("hidgadget")
+
+
+class HIDDevice(object):
+    """Writer for a USB HID gadget node, the node is kept open between reports"""
+
+    # The gadget node goes away while the USB host re-enumerates
+    _REOPEN_ERRNOS = (errno.ENODEV, errno.ESHUTDOWN, errno.EPIPE, errno.EBADF)
+
+    def __init__(self, device_node):
+        self.device_node = device_node
+        self._fd = None
+
+    def open(self):
+        if self._fd is None:
+            self._fd = os.open(self.device_node, os.O_RDWR)
+        return self._fd
+
+    def close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def write(self, report):
+        try:
+            os.write(self.open(), report)
+        except OSError as err:
+            if err.errno not in self._REOPEN_ERRNOS:
+                raise
+            log.info(f"Reopening {self.device_node} ({err.strerror})")
+            self.close()
+            os.write(self.open(), report)
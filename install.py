@@ -47,6 +47,9 @@ def install(appdir):
         fp.write(apply_template('services/keyboard-device.service', **template_map))
     call("systemctl enable keyboard-device.service", shell=True)
 
+    shutil.copy('services/70-gamepad.rules', '/etc/udev/rules.d/70-gamepad.rules')
+    call("udevadm control --reload", shell=True)
+
 
 if __name__ == '__main__':
     if os.geteuid() != 0:
@@ -1,7 +1,9 @@
 import struct
 
+from hidgadget import HIDDevice
 
-class Keyboard(object):
+
+class Keyboard(HIDDevice):
     KEY_RIGHT = 0x4f
     KEY_LEFT = 0x50
     KEY_DOWN = 0x51
@@ -28,18 +30,46 @@ class Keyboard(object):
 
     _EVENT_FORMAT = str('BBB5B')
 
+    MAX_KEYS = 6
+    KEY_ERROR_ROLLOVER = 0x01
+
     def __init__(self, device_node="/dev/hidg0"):
-        self.device_node = device_node
+        super().__init__(device_node)
+        self._reports = {}
+        self._last_report = None
+
+    def keys_report(self, buttons=(), media_key=0, modifier=0):
+        """Return the packed report for up to six held keys
+
+        Reports are built once per key combination. Like a real keyboard,
+        more than six keys report ErrorRollOver in every slot.
+        """
+        key = (buttons, media_key, modifier)
+        report = self._reports.get(key)
+        if report is None:
+            if len(buttons) > self.MAX_KEYS:
+                slots = (self.KEY_ERROR_ROLLOVER,) * self.MAX_KEYS
+            else:
+                slots = tuple(buttons) + (0,) * (self.MAX_KEYS - len(buttons))
+            report = struct.pack(self._EVENT_FORMAT, modifier, media_key, *slots)
+            self._reports[key] = report
+        return report
+
+    def report(self, button=0, media_key=0, modifier=0):
+        return self.keys_report((button,) if button else (), media_key, modifier)
 
     def release(self):
-        self.press(0, 0, 0)
+        self.write(self.report())
 
     def press(self, button=0, media_key=0, modifier=0):
-        report = struct.pack(
-            self._EVENT_FORMAT, modifier, media_key, button, 0, 0, 0, 0, 0)
-        self.write(report)
+        self.write(self.report(button, media_key, modifier))
+
+    def update(self, buttons=(), media_key=0, modifier=0):
+        """Report the given set of held keys, nothing is written if it did not change"""
+        report = self.keys_report(buttons, media_key, modifier)
+        if report != self._last_report:
+            self.write(report)
 
     def write(self, report):
-        with open(self.device_node, 'rb+') as fd:
-            fd.write(report)
-            fd.flush()
\ No newline at end of file
+        super().write(report)
+        self._last_report = report
@@ -0,0 +1,250 @@
+import inspect
+import json
+import logging
+
+from evdev import ecodes
+
+from gesture import Chord, DoubleTap, LongPress, Tap, CHORD_WINDOW, DOUBLE_TAP_WINDOW
+from keyboard import Keyboard
+from macro import Delay, KeyStep, Macro, MacroAction, TvGroup
+from repeat import RepeatConfig
+from tv.bravia import Bravia
+from volume import VolumeAction
+
+log = logging.getLogger("keymap")
+
+
+DOWN = 1
+UP = 0
+
+EDGES = {"down": DOWN, "up": UP}
+GESTURES = ["tap", "hold", "double_tap", "chord"]
+
+NO_MODIFIERS = frozenset()
+
+
+class KeyAction(object):
+    """Send a HID keyboard report, optionally auto-repeated while held"""
+    __slots__ = ("button", "media_key", "modifier", "repeat")
+
+    def __init__(self, button=0, media_key=0, modifier=0, repeat=None):
+        self.button = button
+        self.media_key = media_key
+        self.modifier = modifier
+        self.repeat = repeat
+
+    def __repr__(self):
+        return f"KeyAction(0x{self.button:02x}, 0x{self.media_key:02x}, 0x{self.modifier:02x})"
+
+
+class TvAction(object):
+    """Call a Bravia client method, `tv` takes care of how it is dispatched"""
+    __slots__ = ("method", "args", "kwargs")
+
+    repeat = None
+
+    def __init__(self, method, *args, **kwargs):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+
+    def execute(self, kbd, tv):
+        tv(self.method, *self.args, **self.kwargs)
+
+    def __repr__(self):
+        return f"TvAction({self.method}, {self.args}, {self.kwargs})"
+
+
+IRCC_METHOD = "send_ircc_command"
+
+
+def IrccAction(command):
+    return TvAction(IRCC_METHOD, command)
+
+
+def _resolve(table, name, what):
+    if isinstance(name, int):
+        return name
+    try:
+        return table[name]
+    except KeyError:
+        raise ValueError(f"Unknown {what} '{name}'")
+
+
+def _button(name):
+    return _resolve(ecodes.ecodes, name, "button")
+
+
+def _keyboard_key(name):
+    if isinstance(name, int):
+        return name
+    value = getattr(Keyboard, name, None)
+    if not isinstance(value, int):
+        raise ValueError(f"Unknown keyboard key '{name}'")
+    return value
+
+
+def _tv_method(name, params):
+    """Check that a `rest` binding names a Bravia method taking `params`"""
+    method = getattr(Bravia, name, None) if not name.startswith("_") else None
+    if not inspect.isfunction(method):
+        raise ValueError(f"Unknown Bravia method '{name}'")
+    try:
+        inspect.signature(method).bind(None, **params)
+    except TypeError as err:
+        raise ValueError(f"Invalid params for Bravia method '{name}': {err}")
+    return name
+
+
+def compile_repeat(binding, defaults):
+    repeat = binding.get("repeat")
+    if not repeat:
+        return None
+    if binding.get("on", "down") != "down":
+        raise ValueError(f"Only 'down' bindings can repeat: {binding}")
+    return RepeatConfig.from_dict(repeat if isinstance(repeat, dict) else {}, defaults)
+
+
+def compile_action(binding, repeat_defaults=None, macros=None):
+    if "macro" in binding:
+        if macros is None or binding["macro"] not in macros:
+            raise ValueError(f"Unknown macro '{binding['macro']}'")
+        return MacroAction(macros[binding["macro"]])
+    if "ircc" in binding:
+        return IrccAction(binding["ircc"])
+    if "rest" in binding:
+        params = binding.get("params", {})
+        return TvAction(_tv_method(binding["rest"], params), **params)
+    if "app" in binding:
+        return TvAction("launch_app", binding["app"])
+    if "channel" in binding:
+        return TvAction("tune_channel", str(binding["channel"]))
+    if "volume" in binding:
+        steps = int(binding["volume"])
+        if not steps:
+            raise ValueError(f"Volume binding without steps: {binding}")
+        return VolumeAction(steps, compile_repeat(binding, repeat_defaults))
+    if "key" in binding or "media_key" in binding:
+        return KeyAction(
+            button=_keyboard_key(binding.get("key", 0)),
+            media_key=_keyboard_key(binding.get("media_key", 0)),
+            modifier=_keyboard_key(binding.get("modifier", 0)),
+            repeat=compile_repeat(binding, repeat_defaults))
+    raise ValueError(f"Binding has no action: {binding}")
+
+
+def compile_macro(name, config):
+    """Compile a list of macro steps, TV steps run one after the other
+
+    A REST step with `"parallel": true` joins the TV step before it and is
+    sent without waiting for that one's reply. IRCC steps are key presses
+    whose order matters, they never overlap another call.
+    """
+    steps = []
+    for step in config:
+        if "delay" in step:
+            seconds = float(step["delay"])
+            if seconds < 0:
+                raise ValueError(f"Negative delay in macro '{name}'")
+            steps.append(Delay(seconds))
+            continue
+
+        action = compile_action(step)
+        if isinstance(action, VolumeAction):
+            raise ValueError(f"Macro '{name}' cannot use volume steps, use set_audio_volume")
+        if isinstance(action, TvAction):
+            if not step.get("parallel"):
+                steps.append(TvGroup([action]))
+                continue
+            if not steps or not isinstance(steps[-1], TvGroup) or \
+                    any(a.method == IRCC_METHOD for a in steps[-1].actions + (action,)):
+                raise ValueError(f"Parallel step must be a REST call after another in macro '{name}': {step}")
+            steps[-1] = TvGroup(steps[-1].actions + (action,))
+        else:
+            steps.append(KeyStep(action, float(step.get("hold", 0))))
+    if not steps:
+        raise ValueError(f"Macro '{name}' has no steps")
+    return Macro(name, steps)
+
+
+def compile_gesture(config, macros=None):
+    """Gesture with its action, `gesture` is one of tap, hold, double_tap or chord"""
+    if config.get("repeat"):
+        raise ValueError(f"Gestures cannot repeat: {config}")
+    kind = config.get("gesture")
+    action = compile_action(config, macros=macros)
+    if kind == "chord":
+        return Chord([_button(b) for b in config["buttons"]], action, float(config.get("window", CHORD_WINDOW)))
+    button = _button(config["button"])
+    if kind == "hold":
+        return LongPress(button, float(config["duration"]), action)
+    if kind == "double_tap":
+        return DoubleTap(button, action, float(config.get("window", DOUBLE_TAP_WINDOW)))
+    if kind == "tap":
+        max_duration = config.get("max_duration")
+        return Tap(button, action, float(max_duration) if max_duration is not None else None)
+    raise ValueError(f"Invalid gesture '{kind}', expected one of {GESTURES}")
+
+
+class Keymap(object):
+    """Dispatch table keyed by (active modifiers, event code, edge)
+
+    A binding only fires when exactly its modifiers are held, so holding R2
+    switches to a separate layer of bindings. Lookups are a single dict
+    access no matter how many bindings there are. `gestures` are handed to
+    the GestureRecognizer of each gamepad using the keymap.
+    """
+
+    def __init__(self, modifiers=(), bindings=(), gestures=()):
+        self.modifiers = frozenset(modifiers)
+        self.gestures = list(gestures)
+        self._table = {}
+        for modifier_set, code, edge, action in bindings:
+            self.bind(modifier_set, code, edge, action)
+
+    def bind(self, modifier_set, code, edge, action):
+        modifier_set = frozenset(modifier_set)
+        unknown = modifier_set - self.modifiers
+        if unknown:
+            raise ValueError(f"Undeclared modifiers {sorted(unknown)}")
+        key = (modifier_set, code, edge)
+        if key in self._table:
+            raise ValueError(f"Duplicate binding for {ecodes.BTN.get(code, code)}")
+        self._table[key] = action
+
+    def __len__(self):
+        return len(self._table)
+
+    def active_modifiers(self, pressed):
+        """Modifier set from the currently pressed keys"""
+        if not self.modifiers:
+            return NO_MODIFIERS
+        return self.modifiers.intersection(pressed)
+
+    def lookup(self, modifier_set, code, edge):
+        return self._table.get((modifier_set, code, edge))
+
+    @classmethod
+    def from_dict(cls, config):
+        keymap = cls(_button(m) for m in config.get("modifiers", ()))
+        repeat_defaults = config.get("repeat", {})
+        macros = {name: compile_macro(name, steps) for name, steps in config.get("macros", {}).items()}
+        for binding in config.get("bindings", ()):
+            edge = binding.get("on", "down")
+            if edge not in EDGES:
+                raise ValueError(f"Invalid edge '{edge}', expected one of {list(EDGES)}")
+            keymap.bind(
+                [_button(m) for m in binding.get("with", ())],
+                _button(binding["button"]),
+                EDGES[edge],
+                compile_action(binding, repeat_defaults, macros))
+        for gesture in config.get("gestures", ()):
+            keymap.gestures.append(compile_gesture(gesture, macros))
+        return keymap
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r") as fp:
+            keymap = cls.from_dict(json.load(fp))
+        log.info(f"Loaded {len(keymap)} bindings from {filename}")
+        return keymap
@@ -0,0 +1,181 @@
+import logging
+
+log = logging.getLogger("macro")
+
+
+class Delay(object):
+    __slots__ = ("seconds",)
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __repr__(self):
+        return f"Delay({self.seconds})"
+
+
+class KeyStep(object):
+    """Hold a keyboard key for `hold` seconds, 0 taps it"""
+    __slots__ = ("action", "hold")
+
+    def __init__(self, action, hold=0):
+        self.action = action
+        self.hold = hold
+
+    def __repr__(self):
+        return f"KeyStep({self.action}, {self.hold})"
+
+
+class TvGroup(object):
+    """TV calls which do not depend on each other and may overlap, often just one"""
+    __slots__ = ("actions",)
+
+    def __init__(self, actions):
+        self.actions = tuple(actions)
+
+    def __repr__(self):
+        return f"TvGroup({list(self.actions)})"
+
+
+class Macro(object):
+    """Compiled sequence of steps
+
+    Each TV group is sent once the step before it is done, the calls inside
+    a group overlap. Key and delay steps wait for the group before them too,
+    so keys are only pressed once the TV has reacted to the calls before.
+    """
+
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = tuple(steps)
+
+    def __repr__(self):
+        return f"Macro({self.name}, {list(self.steps)})"
+
+
+class MacroAction(object):
+    """Keymap action starting a macro"""
+    __slots__ = ("macro",)
+
+    repeat = None
+
+    def __init__(self, macro):
+        self.macro = macro
+
+    def __repr__(self):
+        return f"MacroAction({self.macro.name})"
+
+
+class MacroRun(object):
+    """One execution of a macro, steps are timed on absolute deadlines"""
+
+    def __init__(self, runner, macro):
+        self.runner = runner
+        self.macro = macro
+        self.index = 0
+        self.start = runner.tasks.clock()
+        self.when = self.start
+        self.outstanding = 0
+        self.tv_time = 0.0
+        self.tv_calls = 0
+        self.error = None
+
+    def step(self):
+        runner = self.runner
+        tasks = runner.tasks
+        while self.index < len(self.macro.steps):
+            step = self.macro.steps[self.index]
+            self.index += 1
+
+            if isinstance(step, Delay):
+                self.when += step.seconds
+                tasks.call_at(self.when, self.step)
+                return
+            if isinstance(step, KeyStep):
+                runner.press_key(step.action)
+                self.when += step.hold
+                tasks.call_at(self.when, self.release, step.action)
+                return
+            if isinstance(step, TvGroup):
+                self.outstanding = len(step.actions)
+                for action in step.actions:
+                    runner.submit(self, action)
+                return
+
+        runner.finished(self)
+
+    def release(self, action):
+        self.runner.release_key(action)
+        self.step()
+
+    def on_tv_done(self, elapsed, error):
+        self.outstanding -= 1
+        self.tv_calls += 1
+        self.tv_time += elapsed
+        if error is not None and self.error is None:
+            self.error = error
+        if self.outstanding:
+            return
+        if self.error is not None:
+            log.warning(f"Macro {self.macro.name} aborted: {self.error}")
+            self.runner.finished(self)
+            return
+        # Later steps are timed from when the TV answered
+        self.when = max(self.when, self.runner.tasks.clock())
+        self.step()
+
+
+class MacroRunner(object):
+    """Runs macros from the event loop
+
+    TV calls go through `dispatcher`, which should have as many workers as
+    the Bravia client has connections so a group's calls overlap. Keys are
+    reported through `press_key`/`release_key` so they mix with the keys
+    held on the gamepads. `on_finished(name, seconds)` gets the total latency.
+    """
+
+    def __init__(self, loop, dispatcher, tv, press_key, release_key, on_finished=None):
+        self.loop = loop
+        self.tasks = loop.tasks
+        self.dispatcher = dispatcher
+        self.tv = tv
+        self.press_key = press_key
+        self.release_key = release_key
+        self.on_finished = on_finished
+        self._running = {}
+
+    def is_running(self, name):
+        return name in self._running
+
+    def run(self, macro):
+        if macro.name in self._running:
+            log.info(f"Macro {macro.name} is already running")
+            return None
+        log.debug(f"Running macro {macro.name}")
+        run = self._running[macro.name] = MacroRun(self, macro)
+        run.step()
+        return run
+
+    def submit(self, run, action):
+        if not self.tv:
+            self.loop.call_soon_threadsafe(run.on_tv_done, 0.0, None)
+            return
+
+        start = self.tasks.clock()
+
+        def on_done(result, error):
+            # Measured on the worker so the loop's own latency is not included
+            elapsed = self.tasks.clock() - start
+            self.loop.call_soon_threadsafe(run.on_tv_done, elapsed, error)
+
+        self.dispatcher.submit(self.tv.invoke, action.method, *action.args,
+                               callback=on_done, **action.kwargs)
+
+    def finished(self, run):
+        self._running.pop(run.macro.name, None)
+        if run.error is not None:
+            return
+        total = self.tasks.clock() - run.start
+        log.info(f"Macro {run.macro.name} done in {total * 1e3:.1f} ms "
+                 f"({run.tv_calls} TV calls taking {run.tv_time * 1e3:.1f} ms back to back)")
+        if self.on_finished is not None:
+            self.on_finished(run.macro.name, total)
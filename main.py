@@ -1,18 +1,30 @@
 #!/usr/bin/env python3
 
+import os
 import signal
-import threading
-import subprocess
 import sys
 import time
 import logging
 
-from evdev import ecodes, categorize
+from evdev import ecodes
 
-from gamepad import get_gamepad_observer
+from control import ControlServer
+from eventloop import EventLoop
+from gamepad import get_gamepad_monitor
+from gamepad.bluez import BluezClient
+from gamepad.ds4 import Gamepad
+from gamepad.led import Animation, LedAnimator
+from gesture import GestureRecognizer, LongPress
 from keyboard import Keyboard
-from tasks import Tasks
-from tv.bravia import Bravia
+from keymap import Keymap, KeyAction, DOWN, UP
+from macro import MacroAction, MacroRunner
+from mouse import Mouse, PointerMapper
+from profiler import Profiler
+from repeat import AutoRepeat
+from stats import LatencyTracer
+from tv.bravia import Bravia, CATALOG_TTL, MACRO_WORKERS, POWER_STATUS_TTL
+from tv.dispatcher import CommandDispatcher
+from volume import VolumeAction, VolumeController
 
 log = logging.getLogger("main")
 log.setLevel(logging.INFO)
@@ -20,194 +32,599 @@ log.setLevel(logging.INFO)
 
 TV_URL = "http://192.168.1.2/sony"
 TV_AUTH_PSK = "1234"
+MOUSE_DEVICE = "/dev/hidg1"
+TV_CACHE_FILE = "/var/cache/gamepad-tv-remote/bravia.json"
 TIMEOUT_DURATION = 1800  # 30 minutes
+CONTROL_SOCKET = "/run/gamepad-remote.sock"
+# Input delays beyond this are clock artifacts rather than latency
+MAX_INPUT_DELAY = 10
+PROFILE_REPORT_FILE = "/run/gamepad-remote.profile"
+PROFILE_SAMPLE_INTERVAL = 0.01
+KEYMAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keymap.json")
+KEYMAP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keymaps")
+LOCK_HOLD_DURATION = 1
+DISCONNECT_HOLD_DURATION = 4
+LOW_BATTERY_LEVEL = 20
+
+COLOR_UNLOCKED = (0, 32, 0)
+COLOR_LOCKED = (32, 0, 0)
+# Pulse orange while the battery is low
+LOW_BATTERY_ANIMATION = Animation([(1.0, (32, 32, 0)), (1.0, (8, 8, 0))])
+# Sent for volume bindings while the TV's REST API cannot be used
+VOLUME_UP_KEY = KeyAction(Keyboard.KEY_VOLUME_UP)
+VOLUME_DOWN_KEY = KeyAction(Keyboard.KEY_VOLUME_DOWN)
+# Blink blue while a TV command takes longer than TV_BUSY_DELAY
+TV_BUSY_ANIMATION = Animation([(0.1, (0, 0, 32)), (0.1, None)])
+TV_BUSY_DELAY = 0.15
+
+
+class Controller(object):
+    """State of one connected gamepad"""
+
+    def __init__(self, gamepad, keymap, repeat, pointer=None):
+        self.gamepad = gamepad
+        self.leds = None
+        self.keymap = keymap
+        self.repeat = repeat
+        self.pointer = pointer
+        self.attached = False
+        self.locked = False
+        self.last_activity_ts = time.monotonic()
+        self.timeout_task = None
+        self.gestures = None
+        self.held = {}  # Gamepad button -> KeyAction held down on the keyboard
+        self.taps = []  # KeyActions pressed and released within the frame
+        self.keys_dirty = False
+        self.frame_start = None
+
+    def __repr__(self):
+        return repr(self.gamepad)
 
 
 class Application(object):
-    def __init__(self, tv=None):
+    def __init__(self, tv=None, keymap=None, kbd=None, loop=None, tv_queue=None, mouse=None, bluez=None,
+                 macro_queue=None, tv_factory=None):
         self._tv = tv
-        self._gamepad = None
-        self._gamepad_connected = threading.Event()
-        self._last_activity_ts = time.time()
-        self._locked = False
-        self._kbd = Keyboard()
-        self._stop = threading.Event()
-
-    def set_lock_status(self, status):
-        self._locked = status
-        if self._locked:
-            self._gamepad.set_led_colors(red=32, green=0, blue=0)
+        # Builds the TV client once the loop runs, see start()
+        self._tv_factory = tv_factory
+        self._turn_on_pending = False
+        self._keymap = keymap if keymap is not None else Keymap.load(KEYMAP_FILE)
+        self._keymaps = {}
+        self._tv_queue = tv_queue if tv_queue is not None else CommandDispatcher()
+        self._pads = []
+        self._loop = loop or EventLoop()
+        self._tasks = self._loop.tasks
+        self._kbd = kbd or Keyboard()
+        self._mouse = mouse
+        self._bluez = bluez if bluez is not None else BluezClient(self._loop, self._tasks)
+        self._tracer = LatencyTracer()
+        # Macros get their own workers so the calls of a step can overlap
+        self._macro_queue = macro_queue if macro_queue is not None else CommandDispatcher(
+            max_depth=16, workers=MACRO_WORKERS, name="tv-macro")
+        self._macro_keys = []
+        self._macros = MacroRunner(
+            self._loop, self._macro_queue, tv, self.press_macro_key, self.release_macro_key,
+            lambda name, seconds: self._tracer.record("macro", seconds))
+        self._volume = VolumeController(self._loop, self._tv_queue, tv, self.tap_volume_keys)
+        self._event_start = None
+        self._control = None
+        self._profiler = None
+        self._tv_busy = 0
+        self._tv_busy_task = None
+        # Work even while the gamepad is locked, unlike the keymap's gestures
+        self._system_gestures = [
+            LongPress(ecodes.BTN_SELECT, LOCK_HOLD_DURATION, self.on_lock_pressed),
+            LongPress(ecodes.BTN_MODE, DISCONNECT_HOLD_DURATION, self.on_disconnect_pressed),
+        ]
+
+    def get_keymap(self, gamepad):
+        """Keymap of a gamepad, `keymaps/<uniq>.json` if it exists or the default one"""
+        uniq = (gamepad.uniq or "").lower()
+        if not uniq:
+            return self._keymap
+        if uniq not in self._keymaps:
+            filename = os.path.join(KEYMAP_DIR, f"{uniq}.json")
+            self._keymaps[uniq] = Keymap.load(filename) if os.path.exists(filename) else self._keymap
+        return self._keymaps[uniq]
+
+    def set_lock_status(self, pad, status):
+        pad.locked = status
+        pad.repeat.stop_all()
+        if pad.locked:
+            self.release_keys(pad)
+            if pad.pointer is not None:
+                pad.pointer.reset()
+
+        pad.leds.set_base(*(COLOR_LOCKED if pad.locked else COLOR_UNLOCKED))
+        self.update_battery_led(pad)
+
+    def update_battery_led(self, pad):
+        gamepad = pad.gamepad
+        if (not pad.locked and gamepad.has_battery and gamepad.battery_level <= LOW_BATTERY_LEVEL
+                and gamepad.battery_status == "Discharging"):
+            pad.leds.play("battery", LOW_BATTERY_ANIMATION)
         else:
-            # Display orange LED if low battery
-            if self._gamepad.battery_level <= 20 and self._gamepad.battery_status == "Discharging":
-                self._gamepad.set_led_colors(red=32, green=32, blue=0)
-            else:
-                self._gamepad.set_led_colors(red=0, green=32, blue=0)
+            pad.leds.stop("battery")
 
     def on_gamepad_connected(self, gamepad_obj):
-        self._gamepad = gamepad_obj
-        self._last_activity_ts = time.time()
-        self.set_lock_status(False)  # Make sure the gampead is unlocked
-        self._gamepad_connected.set()
+        for pad in list(self._pads):
+            if pad.gamepad._udev_device is not None and pad.gamepad._udev_device == gamepad_obj._udev_device:
+                self._remove_pad(pad)
+
+        pad = Controller(
+            gamepad_obj, self.get_keymap(gamepad_obj),
+            AutoRepeat(self._tasks, self._tasks.clock, self.emit_repeat),
+            PointerMapper(self._mouse, self._tasks) if self._mouse is not None else None)
+        pad.leds = LedAnimator(self._tasks, gamepad_obj.set_led_colors)
+        pad.gestures = GestureRecognizer(
+            self._tasks, lambda gesture: self.on_gesture(pad, gesture),
+            self._system_gestures + pad.keymap.gestures)
+        self._pads.append(pad)
+        self.set_lock_status(pad, False)  # Make sure the gampead is unlocked
+        self._loop.register(gamepad_obj, lambda: self.on_gamepad_readable(pad))
+        pad.attached = True
+
+        if pad.pointer is not None:
+            for code in (ecodes.ABS_X, ecodes.ABS_Y):
+                abs_range = gamepad_obj.abs_range(code)
+                if abs_range:
+                    pad.pointer.set_stick_range(code, *abs_range)
+            touchpad = gamepad_obj.open_touchpad()
+            if touchpad is not None:
+                self._loop.register(touchpad, lambda: self.on_touchpad_readable(pad))
+
+        if gamepad_obj.is_bluetooth:
+            pad.timeout_task = self._tasks.call_later(
+                TIMEOUT_DURATION, self.check_gamepad_timeout, pad)
+
+        log.info(f"{gamepad_obj} connected ({len(self._pads)} gamepads)")
+        if gamepad_obj.has_battery:
+            log.info("{g} battery level: {g.battery_level}% ({g.battery_status})".format(g=gamepad_obj))
 
-        log.info(f"{self._gamepad} connected")
+        if self._tv:
+            self._tv_queue.submit(self._tv.turn_on, deadline=0)
+        elif self._tv_factory is not None:
+            self._turn_on_pending = True
 
-        self._tv.turn_on()
+        return pad
 
     def on_gamepad_disconnected(self, device):
-        if device == self._gamepad._udev_device:
-            log.info(f"{self._gamepad} disconnected")
-            self._gamepad_connected.clear()
-            self._gamepad = None
-
-    def on_key_down(self, event):
-        if self._gamepad.is_pressed(ecodes.BTN_TR2):
-            if event.code == ecodes.BTN_DPAD_UP:
-                self._kbd.press(self._kbd.KEY_VOLUME_UP)
-                return
-
-            elif event.code == ecodes.BTN_DPAD_DOWN:
-                self._kbd.press(self._kbd.KEY_VOLUME_DOWN)
-                return
-
-            elif event.code == ecodes.BTN_DPAD_LEFT:
-                self._kbd.press(media_key=self._kbd.KEY_MEDIA_PREV)
-                return
-
-            elif event.code == ecodes.BTN_DPAD_RIGHT:
-                self._kbd.press(media_key=self._kbd.KEY_MEDIA_NEXT)
-                return
-
-        elif event.code == ecodes.BTN_DPAD_UP:
-            self._kbd.press(self._kbd.KEY_UP)
-
-        elif event.code == ecodes.BTN_DPAD_DOWN:
-            self._kbd.press(self._kbd.KEY_DOWN)
-
-        elif event.code == ecodes.BTN_DPAD_LEFT:
-            self._kbd.press(self._kbd.KEY_LEFT)
-
-        elif event.code == ecodes.BTN_DPAD_RIGHT:
-            self._kbd.press(self._kbd.KEY_RIGHT)
-
-        elif event.code in (ecodes.BTN_SOUTH,):
-            self._kbd.press(self._kbd.KEY_RETURN)
-
-        elif event.code in (ecodes.BTN_START,):
-            self._kbd.press(self._kbd.KEY_RETURN, modifier=self._kbd.L_META)
-
-    def on_key_up(self, event):
-        if self._gamepad.is_pressed(ecodes.BTN_TR2):
-            if event.code in (ecodes.BTN_NORTH,):
-                self._tv.send_ircc_command("ActionMenu")
-                return
+        for pad in list(self._pads):
+            if device == pad.gamepad._udev_device:
+                log.info(f"{pad.gamepad} disconnected")
+                self._remove_pad(pad)
+
+    def _remove_pad(self, pad):
+        self._detach_gamepad(pad)
+        pad.gamepad.close_leds()
+        self._pads.remove(pad)
+
+    def _detach_gamepad(self, pad):
+        """Stop reading from the gamepad and cancel its timers"""
+        if not pad.attached:
+            return
+        pad.attached = False
+        self._loop.unregister(pad.gamepad)
+        pad.leds.stop_all()
+        pad.repeat.stop_all()
+        self.release_keys(pad)
+        if pad.pointer is not None:
+            pad.pointer.reset()
+            if pad.gamepad.touchpad is not None:
+                self._loop.unregister(pad.gamepad.touchpad)
+                pad.gamepad.close_touchpad()
+        pad.gestures.reset()
+        if pad.timeout_task is not None:
+            pad.timeout_task.cancel()
+            pad.timeout_task = None
+
+    def disconnect_gamepad(self, pad):
+        self._detach_gamepad(pad)
+        gamepad = pad.gamepad
+
+        def on_done(error):
+            if error is None:
+                log.info(f"{gamepad} disconnected via BlueZ")
+
+        gamepad.disconnect(self._bluez, on_done)
+
+    def on_gamepad_readable(self, pad):
+        try:
+            for event in pad.gamepad.read():
+                consumed = False
+                if event.type == ecodes.EV_KEY:
+                    delay = pad.gamepad.clock() - event.timestamp()
+                    # Also guards against a wall clock that was stepped
+                    if 0 <= delay < MAX_INPUT_DELAY:
+                        self._tracer.record("input", delay)
+                    consumed = pad.gestures.on_key(event.code, event.value)
+                self.process_event(pad, event, consumed)
+                if event.type == ecodes.EV_SYN and event.code == ecodes.SYN_REPORT:
+                    self.end_frame(pad)
+        except OSError as err:
+            # There seems to be an error reading the gamepad
+            # assume it got disconnected
+            log.warning("Failed to read from gamepad: {}".format(err))
+            self._detach_gamepad(pad)
+
+    def on_touchpad_readable(self, pad):
+        try:
+            events = pad.gamepad.read_touchpad()
+        except OSError as err:
+            log.warning("Failed to read from touchpad: {}".format(err))
+            self._loop.unregister(pad.gamepad.touchpad)
+            pad.gamepad.close_touchpad()
+            return
 
-            if event.code in (ecodes.BTN_NORTH,):
-                self._tv.send_ircc_command("SubTitle")
-                return
+        if pad.locked:
+            return
+        for event in events:
+            if pad.pointer.on_touch(event):
+                pad.last_activity_ts = time.monotonic()
+
+    def process_motion(self, pad, event):
+        """Feed the analog stick to the pointer, once per SYN_REPORT frame"""
+        if event.type == ecodes.EV_ABS:
+            if event.code == ecodes.ABS_X or event.code == ecodes.ABS_Y:
+                pad.pointer.on_stick(event.code, event.value)
+        elif event.type == ecodes.EV_SYN and event.code == ecodes.SYN_REPORT:
+            if pad.pointer.on_stick_frame():
+                pad.last_activity_ts = time.monotonic()
+
+    def on_gesture(self, pad, gesture):
+        if gesture in self._system_gestures:
+            gesture.action(pad)
+            return
+        if pad.locked:
+            return
 
-            if event.code in (ecodes.BTN_WEST,):
-                self._kbd.press(media_key=self._kbd.KEY_MEDIA_MUTE)
-                return
+        action = gesture.action
+        pad.last_activity_ts = time.monotonic()
+        if isinstance(action, KeyAction):
+            # Tapped, sent with the frame being read or right after a timer
+            pad.taps.append(action)
+            self.mark_keys_dirty(pad, self._tracer.clock())
+            self._tasks.call_later(0, self.end_frame, pad)
+        elif isinstance(action, MacroAction):
+            self._macros.run(action.macro)
+        elif isinstance(action, VolumeAction):
+            self._volume.change(action.steps)
+        else:
+            action.execute(self._kbd, self.send_tv_command)
 
-        elif event.code in (ecodes.BTN_TL,):
-            self._tv.send_ircc_command('Display')
+    def on_lock_pressed(self, pad):
+        self.set_lock_status(pad, not pad.locked)
 
-        elif event.code in (ecodes.BTN_EAST,):
-            self._kbd.press(self._kbd.KEY_ESC)
+    def on_disconnect_pressed(self, pad):
+        log.info("Disconnect command received")
+        self.disconnect_gamepad(pad)
+        if self._tv:
+            self._tv_queue.submit(self._tv.turn_off, deadline=0)
+
+    def held_actions(self):
+        for pad in self._pads:
+            yield from pad.held.values()
+        yield from self._macro_keys
+
+    def press_macro_key(self, action):
+        self._macro_keys.append(action)
+        self.flush_keys()
+
+    def release_macro_key(self, action):
+        self._macro_keys.remove(action)
+        self.flush_keys()
+
+    def write_keys(self, actions):
+        """Report the keys of `actions` as held on the keyboard"""
+        buttons = []
+        media_key = modifier = 0
+        for action in actions:
+            if action.button and action.button not in buttons:
+                buttons.append(action.button)
+            media_key |= action.media_key
+            modifier |= action.modifier
+        self._kbd.update(tuple(buttons), media_key, modifier)
+
+    def end_frame(self, pad):
+        """Send at most one keyboard report for everything that changed in the frame"""
+        if not pad.keys_dirty:
+            return
+        pad.keys_dirty = False
 
-        elif event.code in (ecodes.BTN_NORTH,):
-            self._kbd.press(self._kbd.KEY_BACKSPACE)
+        if pad.taps:
+            self.write_keys(list(self.held_actions()) + pad.taps)
+            pad.taps = []
+            # Keys mapped to a release are tapped, let go of them right after
+            self._tasks.call_later(0, self.flush_keys)
+        else:
+            self.flush_keys()
+
+        if pad.frame_start is not None:
+            self._tracer.since("hid", pad.frame_start)
+            pad.frame_start = None
+
+    def flush_keys(self):
+        self.write_keys(self.held_actions())
+
+    def release_keys(self, pad):
+        pad.taps = []
+        pad.keys_dirty = False
+        if pad.held:
+            pad.held.clear()
+            self.flush_keys()
+
+    def emit_repeat(self, action):
+        """Send one auto-repeat of a held key as a release/press pair"""
+        if isinstance(action, VolumeAction):
+            self._volume.change(action.steps)
+            return
+        self.write_keys([a for a in self.held_actions() if a is not action])
+        self.flush_keys()
+
+    def tap_volume_keys(self, steps):
+        """Volume steps as HID key taps, when the TV cannot be asked directly"""
+        key = VOLUME_UP_KEY if steps > 0 else VOLUME_DOWN_KEY
+        held = list(self.held_actions())
+        for _ in range(abs(steps)):
+            self.write_keys(held + [key])
+            self.write_keys(held)
+
+    def send_tv_command(self, method, *args, **kwargs):
+        if not self._tv:
+            return
 
-        elif event.code in (ecodes.BTN_WEST,):
-            self._kbd.press(media_key=self._kbd.KEY_MEDIA_PLAY)
+        start = self._event_start
+
+        def on_done(result, error):
+            if start is not None and error is None:
+                self._tracer.since("tv", start)
+            self._loop.call_soon_threadsafe(self.on_tv_command_done)
+
+        self.on_tv_command_started()
+        # Looked up on the worker, a failure there is only logged
+        self._tv_queue.submit(self._tv.invoke, method, *args, callback=on_done, **kwargs)
+
+    def on_tv_command_started(self):
+        self._tv_busy += 1
+        if self._tv_busy == 1:
+            self._tv_busy_task = self._tasks.call_later(TV_BUSY_DELAY, self.show_tv_busy, True)
+
+    def on_tv_command_done(self):
+        self._tv_busy -= 1
+        if self._tv_busy == 0:
+            if self._tv_busy_task is not None:
+                self._tv_busy_task.cancel()
+            self.show_tv_busy(False)
+
+    def show_tv_busy(self, busy):
+        """Blink the light bars while TV commands are in flight"""
+        self._tv_busy_task = None
+        for pad in self._pads:
+            if not pad.attached:
+                continue
+            if busy:
+                pad.leds.play("tv", TV_BUSY_ANIMATION, priority=1)
+            else:
+                pad.leds.stop("tv")
 
-    def process_event(self, event):
+    def process_event(self, pad, event, consumed=False):
+        """`consumed` events went into a gesture, only their release is handled"""
         if event.type != ecodes.EV_KEY:
+            if pad.pointer is not None and not pad.locked:
+                self.process_motion(pad, event)
             return
 
-        if not self._locked:
-            self._last_activity_ts = time.time()
-            if event.value != 0:
-                self.on_key_down(event)
-            else:
-                self.on_key_up(event)
-                self._kbd.release()  # Send a key-up signal
+        if not pad.locked:
+            start = self._event_start = self._tracer.clock()
+            pad.last_activity_ts = time.monotonic()
+            keymap = pad.keymap
+            modifiers = keymap.active_modifiers(pad.gamepad.get_active_keys())
+            edge = DOWN if event.value != 0 else UP
+            action = keymap.lookup(modifiers, event.code, edge) if not consumed else None
+            self._tracer.since("keymap", start)
+            if isinstance(action, KeyAction):
+                if edge == DOWN:
+                    pad.held[event.code] = action
+                    if action.repeat is not None:
+                        pad.repeat.start(event.code, action, action.repeat)
+                else:
+                    pad.taps.append(action)
+                self.mark_keys_dirty(pad, start)
+            elif isinstance(action, MacroAction):
+                self._macros.run(action.macro)
+            elif isinstance(action, VolumeAction):
+                self._volume.change(action.steps)
+                if edge == DOWN and action.repeat is not None:
+                    pad.repeat.start(event.code, action, action.repeat)
+            elif action is not None:
+                action.execute(self._kbd, self.send_tv_command)
+            if edge == UP:
+                pad.repeat.stop(event.code)
+                if event.code in keymap.modifiers:
+                    pad.repeat.stop_all()
+                if pad.held.pop(event.code, None) is not None:
+                    self.mark_keys_dirty(pad, start)
+            self._event_start = None
+
+    def mark_keys_dirty(self, pad, start):
+        if not pad.keys_dirty:
+            pad.keys_dirty = True
+            pad.frame_start = start
+
+    def get_profiler(self):
+        """Profiler for the hot paths, created on first use"""
+        if self._profiler is None:
+            profiler = Profiler()
+            profiler.add_target(EventLoop, "run_once")
+            profiler.add_target(Application, "on_gamepad_readable")
+            profiler.add_target(Application, "process_event")
+            profiler.add_target(Gamepad, "read")
+            profiler.add_target(Keyboard, "write")
+            profiler.add_target(Bravia, "_call")
+            profiler.add_target(Bravia, "send_ircc_command")
+            self._profiler = profiler
+        return self._profiler
+
+    def profile_command(self, action="report", sample_ms=None):
+        profiler = self.get_profiler()
+        if action == "on":
+            interval = float(sample_ms) / 1000 if sample_ms else None
+            profiler.disable()
+            profiler.reset()
+            profiler.enable(interval)
+            return "OK\n"
+        if action == "off":
+            profiler.disable()
+        elif action == "reset":
+            profiler.reset()
+            return "OK\n"
+        elif action != "report":
+            raise ValueError(f"Unknown profile action '{action}'")
+        return profiler.report()
+
+    def toggle_profiling(self):
+        """SIGUSR1: start profiling with stack sampling, or stop and write the report"""
+        profiler = self.get_profiler()
+        if not profiler.enabled:
+            profiler.reset()
+            profiler.enable(PROFILE_SAMPLE_INTERVAL)
+            return
+        profiler.disable()
+        report = profiler.report()
+        log.info("Profile:\n" + report)
+        try:
+            with open(PROFILE_REPORT_FILE, "w") as fp:
+                fp.write(report)
+        except OSError as err:
+            log.warning(f"Failed to write {PROFILE_REPORT_FILE}: {err}")
+
+    def start_control_server(self):
+        control = ControlServer(CONTROL_SOCKET, self._loop)
+        control.add_command("stats", self._tracer.report, "Show per-stage latency percentiles")
+        control.add_command("stats-reset", lambda: self._tracer.reset() or "OK\n", "Clear the latency histograms")
+        control.add_command("profile", self.profile_command,
+                            "profile on [sample ms] | off | reset | report: hot path counters")
+        try:
+            control.start()
+        except OSError as err:
+            log.warning(f"Control socket unavailable: {err}")
+            return
+        self._control = control
+        self._loop.register(control, control.handle_events)
+
+    def set_tv(self, tv):
+        self._tv = tv
+        self._macros.tv = tv
+        self._volume.tv = tv
+        tv.add_power_listener(
+            lambda status: self._loop.call_soon_threadsafe(self.on_tv_power_status, status))
+        tv.start_notifications()
+        self.create_tasks()
+        if self._turn_on_pending:
+            self._turn_on_pending = False
+            self._tv_queue.submit(tv.turn_on, deadline=0)
 
     def start(self):
-        get_gamepad_observer(
+        # Only what a button press needs is set up before the loop runs, so
+        # the first key reaches the host as early as possible
+        monitor = get_gamepad_monitor(
             self.on_gamepad_connected,
-            self.on_gamepad_disconnected).start()
+            self.on_gamepad_disconnected,
+            self._tasks,
+            self.on_battery_changed)
+        self._loop.register(monitor, monitor.handle_events)
+        monitor.start()
 
+        self._tasks.call_later(0, self.start_deferred)
         self._run()
 
+    def start_deferred(self):
+        """Everything the first button press does not need, run from the loop"""
+        start = time.monotonic()
+        self._tv_queue.start()
+        self._macro_queue.start()
+        self.start_control_server()
+
+        if self._tv_factory is not None and self._tv is None:
+            self.set_tv(self._tv_factory())
+        elif self._tv:
+            self.set_tv(self._tv)
+        log.debug(f"Deferred startup took {(time.monotonic() - start) * 1e3:.1f} ms")
+
     def stop(self, signum, frame):
-        self._stop.set()
+        self._loop.stop()
 
-    def check_gamepad_timeout(self):
+    def on_sigusr1(self, signum, frame):
+        self._loop.call_soon_threadsafe(self.toggle_profiling)
+
+    def check_gamepad_timeout(self, pad):
         """Disconnect gamepad it has not been used for some time"""
-        if self._gamepad.is_bluetooth:
-            if time.time() - self._last_activity_ts >= TIMEOUT_DURATION:
-                self._gamepad_connected.clear()
-                self._gamepad.disconnect()
+        pad.timeout_task = None
+        if not pad.attached:
+            return
 
-    def check_gamepad_battery(self):
-        """Check gamepad battery status"""
-        if self._gamepad.has_battery:
-            log.info("Gamepad battery level: {g.battery_level}% ({g.battery_status})".format(g=self._gamepad))
+        idle = time.monotonic() - pad.last_activity_ts
+        if idle >= TIMEOUT_DURATION:
+            self.disconnect_gamepad(pad)
+        else:
+            pad.timeout_task = self._tasks.call_later(
+                TIMEOUT_DURATION - idle, self.check_gamepad_timeout, pad)
+
+    def on_battery_changed(self, device):
+        """Battery uevent of any power supply, update the gamepad it belongs to"""
+        for pad in self._pads:
+            gamepad = pad.gamepad
+            if not gamepad.is_battery(device):
+                continue
+            previous = gamepad.battery_level, gamepad.battery_status
+            gamepad.update_battery(device)
+            if (gamepad.battery_level, gamepad.battery_status) != previous:
+                log.info("{g} battery level: {g.battery_level}% ({g.battery_status})".format(g=gamepad))
+            if pad.attached:
+                self.update_battery_led(pad)
+
+    def on_tv_power_status(self, status):
+        """Disconnect bluetooth gamepads if TV is not powered on"""
+        if status == "active":
+            return
+        for pad in self._pads:
+            if pad.attached and pad.gamepad.is_bluetooth:
+                log.info(f"TV power status is {status}")
+                self.disconnect_gamepad(pad)
 
     def check_tv_power_status(self):
-        """Disconnect bluetooth gamepad if TV is not powered on"""
-        if self._gamepad.is_bluetooth and self._tv.get_power_status() != "active":
-            self._gamepad_connected.clear()
-            self._gamepad.disconnect()
+        if self._tv.is_power_status_fresh(POWER_STATUS_TTL):
+            self.on_tv_power_status(self._tv.power_status)
+            return
 
-    def create_tasks(self):
-        tasks = Tasks()
+        # Ask the TV from the worker thread, the answer is handled on the loop
+        def on_done(status, error):
+            if error is None:
+                self._loop.call_soon_threadsafe(self.on_tv_power_status, status)
 
-        tasks.add(self.check_gamepad_timeout)
-        tasks.add_periodic(300, self.check_gamepad_battery)
-        if self._tv:
-            tasks.add_periodic(60, self.check_tv_power_status)
+        self._tv_queue.submit(
+            self._tv.get_power_status, max_age=POWER_STATUS_TTL, callback=on_done)
 
-        return tasks
+    def create_tasks(self):
+        if self._tv:
+            self._tasks.add_periodic(POWER_STATUS_TTL, self.check_tv_power_status)
+            self._tasks.add_periodic(
+                CATALOG_TTL, self._tv.refresh_catalog_async, delay=CATALOG_TTL)
 
     def _run(self):
         log.debug("_run()")
 
-        side_tasks = self.create_tasks()
+        try:
+            self._loop.run()
+        except Exception:
+            log.exception("Unexpected error")
+            # Stop the application and let systemd handle the restart
 
-        while not self._stop.is_set():
-            if not self._gamepad_connected.wait(1):
-                continue
-            try:
-                try:
-                    for event in self._gamepad.read():
-                        self.process_event(event)
-                except OSError as err:
-                    # There seems to be an error reading the gamepad
-                    # assume it got disconnected
-                    log.warn("Failed to read from gamepad: {}".format(err))
-                    self._gamepad_connected.clear()
-                    continue
-
-                # Lock signal
-                if self._gamepad.is_pressed(ecodes.BTN_SELECT, min_duration=1):
-                    self.set_lock_status(not self._locked)
-
-                # Disconnect Signal
-                if self._gamepad.is_pressed(ecodes.BTN_MODE, min_duration=4):
-                    log.info("Disconnect command received")
-                    self._gamepad.disconnect()
-                    if self._tv:
-                        self._tv.turn_off()
-                    continue
-
-                side_tasks.do()
-
-            except Exception:
-                log.exception("Unexpected error")
-                break  # Stop the application and let systemd handle the restart
+        self._tv_queue.stop(timeout=5)
+        self._macro_queue.stop(timeout=5)
+        if self._control is not None:
+            self._control.close()
+        self._bluez.close()
 
 
 def main():
@@ -218,10 +635,14 @@ def main():
     logging.getLogger('urllib3.connectionpool').setLevel(logging.INFO)
     logging.getLogger('tv.bravia').setLevel(logging.INFO)
 
-    app = Application(tv=Bravia(TV_URL, auth_psk=TV_AUTH_PSK))
+    mouse = Mouse(MOUSE_DEVICE) if os.path.exists(MOUSE_DEVICE) else None
+    app = Application(
+        tv_factory=lambda: Bravia(TV_URL, auth_psk=TV_AUTH_PSK, cache_file=TV_CACHE_FILE),
+        mouse=mouse)
 
     signal.signal(signal.SIGTERM, app.stop)
     signal.signal(signal.SIGINT, app.stop)
+    signal.signal(signal.SIGUSR1, app.on_sigusr1)
 
     app.start()
     log.info("Bye")
@@ -0,0 +1,187 @@
+import logging
+import math
+import struct
+
+from evdev import ecodes
+
+from hidgadget import HIDDevice
+
+log = logging.getLogger("mouse")
+
+
+class Mouse(HIDDevice):
+    BTN_LEFT = 0x01
+    BTN_RIGHT = 0x02
+    BTN_MIDDLE = 0x04
+
+    _EVENT_FORMAT = str('Bbbb')
+
+    def __init__(self, device_node="/dev/hidg1"):
+        super().__init__(device_node)
+
+    def move(self, dx=0, dy=0, wheel=0, buttons=0):
+        self.write(struct.pack(self._EVENT_FORMAT, buttons, dx, dy, wheel))
+
+
+def _clamp(value, limit=127):
+    return max(-limit, min(limit, value))
+
+
+class PointerMapper(object):
+    """Turn stick and touchpad input into rate limited relative mouse reports
+
+    Axis events are only stored as they arrive and evaluated once per
+    SYN_REPORT frame. Motion is accumulated and written at most once per
+    `interval`, the USB poll interval of the mouse gadget. While the stick
+    rests in its deadzone no timer is running.
+    """
+
+    def __init__(self, mouse, tasks, interval=0.008, deadzone=0.15,
+                 stick_speed=600, stick_exponent=2.0,
+                 touchpad_gain=0.6, touchpad_accel=0.002):
+        self._mouse = mouse
+        self._tasks = tasks
+        self.interval = interval
+        self.deadzone = deadzone
+        self.stick_speed = stick_speed  # Pixels per second at full deflection
+        self.stick_exponent = stick_exponent
+        self.touchpad_gain = touchpad_gain
+        self.touchpad_accel = touchpad_accel
+
+        self._stick_range = {ecodes.ABS_X: (0, 255), ecodes.ABS_Y: (0, 255)}
+        self._stick = {ecodes.ABS_X: 0.0, ecodes.ABS_Y: 0.0}
+        self._stick_velocity = (0.0, 0.0)
+        self._stick_task = None
+        self._stick_ts = 0
+
+        self._touching = False
+        self._touch_pos = {}
+        self._touch_last = None
+
+        self._dx = 0.0
+        self._dy = 0.0
+        self._buttons = 0
+        self._reported_buttons = 0
+        self._flush_task = None
+        self._last_report = -math.inf
+
+    def set_stick_range(self, code, minimum, maximum):
+        if maximum > minimum:
+            self._stick_range[code] = (minimum, maximum)
+
+    def reset(self):
+        for code in self._stick:
+            self._stick[code] = 0.0
+        self._stick_velocity = (0.0, 0.0)
+        if self._stick_task is not None:
+            self._stick_task.cancel()
+            self._stick_task = None
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._touching = False
+        self._touch_last = None
+        self._dx = self._dy = 0.0
+        if self._buttons or self._reported_buttons:
+            self._buttons = 0
+            self._flush()
+
+    # Analog stick
+
+    def on_stick(self, code, value):
+        minimum, maximum = self._stick_range[code]
+        self._stick[code] = (2.0 * (value - minimum) / (maximum - minimum)) - 1.0
+
+    def on_stick_frame(self):
+        """Returns True while the stick is moving the pointer"""
+        x, y = self._stick[ecodes.ABS_X], self._stick[ecodes.ABS_Y]
+        magnitude = math.hypot(x, y)
+        if magnitude <= self.deadzone:
+            self._stick_velocity = (0.0, 0.0)
+            if self._stick_task is not None:
+                self._stick_task.cancel()
+                self._stick_task = None
+            return False
+
+        # Rescale outside the deadzone and apply the acceleration curve
+        scaled = min(1.0, (magnitude - self.deadzone) / (1.0 - self.deadzone))
+        speed = self.stick_speed * scaled ** self.stick_exponent
+        self._stick_velocity = (speed * x / magnitude, speed * y / magnitude)
+
+        if self._stick_task is None:
+            self._stick_ts = self._tasks.clock()
+            self._stick_task = self._tasks.add_periodic(self.interval, self._stick_tick)
+        return True
+
+    def _stick_tick(self):
+        now = self._tasks.clock()
+        elapsed, self._stick_ts = now - self._stick_ts, now
+        vx, vy = self._stick_velocity
+        self._dx += vx * elapsed
+        self._dy += vy * elapsed
+        self._request_flush()
+
+    # Touchpad
+
+    def on_touch(self, event):
+        """Returns True at the end of a frame in which the touchpad was used"""
+        if event.type == ecodes.EV_ABS:
+            if event.code in (ecodes.ABS_X, ecodes.ABS_Y):
+                self._touch_pos[event.code] = event.value
+        elif event.type == ecodes.EV_KEY:
+            if event.code == ecodes.BTN_TOUCH:
+                self._touching = bool(event.value)
+                if not self._touching:
+                    self._touch_last = None
+            elif event.code == ecodes.BTN_LEFT:
+                if event.value:
+                    self._buttons |= Mouse.BTN_LEFT
+                else:
+                    self._buttons &= ~Mouse.BTN_LEFT
+        elif event.type == ecodes.EV_SYN and event.code == ecodes.SYN_REPORT:
+            return self.on_touch_frame()
+        return False
+
+    def on_touch_frame(self):
+        if self._touching and len(self._touch_pos) == 2:
+            pos = (self._touch_pos[ecodes.ABS_X], self._touch_pos[ecodes.ABS_Y])
+            if self._touch_last is not None:
+                dx, dy = pos[0] - self._touch_last[0], pos[1] - self._touch_last[1]
+                gain = self.touchpad_gain * (1 + self.touchpad_accel * math.hypot(dx, dy))
+                self._dx += dx * gain
+                self._dy += dy * gain
+            self._touch_last = pos
+
+        if self._dx or self._dy or self._buttons != self._reported_buttons:
+            self._request_flush()
+        return self._touching or bool(self._buttons)
+
+    # Report writer
+
+    def _request_flush(self):
+        if self._flush_task is not None:
+            return  # Already scheduled, motion is coalesced into that report
+        delay = self._last_report + self.interval - self._tasks.clock()
+        if delay <= 0:
+            self._flush()
+        else:
+            self._flush_task = self._tasks.call_later(delay, self._flush)
+
+    def _flush(self):
+        self._flush_task = None
+        dx, dy = _clamp(int(self._dx)), _clamp(int(self._dy))
+        if not (dx or dy or self._buttons != self._reported_buttons):
+            return
+
+        # Keep the fractional part and anything above the report range
+        self._dx -= dx
+        self._dy -= dy
+        try:
+            self._mouse.move(dx, dy, 0, self._buttons)
+        except OSError as err:
+            log.warning(f"Failed to write mouse report: {err}")
+        self._reported_buttons = self._buttons
+        self._last_report = self._tasks.clock()
+
+        if abs(self._dx) >= 1 or abs(self._dy) >= 1:
+            self._request_flush()
@@ -0,0 +1,175 @@
+import collections
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+
+log = logging.getLogger("profiler")
+
+
+SAMPLE_DEPTH = 8
+REPORT_STACKS = 10
+
+
+class CallStats(object):
+    __slots__ = ("calls", "total", "max", "_lock")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self.calls = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def add(self, elapsed):
+        # Bravia calls are counted from the dispatcher threads
+        with self._lock:
+            self.calls += 1
+            self.total += elapsed
+            if elapsed > self.max:
+                self.max = elapsed
+
+
+class Profiler(object):
+    """Call counters and stack sampling which can be switched on at runtime
+
+    Targets are wrapped in place when profiling is enabled and the original
+    functions are put back when it is disabled, so nothing is measured and
+    nothing costs anything while it is off. Generator functions are timed
+    for each item they produce, not for the time their consumer takes.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.enabled = False
+        self.started = None
+        self.stopped = None
+        self._targets = []
+        self._originals = []
+        self._stats = {}
+        self._samples = collections.Counter()
+        self._sample_count = 0
+        self._sampler = None
+        self._sampler_stop = threading.Event()
+
+    def add_target(self, owner, name, label=None):
+        """Profile `owner.name`, a class or an instance attribute"""
+        label = label or "{}.{}".format(getattr(owner, "__name__", type(owner).__name__), name)
+        self._targets.append((owner, name, label))
+
+    def _wrap(self, func, stats):
+        clock = self.clock
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                gen = func(*args, **kwargs)
+                elapsed = 0.0
+                try:
+                    while True:
+                        start = clock()
+                        try:
+                            item = next(gen)
+                        except StopIteration:
+                            return
+                        finally:
+                            elapsed += clock() - start
+                        yield item
+                finally:
+                    stats.add(elapsed)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = clock()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    stats.add(clock() - start)
+
+        return wrapper
+
+    def enable(self, sample_interval=None):
+        """Start counting, with `sample_interval` seconds also sample the main thread's stack"""
+        if self.enabled:
+            return
+        self.enabled = True
+        self.started = time.monotonic()
+        self.stopped = None
+
+        for owner, name, label in self._targets:
+            func = getattr(owner, name)
+            own = name in vars(owner)
+            stats = self._stats.setdefault(label, CallStats())
+            setattr(owner, name, self._wrap(func, stats))
+            self._originals.append((owner, name, func if own else None))
+
+        if sample_interval:
+            self._sampler_stop.clear()
+            self._sampler = threading.Thread(
+                target=self._sample, args=(threading.main_thread().ident, sample_interval),
+                name="profiler", daemon=True)
+            self._sampler.start()
+        log.info("Profiling enabled" + (f", sampling every {sample_interval * 1e3:.0f} ms"
+                                        if sample_interval else ""))
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.stopped = time.monotonic()
+        for owner, name, func in reversed(self._originals):
+            if func is None:
+                delattr(owner, name)  # It was inherited
+            else:
+                setattr(owner, name, func)
+        self._originals = []
+
+        if self._sampler is not None:
+            self._sampler_stop.set()
+            self._sampler.join()
+            self._sampler = None
+        log.info("Profiling disabled")
+
+    def reset(self):
+        for stats in self._stats.values():
+            stats.clear()
+        self._samples.clear()
+        self._sample_count = 0
+        self.started = time.monotonic() if self.enabled else None
+        self.stopped = None
+
+    def _sample(self, thread_id, interval):
+        while not self._sampler_stop.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None and len(stack) < SAMPLE_DEPTH:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self._samples[tuple(stack)] += 1
+            self._sample_count += 1
+
+    def report(self):
+        lines = []
+        if self.started is not None:
+            duration = (self.stopped or time.monotonic()) - self.started
+            lines.append(f"profiled for {duration:.1f} s{'' if self.enabled else ' (stopped)'}")
+        lines.append("{:<32} {:>9} {:>11} {:>10} {:>10}".format("function", "calls", "total ms", "mean us", "max us"))
+        for label, stats in self._stats.items():
+            mean = stats.total / stats.calls if stats.calls else 0.0
+            lines.append("{:<32} {:>9} {:>11.3f} {:>10.1f} {:>10.1f}".format(
+                label, stats.calls, stats.total * 1e3, mean * 1e6, stats.max * 1e6))
+
+        if self._sample_count:
+            lines.append(f"\n{self._sample_count} stack samples of the main thread:")
+            for stack, count in self._samples.most_common(REPORT_STACKS):
+                lines.append(f"{count * 100 / self._sample_count:5.1f}%  " + " < ".join(stack))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,93 @@
+import logging
+
+log = logging.getLogger("repeat")
+
+
+class RepeatConfig(object):
+    """Auto-repeat timing of a held button
+
+    The first repeat comes after `delay` seconds. The repeat rate then
+    ramps linearly from `rate` to `max_rate` repeats per second over
+    `accel_time` seconds.
+    """
+
+    __slots__ = ("delay", "rate", "max_rate", "accel_time")
+
+    def __init__(self, delay=0.4, rate=8, max_rate=None, accel_time=0):
+        if delay < 0 or rate <= 0:
+            raise ValueError("Repeat delay must be >= 0 and rate > 0")
+        self.delay = delay
+        self.rate = rate
+        self.max_rate = max(max_rate or rate, rate)
+        self.accel_time = accel_time
+
+    def interval(self, elapsed):
+        """Time to the next repeat, `elapsed` seconds after the first one"""
+        if self.accel_time and elapsed < self.accel_time:
+            rate = self.rate + (self.max_rate - self.rate) * elapsed / self.accel_time
+        else:
+            rate = self.max_rate
+        return 1.0 / rate
+
+    @classmethod
+    def from_dict(cls, config, defaults=None):
+        values = dict(defaults or {})
+        values.update(config)
+        return cls(**values)
+
+    def __repr__(self):
+        return f"RepeatConfig({self.delay}, {self.rate}, {self.max_rate}, {self.accel_time})"
+
+
+class _Repeat(object):
+    __slots__ = ("action", "config", "first", "deadline", "task")
+
+    def __init__(self, action, config, first):
+        self.action = action
+        self.config = config
+        self.first = first
+        self.deadline = first
+        self.task = None
+
+
+class AutoRepeat(object):
+    """Timer driven key repeat
+
+    Deadlines are absolute and derived from the previous deadline, so the
+    repeat period does not drift with the time spent handling each tick.
+    """
+
+    def __init__(self, tasks, clock, emit):
+        """`emit(action)` sends one repeat of the action"""
+        self._tasks = tasks
+        self._clock = clock
+        self._emit = emit
+        self._active = {}
+
+    def __contains__(self, key):
+        return key in self._active
+
+    def start(self, key, action, config):
+        self.stop(key)
+        repeat = _Repeat(action, config, self._clock() + config.delay)
+        repeat.task = self._tasks.call_at(repeat.deadline, self._tick, key, repeat)
+        self._active[key] = repeat
+
+    def _tick(self, key, repeat):
+        self._emit(repeat.action)
+        interval = repeat.config.interval(repeat.deadline - repeat.first)
+        repeat.deadline += interval
+        now = self._clock()
+        if repeat.deadline <= now:
+            # Fell behind, skip ahead instead of sending a burst
+            repeat.deadline = now + interval
+        repeat.task = self._tasks.call_at(repeat.deadline, self._tick, key, repeat)
+
+    def stop(self, key):
+        repeat = self._active.pop(key, None)
+        if repeat is not None:
+            repeat.task.cancel()
+
+    def stop_all(self):
+        for key in list(self._active):
+            self.stop(key)
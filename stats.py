@@ -0,0 +1,101 @@
+import bisect
+import logging
+import time
+
+log = logging.getLogger("stats")
+
+
+def _bucket_bounds(start=10e-6, stop=10.0, steps_per_doubling=4):
+    """Logarithmic bucket upper bounds in seconds, ~19% apart"""
+    bounds = []
+    value = start
+    factor = 2 ** (1 / steps_per_doubling)
+    while value < stop:
+        bounds.append(value)
+        value *= factor
+    bounds.append(stop)
+    return bounds
+
+
+BUCKET_BOUNDS = _bucket_bounds()
+
+
+class LatencyHistogram(object):
+    """Fixed bucket histogram, recording is a bisect and an increment"""
+
+    __slots__ = ("counts", "total", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile"""
+        if not self.total:
+            return 0.0
+        target = self.total * p / 100
+        count = 0
+        for i, n in enumerate(self.counts):
+            count += n
+            if count >= target:
+                return BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.total if self.total else 0.0
+
+
+class LatencyTracer(object):
+    """Per-stage latency histograms
+
+    Stages are measured from the moment an input event is read, using the
+    monotonic clock, except for `input` which is the delay between the
+    kernel event timestamp (on the monotonic clock as well where the
+    device allows it) and the read and `macro` which is the total
+    duration of a macro run.
+    """
+
+    STAGES = ("input", "keymap", "hid", "tv", "macro")
+
+    def __init__(self, enabled=True, clock=time.monotonic):
+        self.enabled = enabled
+        self.clock = clock
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.started = time.time()
+
+    def record(self, stage, seconds):
+        if self.enabled:
+            self.histograms[stage].record(seconds)
+
+    def since(self, stage, start):
+        if self.enabled:
+            self.histograms[stage].record(self.clock() - start)
+
+    def reset(self):
+        for stage in self.histograms:
+            self.histograms[stage] = LatencyHistogram()
+        self.started = time.time()
+
+    def report(self):
+        lines = ["{:<8} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+            "stage", "count", "p50 ms", "p95 ms", "p99 ms", "max ms")]
+        for stage, hist in self.histograms.items():
+            lines.append("{:<8} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+                stage, hist.total,
+                hist.percentile(50) * 1000, hist.percentile(95) * 1000,
+                hist.percentile(99) * 1000, hist.max * 1000))
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename):
+        with open(filename, "w") as fp:
+            fp.write(self.report())
@@ -1,32 +1,69 @@
+import heapq
+import itertools
 import time
-import types
+
+
+class Task(object):
+    __slots__ = ("when", "period", "func", "args", "cancelled")
+
+    def __init__(self, when, period, func, args):
+        self.when = when
+        self.period = period
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
 
 class Tasks(object):
-    def __init__(self):
-        self._tasks = []
-
-    def _periodic(self, period, func, *args, **kwargs):
-        next_t = 0
-        while True:
-            now = time.time()
-            if now >= next_t:
-                func(*args, **kwargs)
-                next_t = now + period
-            yield
-    
-    def _always(self, func, *args, **kwargs):
-        while True:
-            yield func(*args, **kwargs)
-
-    def add(self, func):
-        if not isinstance(func, types.GeneratorType):
-            func = self._always(func)
-        self._tasks.append(func)
-
-    def add_periodic(self, period, func):
-        self._tasks.append(
-            self._periodic(period, func))
+    """Deadline ordered scheduler
+
+    Tasks are kept in a heap ordered by their due time, `timeout()` tells
+    the event loop exactly how long it may sleep before the next one is due.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _push(self, task):
+        heapq.heappush(self._heap, (task.when, next(self._seq), task))
+        return task
+
+    def call_at(self, when, func, *args):
+        return self._push(Task(when, None, func, args))
+
+    def call_later(self, delay, func, *args):
+        return self.call_at(self.clock() + delay, func, *args)
+
+    def add_periodic(self, period, func, *args, delay=0):
+        return self._push(Task(self.clock() + delay, period, func, args))
+
+    def timeout(self):
+        """Seconds until the next task is due, None if there is nothing scheduled"""
+        heap = self._heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        return max(0, heap[0][0] - self.clock())
 
     def do(self):
-        for task in self._tasks:
-            next(task)
\ No newline at end of file
+        heap = self._heap
+        now = self.clock()
+        while heap and heap[0][0] <= now:
+            _, _, task = heapq.heappop(heap)
+            if task.cancelled:
+                continue
+            if task.period is not None:
+                task.when += task.period
+                if task.when <= now:
+                    task.when = now + task.period
+                self._push(task)
+            task.func(*task.args)
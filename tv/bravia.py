@@ -1,95 +1,377 @@
+import itertools
 import json
 import logging
+import random
+import threading
+import time
 import xml.etree.ElementTree as ET
 
+from .breaker import CircuitBreaker
+from .cache import TVCache
+from .catalog import Catalog, app_entry, channel_entry
+from .notify import PowerNotifier
+
 log = logging.getLogger("tv.bravia")
 
 
+IRCC_ENVELOPE = (
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+        '<s:Body>'
+            '<u:X_SendIRCC xmlns:u="urn:schemas-sony-com:service:IRCC:1">'
+                '<IRCCCode>{ircc_code}</IRCCCode>'
+            '</u:X_SendIRCC>'
+        '</s:Body>'
+    '</s:Envelope>')
+
+IRCC_HEADERS = {
+    "Content-Type": "text/xml; charset=UTF-8",
+    "SOAPACTION": "\"urn:schemas-sony-com:service:IRCC:1#X_SendIRCC\"",
+}
+
+JSON_HEADERS = {
+    "Content-Type": "application/json; charset=UTF-8",
+}
+
+CACHE_TTL = 7 * 24 * 3600  # 1 week
+POWER_STATUS_TTL = 60
+# How long the speaker volume read from the TV is trusted without notifications
+VOLUME_TTL = 10
+# Workers running macro steps, the calls of a step overlap up to this
+MACRO_WORKERS = 2
+# Connections kept to the TV, one for every thread that may call it at the
+# same time: the command worker, the macro workers and the refresh and
+# catalog threads. A smaller pool closes the surplus connections after use
+POOL_SIZE = 1 + MACRO_WORKERS + 2
+CATALOG_TTL = 24 * 3600
+# getContentList returns at most this many items per call
+CONTENT_PAGE_SIZE = 200
+
+# Seconds to connect and to wait for the answer. Commands are sent from the
+# input path and must fail quickly, the lists can take the TV a while
+CONNECT_TIMEOUT = 1.0
+COMMAND_TIMEOUT = 2.0
+LIST_TIMEOUT = 10.0
+LIST_METHODS = {"getApplicationList", "getContentList"}
+# Reads (get* methods) are retried after a jittered, doubling delay
+READ_RETRIES = 2
+RETRY_DELAY = 0.1
+# Consecutive connection failures after which calls fail without trying,
+# and for how long before the next call probes the TV again
+BREAKER_THRESHOLD = 3
+BREAKER_RESET_TIMEOUT = 5.0
+
+SOAP_NS = "{http://schemas.xmlsoap.org/soap/envelope/}"
+UPNP_NS = "{urn:schemas-upnp-org:control-1-0}"
+
+
+class BraviaError(Exception):
+    """The TV answered with an error"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class BraviaUnavailable(BraviaError):
+    """The TV could not be reached, did not answer in time or is known to be unreachable"""
+
+
 class Bravia(object):
-    def __init__(self, url, auth_psk):
+    def __init__(self, url, auth_psk, cache_file=None, cache_ttl=CACHE_TTL, catalog_ttl=CATALOG_TTL):
+        """Does not talk to the TV
+
+        System and remote controller information and the app/channel catalog
+        are taken from the cache when available and (re)fetched from the TV
+        in the background.
+        """
         self._url = url
         self._psk = auth_psk
-        self._id = 1
-        self.sys_info = self.get_system_information()
+        self._ids = itertools.count(1)
+        self._breaker = CircuitBreaker("TV", BREAKER_THRESHOLD, BREAKER_RESET_TIMEOUT)
+        self._session = self._create_session()
+        self._ircc_prefix, self._ircc_suffix = [
+            part.encode() for part in IRCC_ENVELOPE.split("{ircc_code}")]
+        self._ircc_payloads = {}
+        self._refresh_lock = threading.Lock()
+        self._catalog_lock = threading.Lock()
+        self._catalog_ttl = catalog_ttl
+        self._cache = TVCache(cache_file, cache_ttl) if cache_file else None
 
+        self.sys_info = {}
         self.remote_info = {}
-        for ircc_cmd in self.get_remote_controller_info()[1]:
-            self.remote_info[ircc_cmd['name']] = ircc_cmd['value']
+        self.catalog = Catalog()
 
-    def _call(self, service, method, version="1.0", **params):
+        self._power_status = None
+        self._power_status_ts = 0
+        self._power_listeners = []
+        self._volume = None
+        self._volume_ts = 0
+        self._notifier = None
+
+        is_fresh = False
+        if self._cache:
+            entry, is_fresh = self._cache.load(url)
+            if entry:
+                log.info("Using cached TV information")
+                self.sys_info = entry.get("sys_info", {})
+                self._set_remote_info(entry.get("remote_info", {}))
+                self.catalog = Catalog.from_dict(entry.get("catalog", {}))
+
+        if not is_fresh:
+            self.refresh_async()
+        elif not self.catalog.is_fresh(catalog_ttl):
+            self.refresh_catalog_async()
+
+    def _set_remote_info(self, remote_info):
+        self.remote_info = remote_info
+        self._ircc_payloads = {}
+
+    def refresh(self):
+        """Fetch system and remote controller information and update the cache"""
+        with self._refresh_lock:
+            sys_info = self.get_system_information()
+            remote_info = {}
+            for ircc_cmd in self.get_remote_controller_info()[1]:
+                remote_info[ircc_cmd['name']] = ircc_cmd['value']
+
+            self.sys_info = sys_info
+            self._set_remote_info(remote_info)
+            if self._cache:
+                self._cache.store_info(self._url, TVCache.tv_key(sys_info), sys_info, remote_info)
+            log.debug("TV information refreshed")
+
+    def _try_refresh(self):
+        try:
+            self.refresh()
+        except Exception as err:
+            log.warning("Failed to read TV information: {0}".format(err))
+            return
+        if not self.catalog.is_fresh(self._catalog_ttl):
+            self._try_refresh_catalog()
+
+    def refresh_async(self):
+        threading.Thread(target=self._try_refresh, name="bravia-refresh", daemon=True).start()
+
+    def refresh_catalog(self):
+        """Fetch the apps and channels and replace the catalog if anything changed
+
+        Entries the TV no longer lists are dropped. Channels are fetched page
+        by page. Returns False if a refresh was already running.
+        """
+        if not self._catalog_lock.acquire(blocking=False):
+            return False
+        try:
+            apps = [app_entry(app) for app in self.get_application_list()[0]]
+            channels = []
+            while True:
+                try:
+                    page = self.get_tv_channels(start=len(channels))
+                except BraviaUnavailable:
+                    raise
+                except BraviaError:
+                    if not channels:
+                        raise
+                    break  # Some TVs answer past the last channel with an error
+                channels.extend(channel_entry(channel) for channel in page)
+                if len(page) < CONTENT_PAGE_SIZE:
+                    break
+
+            catalog = Catalog(apps, channels, time.time())
+            added, removed = self.catalog.diff(catalog)
+            if added or removed:
+                log.info(f"Catalog has {len(apps)} apps and {len(channels)} channels, "
+                         f"{len(added)} new or changed, {len(removed)} removed")
+                self.catalog = catalog
+            else:
+                # Keep the old index and its memoized lookups
+                self.catalog.updated = catalog.updated
+            if self._cache and self.sys_info:
+                self._cache.store(self._url, TVCache.tv_key(self.sys_info), catalog=self.catalog.to_dict())
+            return True
+        finally:
+            self._catalog_lock.release()
+
+    def _try_refresh_catalog(self):
+        try:
+            self.refresh_catalog()
+        except Exception as err:
+            log.warning(f"Failed to read the app and channel lists: {err}")
+
+    def refresh_catalog_async(self):
+        threading.Thread(target=self._try_refresh_catalog, name="bravia-catalog", daemon=True).start()
+
+    def _create_session(self):
+        """Keep-alive session so that every command reuses the same connection"""
+        # Imported here, requests takes longer to import than everything else
+        # the service needs before it can handle the first button press
         import requests
-        headers = {
-            "X-Auth-PSK": self._psk
-        }
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"X-Auth-PSK": self._psk})
+        self._transport_errors = (requests.RequestException, OSError)
+        return session
+
+    def invoke(self, method, *args, **kwargs):
+        """Call a public method by name, keymaps refer to them this way"""
+        return getattr(self, method)(*args, **kwargs)
+
+    def close(self):
+        self.stop_notifications()
+        self._session.close()
+
+    def _post(self, path, headers, data, timeout):
+        """POST through the circuit breaker, connection problems raise BraviaUnavailable"""
+        if not self._breaker.allow():
+            raise BraviaUnavailable(f"TV unreachable, retrying in {self._breaker.retry_in():.1f} s")
+        try:
+            response = self._session.post(
+                self._url + "/" + path, headers=headers, data=data, timeout=(CONNECT_TIMEOUT, timeout))
+        except self._transport_errors as err:
+            self._breaker.failure()
+            raise BraviaUnavailable(str(err)) from err
+        self._breaker.success()
+        return response
+
+    def _call(self, service, method, version="1.0", **params):
         payload = {
             "method": method,
-            "id": self._id,
+            "id": next(self._ids),
             "params": [params],
             "version": version
         }
-        self._id += 1
+        data = json.dumps(payload)
+        timeout = LIST_TIMEOUT if method in LIST_METHODS else COMMAND_TIMEOUT
+        retries = READ_RETRIES if method.startswith("get") else 0
         log.debug("-> {0}({1})".format(method, params or ""))
-        r = requests.post(self._url+"/"+service, headers=headers, data=json.dumps(payload))
-        r_json = r.json()
+        for attempt in range(retries + 1):
+            try:
+                r = self._post(service, JSON_HEADERS, data, timeout)
+                break
+            except BraviaUnavailable as err:
+                if attempt == retries or self._breaker.is_open:
+                    raise
+                delay = RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5)
+                log.debug(f"{method} failed ({err}), retrying in {delay * 1e3:.0f} ms")
+                time.sleep(delay)
+
+        try:
+            r_json = r.json()
+        except ValueError:
+            raise BraviaError(f"{method}: HTTP {r.status_code} without a JSON answer", r.status_code)
         log.debug("<- {0} {1}".format(r.status_code, r_json))
 
         if "error" in r_json:
-            raise Exception(r_json["error"])
+            error = r_json["error"]
+            code, message = (error + [None, None])[:2] if isinstance(error, list) else (None, error)
+            raise BraviaError(f"{method}: {message} ({code})", code)
 
         return r_json["result"]
 
+    def _get_ircc_payload(self, command):
+        if not self.remote_info:
+            self.refresh()  # Nothing cached and the TV was not reachable before
+
+        payload = self._ircc_payloads.get(command)
+        if payload is None:
+            ircc_code = self.remote_info.get(command, command)
+            payload = self._ircc_prefix + ircc_code.encode() + self._ircc_suffix
+            self._ircc_payloads[command] = payload
+        return payload
+
     def send_ircc_command(self, command):
-        import requests
-        headers = {
-            "Content-Type": "text/xml; charset=UTF-8",
-            "SOAPACTION": "\"urn:schemas-sony-com:service:IRCC:1#X_SendIRCC\"",
-            "X-Auth-PSK": self._psk,
-        }
-        ircc_code = self.remote_info.get(command, command)
-        payload = (
-            '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
-                '<s:Body>'
-                    '<u:X_SendIRCC xmlns:u="urn:schemas-sony-com:service:IRCC:1">'
-                        '<IRCCCode>{ircc_code}</IRCCCode>'
-                    '</u:X_SendIRCC>'
-                '</s:Body>'
-            '</s:Envelope>').format(ircc_code=ircc_code)
-
-        log.debug("(ircc) -> {0}".format(ircc_code))
-        response = requests.post(self._url+"/"+"IRCC", headers=headers, data=payload)
-        response = ET.fromstring(response.content)
-
-        if response.find('.//{http://schemas.xmlsoap.org/soap/envelope/}Fault'):
-            upnp_error = response.find('.//{urn:schemas-upnp-org:control-1-0}UPnPError')
-            error_msg = {'code': '', 'description': ''}
-            for child in upnp_error:
-                if child.tag.endswith('errorCode'):
-                    error_msg['code'] = child.text
-                if child.tag.endswith('errorDescription'):
-                    error_msg['description'] = child.text
-            log.debug("(ircc) <- Fault {0}".format(error_msg))
-            if error_msg:
-                raise Exception(error_msg)
-        else:
+        payload = self._get_ircc_payload(command)
+
+        log.debug("(ircc) -> {0}".format(command))
+        # Not retried, a key press sent twice is not the same as once
+        response = self._post("IRCC", IRCC_HEADERS, payload, COMMAND_TIMEOUT)
+        if response.status_code == 200:
             log.debug("(ircc) <- OK")
+            return
+
+        try:
+            fault = ET.fromstring(response.content).find(f".//{SOAP_NS}Fault")
+        except ET.ParseError:
+            fault = None
+        if fault is None:
+            raise BraviaError(f"IRCC {command}: HTTP {response.status_code}", response.status_code)
+        code = fault.findtext(f".//{UPNP_NS}errorCode", "")
+        description = fault.findtext(f".//{UPNP_NS}errorDescription", "")
+        log.debug("(ircc) <- Fault {0} {1}".format(code, description))
+        raise BraviaError(f"IRCC {command}: {description} ({code})", code)
 
     def get_system_information(self):
         result = self._call("system", "getSystemInformation")[0]
         return result
 
-    def get_power_status(self):
+    def add_power_listener(self, callback):
+        """`callback(status)` is called whenever the known power status changes"""
+        self._power_listeners.append(callback)
+
+    def _set_power_status(self, status):
+        changed = (status != self._power_status)
+        self._power_status = status
+        self._power_status_ts = time.monotonic()
+        if changed:
+            for callback in self._power_listeners:
+                callback(status)
+
+    def start_notifications(self):
+        """Keep the power status and volume up to date through the TV's notification channel"""
+        if self._notifier is None:
+            self._notifier = PowerNotifier(
+                self._url, self._psk, self._set_power_status, on_volume=self._set_volume_info).start()
+
+    def stop_notifications(self):
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
+
+    @property
+    def has_power_notifications(self):
+        return self._notifier is not None and self._notifier.connected
+
+    @property
+    def power_status(self):
+        """Last known power status, never talks to the TV"""
+        return self._power_status or "unknown"
+
+    def is_power_status_fresh(self, max_age=POWER_STATUS_TTL):
+        if self._power_status is None:
+            return False
+        if self.has_power_notifications:
+            return True
+        return (time.monotonic() - self._power_status_ts) < max_age
+
+    def get_power_status(self, max_age=0):
+        """Power status from the TV, or from the cache if it is younger than `max_age`"""
+        if max_age and self.is_power_status_fresh(max_age):
+            return self._power_status
         try:
             result = self._call("system", "getPowerStatus")[0]
+            self._set_power_status(result["status"])
             return result["status"]
-        except Exception as err:
+        except BraviaError as err:
             log.warn("Failed to read power status: {0}".format(err))
             return "unknown"
 
+    def _set_power(self, on):
+        # Optimistic update, forgotten again if the TV did not take the command
+        self._set_power_status(on and "active" or "standby")
+        try:
+            self._call("system", "setPowerStatus", status=on)
+        except BraviaError:
+            self._power_status = None
+            raise
+
     def turn_on(self):
-        self._call("system", "setPowerStatus", status=True)
+        self._set_power(True)
 
     def turn_off(self):
-        self._call("system", "setPowerStatus", status=False)
+        self._set_power(False)
 
     def get_network_settings(self):
         result = self._call("system", "getNetworkSettings")
@@ -99,8 +381,27 @@ class Bravia(object):
         result = self._call("system", "getRemoteControllerInfo")
         return result
 
-    def get_volume_information(self, target="speaker"):
+    def _set_volume_info(self, info):
+        if info.get("target", "speaker") != "speaker":
+            return
+        volume = dict(self._volume or {})
+        volume.update(info)
+        self._volume = volume
+        self._volume_ts = time.monotonic()
+
+    def is_volume_fresh(self, max_age=VOLUME_TTL):
+        if self._volume is None:
+            return False
+        if self._notifier is not None and self._notifier.volume_enabled:
+            return True
+        return (time.monotonic() - self._volume_ts) < max_age
+
+    def get_volume_information(self, target="speaker", max_age=0):
+        """Speaker volume dict from the TV, or from the cache if it is younger than `max_age`"""
+        if max_age and target == "speaker" and self.is_volume_fresh(max_age):
+            return self._volume
         result = self._call("audio", "getVolumeInformation", target=target)[0][0]
+        self._set_volume_info(result)
         return result
 
     def get_application_list(self):
@@ -112,9 +413,29 @@ class Bravia(object):
 
     def set_audio_volume(self, volume, ui="on", target=""):
         self._call("audio", "setAudioVolume", version="1.2", volume=str(volume), ui=ui, target=target)
+        if self._volume is not None and target in ("", "speaker") and str(volume).isdigit():
+            self._set_volume_info({"volume": int(volume)})
+
+    def change_volume(self, steps, max_age=VOLUME_TTL):
+        """Move the volume by `steps` with one absolute setAudioVolume call
+
+        The current level comes from the cache while it is fresh, so a
+        change usually costs a single round trip. Returns the new volume.
+        """
+        info = self.get_volume_information(max_age=max_age)
+        volume = min(max(info["volume"] + steps, info.get("minVolume", 0)), info.get("maxVolume", 100))
+        if volume != info["volume"]:
+            self.set_audio_volume(volume)
+        return volume
+
+    @property
+    def is_available(self):
+        """False while calls fail fast because the TV was unreachable"""
+        return not self._breaker.is_open
 
-    def get_tv_channels(self):
-        results = self._call("avContent", "getContentList", version="1.5", uri="tv:dvbt")[0]
+    def get_tv_channels(self, start=0, count=CONTENT_PAGE_SIZE):
+        results = self._call("avContent", "getContentList", version="1.5", uri="tv:dvbt",
+                             stIdx=start, cnt=count)[0]
         return results
 
     def get_playing_content(self):
@@ -125,8 +446,31 @@ class Bravia(object):
         result = self._call("avContent", "setPlayContent", uri=uri)
         return result
 
+    def _open_catalog_entry(self, kind, name, open_uri):
+        entry = self.catalog.find(kind, name)
+        if entry is None:
+            self.refresh_catalog_async()
+            raise LookupError(f"No {kind} matching '{name}'")
+        try:
+            return open_uri(entry["uri"])
+        except BraviaUnavailable:
+            raise
+        except BraviaError:
+            # The entry might be gone from the TV, check the lists again
+            self.refresh_catalog_async()
+            raise
+
+    def launch_app(self, name):
+        """Start an app by title or URI, resolved from the catalog"""
+        return self._open_catalog_entry("app", name, self.set_active_app)
+
+    def tune_channel(self, name):
+        """Switch to a channel by title, number or URI, resolved from the catalog"""
+        return self._open_catalog_entry("channel", name, self.set_content)
+
 
 if __name__ == '__main__':
     tv = Bravia("http://192.168.1.2/sony", auth_psk="1234")
+    tv.refresh()
     print(tv)
     print("{product} {name} {model} ({generation}) serial: {serial}".format(**tv.sys_info))
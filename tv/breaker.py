@@ -0,0 +1,64 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger("tv.breaker")
+
+
+class CircuitBreaker(object):
+    """Fails calls fast while the other side is known to be unreachable
+
+    After `threshold` failures in a row the circuit opens and `allow()`
+    returns False for `reset_timeout` seconds. Then a single call is let
+    through as a probe: its success closes the circuit again, its failure
+    keeps it open for another `reset_timeout`.
+    """
+
+    def __init__(self, name, threshold=3, reset_timeout=5.0, clock=time.monotonic):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def retry_in(self):
+        """Seconds until the next probe is let through, 0 if the circuit is closed"""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        with self._lock:
+            if self._probing or self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        if self.opened_at is None and not self.failures:
+            return
+        with self._lock:
+            if self.opened_at is not None:
+                log.info(f"{self.name} reachable again")
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    log.warning(f"{self.name} unreachable after {self.failures} failures, "
+                                f"failing calls for {self.reset_timeout:g} s")
+                self.opened_at = self.clock()
+                self._probing = False
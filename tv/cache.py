@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger("tv.cache")
+
+
+class TVCache(object):
+    """JSON file with per TV information, keyed by TV model/serial
+
+    The TV which was last seen at a given URL is remembered, so the entry
+    can be found at startup without talking to the TV. Only the system and
+    remote controller information expire with `ttl`, stamped by
+    `store_info()`; other sections such as the catalog keep their own
+    timestamps.
+    """
+
+    def __init__(self, filename, ttl):
+        self.filename = filename
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tv_key(sys_info):
+        return "{}/{}".format(sys_info.get("model", ""), sys_info.get("serial", ""))
+
+    def _read(self):
+        try:
+            with open(self.filename, "r") as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return {"urls": {}, "tvs": {}}
+        except ValueError as err:
+            log.warning(f"Ignoring corrupt cache {self.filename}: {err}")
+            return {"urls": {}, "tvs": {}}
+
+    def _write(self, data):
+        dirname = os.path.dirname(self.filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as fp:
+            json.dump(data, fp)
+        os.replace(tmp_filename, self.filename)
+
+    def load(self, url):
+        """Return (entry, is_fresh), entry is None when nothing is cached"""
+        with self._lock:
+            data = self._read()
+        entry = data["tvs"].get(data["urls"].get(url))
+        if entry is None:
+            return None, False
+        return entry, (time.time() - entry.get("info_updated", 0)) < self.ttl
+
+    def store_info(self, url, key, sys_info, remote_info):
+        """Store freshly read system and remote controller information"""
+        self.store(url, key, sys_info=sys_info, remote_info=remote_info, info_updated=time.time())
+
+    def store(self, url, key, **values):
+        with self._lock:
+            data = self._read()
+            entry = data["tvs"].setdefault(key, {})
+            entry.update(values)
+            entry.pop("updated", None)  # Shared timestamp of older versions
+            data["urls"][url] = key
+            try:
+                self._write(data)
+            except OSError as err:
+                log.warning(f"Failed to write cache {self.filename}: {err}")
@@ -0,0 +1,114 @@
+import bisect
+import logging
+import re
+import time
+
+log = logging.getLogger("tv.catalog")
+
+
+KINDS = ("app", "channel")
+
+
+def normalize(name):
+    """Lookup key of a title, case and punctuation are ignored"""
+    return re.sub(r"[^0-9a-z]+", "", name.lower())
+
+
+class CatalogIndex(object):
+    """Entries of one kind indexed by URI and by normalized title
+
+    Lookups try the URI, then the exact title, then the first title starting
+    with the name and finally the closest title. Results are memoized, so
+    resolving the same name again is a single dict access.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = list(entries)
+        self._by_uri = {}
+        self._by_key = {}
+        for entry in self.entries:
+            self._by_uri[entry["uri"]] = entry
+            for name in (entry.get("title"), entry.get("number")):
+                if name:
+                    self._by_key.setdefault(normalize(name), entry)
+        self._keys = sorted(self._by_key)
+        self._memo = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find(self, name):
+        try:
+            return self._memo[name]
+        except KeyError:
+            pass
+
+        entry = self._by_uri.get(name)
+        if entry is None:
+            key = normalize(name)
+            entry = self._by_key.get(key)
+            if entry is None and key:
+                i = bisect.bisect_left(self._keys, key)
+                if i < len(self._keys) and self._keys[i].startswith(key):
+                    entry = self._by_key[self._keys[i]]
+            if entry is None and key:
+                import difflib
+                close = difflib.get_close_matches(key, self._keys, n=1, cutoff=0.6)
+                if close:
+                    entry = self._by_key[close[0]]
+
+        self._memo[name] = entry
+        return entry
+
+
+class Catalog(object):
+    """Immutable snapshot of the apps and channels of a TV
+
+    A refresh builds a new Catalog which replaces the old one as a whole, so
+    readers never see a half updated index.
+    """
+
+    def __init__(self, apps=(), channels=(), updated=0):
+        self.updated = updated
+        self._indexes = {"app": CatalogIndex(apps), "channel": CatalogIndex(channels)}
+
+    def __len__(self):
+        return sum(len(index) for index in self._indexes.values())
+
+    def entries(self, kind):
+        return self._indexes[kind].entries
+
+    def find(self, kind, name):
+        """Entry dict with `title` and `uri`, None if nothing matches"""
+        return self._indexes[kind].find(name)
+
+    def is_fresh(self, ttl):
+        return (time.time() - self.updated) < ttl
+
+    def diff(self, other):
+        """(added, removed) URIs of `other` compared to this catalog"""
+        added, removed = [], []
+        for kind in KINDS:
+            old = {e["uri"]: e for e in self.entries(kind)}
+            new = {e["uri"]: e for e in other.entries(kind)}
+            added.extend(uri for uri, e in new.items() if old.get(uri) != e)
+            removed.extend(uri for uri in old if uri not in new)
+        return added, removed
+
+    def to_dict(self):
+        return {"apps": self.entries("app"), "channels": self.entries("channel"), "updated": self.updated}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("apps", ()), data.get("channels", ()), data.get("updated", 0))
+
+
+def app_entry(app):
+    return {"title": app.get("title", ""), "uri": app["uri"]}
+
+
+def channel_entry(channel):
+    entry = {"title": channel.get("title", ""), "uri": channel["uri"]}
+    if channel.get("dispNum"):
+        entry["number"] = channel["dispNum"].lstrip("0") or "0"
+    return entry
@@ -0,0 +1,141 @@
+import collections
+import logging
+import threading
+import time
+
+log = logging.getLogger("tv.dispatcher")
+
+
+class CommandDropped(Exception):
+    """The command was discarded without being sent"""
+
+
+class Command(object):
+    __slots__ = ("func", "args", "kwargs", "deadline", "callback", "submitted")
+
+    def __init__(self, func, args, kwargs, deadline, callback):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.deadline = deadline
+        self.callback = callback
+        self.submitted = time.monotonic()
+
+    def __repr__(self):
+        return "{}({})".format(getattr(self.func, "__name__", self.func), ", ".join(map(repr, self.args)))
+
+    def complete(self, result, error):
+        if self.callback is not None:
+            try:
+                self.callback(result, error)
+            except Exception:
+                log.exception("Error in TV command callback")
+
+
+class CommandDispatcher(object):
+    """Run TV commands on a worker thread so the input loop never waits on the network
+
+    The queue is bounded; when it is full the oldest pending command that
+    can expire is dropped, commands without a deadline are kept. Commands
+    which are still queued after their deadline are discarded instead of
+    being sent late. With more than one worker the commands are started in
+    order but may overlap.
+    """
+
+    def __init__(self, max_depth=8, default_deadline=2.0, workers=1, name="tv-dispatcher"):
+        self._max_depth = max_depth
+        self._default_deadline = default_deadline
+        self._workers = workers
+        self._name = name
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        self.dropped = 0
+
+    def start(self):
+        if not self._threads:
+            self._stopped = False
+            for n in range(self._workers):
+                thread = threading.Thread(target=self._worker, name=f"{self._name}-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def __len__(self):
+        return len(self._queue)
+
+    def submit(self, func, *args, deadline=None, callback=None, **kwargs):
+        """Queue `func(*args, **kwargs)`, returns immediately
+
+        `deadline` is the number of seconds the command may wait in the queue,
+        None uses the default and 0 never expires. `callback(result, error)`
+        is invoked from the worker thread once the command completes, or
+        with a CommandDropped error when it is discarded.
+        """
+        if deadline is None:
+            deadline = self._default_deadline
+        expires = (time.monotonic() + deadline) if deadline else None
+        cmd = Command(func, args, kwargs, expires, callback)
+
+        stale = None
+        with self._cond:
+            if len(self._queue) >= self._max_depth:
+                stale = self._pop_expiring()
+                if stale is None and expires is not None:
+                    # Only commands that must not be lost are queued
+                    stale = cmd
+                if stale is not None:
+                    self.dropped += 1
+            if stale is not cmd:
+                self._queue.append(cmd)
+                self._cond.notify()
+        if stale is not None:
+            log.warning(f"Queue full, dropping {stale}")
+            stale.complete(None, CommandDropped("queue full"))
+        return cmd
+
+    def _pop_expiring(self):
+        for queued in self._queue:
+            if queued.deadline is not None:
+                self._queue.remove(queued)
+                return queued
+        return None
+
+    def _next(self):
+        with self._cond:
+            while not self._queue and not self._stopped:
+                self._cond.wait()
+            if self._stopped:
+                return None
+            return self._queue.popleft()
+
+    def _worker(self):
+        while True:
+            cmd = self._next()
+            if cmd is None:
+                break
+
+            if cmd.deadline is not None and time.monotonic() > cmd.deadline:
+                with self._cond:
+                    self.dropped += 1
+                log.info(f"Dropping stale command {cmd}")
+                cmd.complete(None, CommandDropped("deadline expired"))
+                continue
+
+            result, error = None, None
+            try:
+                result = cmd.func(*cmd.args, **cmd.kwargs)
+            except Exception as err:
+                error = err
+                log.warning(f"TV command {cmd} failed: {err}")
+
+            cmd.complete(result, error)
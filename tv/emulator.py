@@ -0,0 +1,521 @@
+"""Local stand-in for a Sony Bravia TV
+
+Serves the `system`, `audio`, `appControl` and `avContent` JSON-RPC
+services and the IRCC SOAP endpoint the client uses, checks `X-Auth-PSK`
+and pushes `notifyPowerStatus` and `notifyVolumeInformation` over the
+notification WebSocket. Answers can be delayed by a latency distribution
+and a fraction of them turned into errors or connection resets, so the
+client can be tested without a TV. Run it with:
+
+    python3 -m tv.emulator [--port 8080] [--psk 1234] [--latency 5-20]
+                           [--error-rate 0.01] [--reset-rate 0.01]
+
+and point `TV_URL` at the printed URL.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import socket
+import struct
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger("tv.emulator")
+
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+REMOTE_CODES = {
+    "Power": "AAAAAQAAAAEAAAAVAw==",
+    "WakeUp": "AAAAAQAAAAEAAAAuAw==",
+    "PowerOff": "AAAAAQAAAAEAAAAvAw==",
+    "VolumeUp": "AAAAAQAAAAEAAAASAw==",
+    "VolumeDown": "AAAAAQAAAAEAAAATAw==",
+    "Mute": "AAAAAQAAAAEAAAAUAw==",
+    "Up": "AAAAAQAAAAEAAAB0Aw==",
+    "Down": "AAAAAQAAAAEAAAB1Aw==",
+    "Left": "AAAAAQAAAAEAAAA0Aw==",
+    "Right": "AAAAAQAAAAEAAAAzAw==",
+    "Confirm": "AAAAAQAAAAEAAABlAw==",
+    "Home": "AAAAAQAAAAEAAABgAw==",
+    "Return": "AAAAAgAAAJcAAAAjAw==",
+    "Display": "AAAAAQAAAAEAAAA6Aw==",
+    "Input": "AAAAAQAAAAEAAAAlAw==",
+    "ActionMenu": "AAAAAgAAAMQAAABLAw==",
+    "SubTitle": "AAAAAgAAAJcAAAAoAw==",
+    "Netflix": "AAAAAgAAABoAAAB8Aw==",
+}
+
+APPS = {
+    "Netflix": "com.sony.dtv.com.netflix.ninja.com.netflix.ninja.MainActivity",
+    "YouTube": "com.sony.dtv.com.google.android.youtube.tv.com.google.android.apps.youtube.tv.activity.ShellActivity",
+    "Prime Video": "com.sony.dtv.com.amazon.amazonvideo.livingroom.com.amazon.ignition.IgnitionActivity",
+    "Spotify": "com.sony.dtv.com.spotify.tv.android.com.spotify.tv.android.SpotifyTVActivity",
+}
+
+# JSON-RPC error codes of the Bravia API
+ERROR_ILLEGAL_ARGUMENT = 3
+ERROR_ILLEGAL_STATE = 7
+ERROR_NO_SUCH_METHOD = 12
+ERROR_FORBIDDEN = 403
+ERROR_DISPLAY_OFF = 40005
+
+NOTIFICATIONS = {"notifyPowerStatus", "notifyVolumeInformation"}
+
+IRCC_RESPONSE = (
+    '<?xml version="1.0"?>'
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+    's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+    '<s:Body><u:X_SendIRCCResponse xmlns:u="urn:schemas-sony-com:service:IRCC:1"/></s:Body>'
+    '</s:Envelope>').encode()
+
+IRCC_FAULT = (
+    '<?xml version="1.0"?>'
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+    's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+    '<s:Body><s:Fault><faultcode>s:Client</faultcode><faultstring>UPnPError</faultstring>'
+    '<detail><UPnPError xmlns="urn:schemas-upnp-org:control-1-0">'
+    '<errorCode>{code}</errorCode><errorDescription>{description}</errorDescription>'
+    '</UPnPError></detail></s:Fault></s:Body></s:Envelope>')
+
+
+def parse_latency(spec, rnd=random):
+    """Latency function from a spec in milliseconds
+
+    `5` is a fixed delay, `5-20` uniform between both, `exp:10` exponential
+    with a mean of 10 and `lognormal:10:0.5` log-normal with a median of 10
+    and the given sigma, which has the long tail of a busy TV.
+    """
+    if not spec:
+        return lambda: 0.0
+    kind, _, args = spec.partition(":")
+    if not args:
+        low, _, high = spec.partition("-")
+        low, high = float(low) / 1e3, float(high or low) / 1e3
+        return lambda: rnd.uniform(low, high)
+    args = [float(arg) for arg in args.split(":")]
+    if kind == "exp":
+        return lambda: rnd.expovariate(1e3 / args[0])
+    if kind == "lognormal":
+        mu = math.log(args[0] / 1e3)
+        return lambda: rnd.lognormvariate(mu, args[1])
+    raise ValueError(f"Unknown latency distribution '{spec}'")
+
+
+class TVState(object):
+    """What the emulated TV is doing, changed by the calls it receives"""
+
+    def __init__(self, channels=50):
+        self.power = "active"
+        self.volume = 15
+        self.max_volume = 100
+        self.mute = False
+        self.active_app = None
+        self.content = "extInput:hdmi?port=1"
+        self.apps = dict(APPS)
+        self.channels = [(n, f"Channel {n}") for n in range(1, channels + 1)]
+        self.lock = threading.Lock()
+
+
+class BraviaEmulator(object):
+    """HTTP server emulating a Bravia TV on a background thread
+
+    `latency` is a function returning the delay of one answer in seconds,
+    see `parse_latency()`. `error_rate` of the answers are errors the TV
+    could give (busy, illegal state), `reset_rate` of the requests get the
+    connection reset instead of an answer.
+    """
+
+    def __init__(self, psk="1234", host="127.0.0.1", port=0, latency=None,
+                 error_rate=0.0, reset_rate=0.0, seed=None, state=None):
+        self.psk = psk
+        self.latency = latency or (lambda: 0.0)
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.state = state or TVState()
+        self.requests = 0
+        self.errors = 0
+        self.resets = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._server = ThreadingHTTPServer((host, port), make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/sony"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="bravia-emulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            listeners, self._listeners = self._listeners, []
+        for listener in listeners:
+            listener.close()
+
+    def fault(self):
+        """None, "error" or "reset" for the next request"""
+        with self._lock:
+            self.requests += 1
+            draw = self._random.random()
+            if draw < self.reset_rate:
+                self.resets += 1
+                return "reset"
+            if draw < self.reset_rate + self.error_rate:
+                self.errors += 1
+                return "error"
+        return None
+
+    def delay(self):
+        with self._lock:
+            seconds = self.latency()
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def notify(self, name, params):
+        message = json.dumps({"method": name, "params": [params], "version": "1.0"})
+        with self._lock:
+            listeners = [ws for ws in self._listeners if name in ws.enabled]
+        for listener in listeners:
+            listener.send(message)
+
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def call(self, service, method, params):
+        """Result of a JSON-RPC call, raises RpcError for an error answer"""
+        handler = getattr(self, f"_{service}_{method}", None)
+        if handler is None:
+            raise RpcError(ERROR_NO_SUCH_METHOD, method)
+        try:
+            with self.state.lock:
+                before = self._snapshot()
+                result = handler(self.state, params)
+                after = self._snapshot()
+        except (KeyError, TypeError, ValueError) as err:
+            raise RpcError(ERROR_ILLEGAL_ARGUMENT, f"Illegal Argument: {err}")
+        self._notify_changes(before, after)
+        return result
+
+    def ircc(self, code):
+        """Apply a remote control code, False if the TV does not know it"""
+        names = {value: name for name, value in REMOTE_CODES.items()}
+        name = names.get(code)
+        if name is None:
+            return False
+        with self.state.lock:
+            before = self._snapshot()
+            power = before[0]
+            if name in ("WakeUp", "Power") and power != "active":
+                self.state.power = "active"
+            elif name in ("PowerOff", "Power"):
+                self.state.power = "standby"
+            elif name == "VolumeUp":
+                self.state.volume = min(self.state.volume + 1, self.state.max_volume)
+            elif name == "VolumeDown":
+                self.state.volume = max(self.state.volume - 1, 0)
+            elif name == "Mute":
+                self.state.mute = not self.state.mute
+            after = self._snapshot()
+        self._notify_changes(before, after)
+        return True
+
+    def _snapshot(self):
+        return self.state.power, self.state.volume, self.state.mute
+
+    def _notify_changes(self, before, after):
+        """Send the notifications for a state change, called without the lock"""
+        if after[0] != before[0]:
+            self.notify("notifyPowerStatus", {"status": after[0]})
+        if after[1:] != before[1:]:
+            self.notify("notifyVolumeInformation", {"target": "speaker", "volume": after[1], "mute": after[2]})
+
+    # JSON-RPC methods, named _<service>_<method>
+
+    def _system_getSystemInformation(self, state, params):
+        return [{"product": "TV", "region": "XEU", "language": "eng", "model": "KD-65X9000E",
+                 "serial": "EMULATOR", "macAddr": "00:00:00:00:00:00", "name": "BRAVIA",
+                 "generation": "4.1.0", "area": "DEU", "cid": "EMULATOR"}]
+
+    def _system_getPowerStatus(self, state, params):
+        return [{"status": state.power}]
+
+    def _system_setPowerStatus(self, state, params):
+        state.power = "active" if params["status"] else "standby"
+        return []
+
+    def _system_getRemoteControllerInfo(self, state, params):
+        return [{"bundled": True, "type": "RM-J1100"},
+                [{"name": name, "value": value} for name, value in REMOTE_CODES.items()]]
+
+    def _system_getNetworkSettings(self, state, params):
+        return [[{"netif": "eth0", "ipAddrV4": "127.0.0.1", "hwAddr": "00:00:00:00:00:00"}]]
+
+    def _audio_getVolumeInformation(self, state, params):
+        return [[{"target": "speaker", "volume": state.volume, "mute": state.mute,
+                  "maxVolume": state.max_volume, "minVolume": 0}]]
+
+    def _audio_setAudioVolume(self, state, params):
+        volume = params["volume"]
+        if volume[:1] in "+-":
+            volume = state.volume + int(volume)
+        volume = int(volume)
+        if not 0 <= volume <= state.max_volume:
+            raise ValueError(f"volume {volume}")
+        state.volume = volume
+        return [0]
+
+    def _audio_setAudioMute(self, state, params):
+        state.mute = bool(params["status"])
+        return [0]
+
+    def _check_display(self, state):
+        if state.power != "active":
+            raise RpcError(ERROR_DISPLAY_OFF, "Display Is Turned off")
+
+    def _appControl_getApplicationList(self, state, params):
+        return [[{"title": title, "uri": uri, "icon": ""} for title, uri in state.apps.items()]]
+
+    def _appControl_setActiveApp(self, state, params):
+        self._check_display(state)
+        if params["uri"] not in state.apps.values():
+            raise RpcError(ERROR_ILLEGAL_ARGUMENT, "Illegal Argument")
+        state.active_app = params["uri"]
+        return []
+
+    def _avContent_getContentList(self, state, params):
+        start, count = int(params.get("stIdx", 0)), int(params.get("cnt", 50))
+        return [[{"title": title, "uri": f"tv:dvbt?trip=1.1.{n}&srvName={title}", "dispNum": f"{n:03d}",
+                  "index": n, "programMediaType": "tv"} for n, title in state.channels[start:start + count]]]
+
+    def _avContent_getPlayingContentInfo(self, state, params):
+        self._check_display(state)
+        if state.active_app:
+            raise RpcError(ERROR_ILLEGAL_STATE, "Illegal State")
+        return [{"uri": state.content, "source": state.content.split("?")[0], "title": ""}]
+
+    def _avContent_setPlayContent(self, state, params):
+        self._check_display(state)
+        uri = params["uri"]
+        if not (uri.startswith("extInput:") or uri.startswith("tv:")):
+            raise RpcError(ERROR_ILLEGAL_ARGUMENT, "Illegal Argument")
+        state.content = uri
+        state.active_app = None
+        return []
+
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class NotificationSocket(object):
+    """Server side of the notification WebSocket, frames are sent unmasked"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.enabled = set()
+        self._lock = threading.Lock()
+
+    def send(self, text, opcode=0x1):
+        payload = text.encode()
+        header = bytearray([0x80 | opcode])
+        if len(payload) < 126:
+            header.append(len(payload))
+        else:
+            header.append(126)
+            header += struct.pack("!H", len(payload))
+        try:
+            with self._lock:
+                self.handler.wfile.write(bytes(header) + payload)
+                self.handler.wfile.flush()
+        except (OSError, ValueError):
+            pass  # Client went away, ValueError once the handler closed the file
+
+    def recv(self):
+        """(opcode, payload) of the next frame from the client"""
+        rfile = self.handler.rfile
+        head = rfile.read(2)
+        if len(head) < 2:
+            return 0x8, b""
+        opcode, length = head[0] & 0x0f, head[1] & 0x7f
+        if length == 126:
+            length, = struct.unpack("!H", rfile.read(2))
+        elif length == 127:
+            length, = struct.unpack("!Q", rfile.read(8))
+        mask = rfile.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(rfile.read(length)))
+        return opcode, payload
+
+    def close(self):
+        self.send("", opcode=0x8)
+
+
+def make_handler(emulator):
+    class EmulatorHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, fmt, *args):
+            log.debug(fmt % args)
+
+        def _reset(self):
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            self.close_connection = True
+
+        def _send(self, status, data, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_json(self, status, message):
+            self._send(status, json.dumps(message).encode(), "application/json; charset=UTF-8")
+
+        def _ircc_fault(self, code, description):
+            self._send(500, IRCC_FAULT.format(code=code, description=description).encode(),
+                       "text/xml; charset=UTF-8")
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            fault = emulator.fault()
+            if fault == "reset":
+                return self._reset()
+            emulator.delay()
+
+            service = self.path.rstrip("/").rsplit("/", 1)[-1]
+            if service == "IRCC":
+                return self._do_ircc(body, fault)
+
+            try:
+                request = json.loads(body)
+                method, request_id = request["method"], request.get("id")
+                params = (request.get("params") or [{}])[0]
+            except (ValueError, KeyError, IndexError):
+                return self._send_json(400, {"error": [ERROR_ILLEGAL_ARGUMENT, "Illegal Argument"], "id": None})
+
+            if self.headers.get("X-Auth-PSK") != emulator.psk:
+                return self._send_json(403, {"error": [ERROR_FORBIDDEN, "Forbidden"], "id": request_id})
+            if fault == "error":
+                return self._send_json(200, {"error": [ERROR_ILLEGAL_STATE, "Illegal State"], "id": request_id})
+            try:
+                result = emulator.call(service, method, params)
+            except RpcError as err:
+                return self._send_json(200, {"error": [err.code, str(err)], "id": request_id})
+            self._send_json(200, {"result": result, "id": request_id})
+
+        def _do_ircc(self, body, fault):
+            if self.headers.get("X-Auth-PSK") != emulator.psk:
+                return self._ircc_fault(606, "Action not authorized")
+            if fault == "error":
+                return self._ircc_fault(501, "Action Failed")
+            match = re.search(rb"<IRCCCode>([^<]*)</IRCCCode>", body)
+            if match is None:
+                return self._ircc_fault(402, "Invalid Args")
+            if not emulator.ircc(match.group(1).decode()):
+                return self._ircc_fault(800, "Cannot accept the IRCC Code")
+            self._send(200, IRCC_RESPONSE, "text/xml; charset=UTF-8")
+
+        def do_GET(self):
+            if self.headers.get("Upgrade", "").lower() != "websocket":
+                return self._send(404, b"", "text/plain")
+            if emulator.fault() == "reset":
+                return self._reset()
+            if self.headers.get("X-Auth-PSK") != emulator.psk:
+                return self._send(403, b"", "text/plain")
+
+            key = self.headers.get("Sec-WebSocket-Key", "")
+            accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+            self.send_response(101, "Switching Protocols")
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept)
+            self.end_headers()
+            self.wfile.flush()
+            self.close_connection = True
+
+            ws = NotificationSocket(self)
+            emulator.add_listener(ws)
+            try:
+                self._serve_notifications(ws)
+            except OSError:
+                pass
+            finally:
+                emulator.remove_listener(ws)
+
+        def _serve_notifications(self, ws):
+            while True:
+                opcode, payload = ws.recv()
+                if opcode == 0x8:
+                    return
+                if opcode == 0x9:
+                    ws.send(payload.decode(), opcode=0xa)
+                    continue
+                if opcode != 0x1:
+                    continue
+                request = json.loads(payload)
+                if request.get("method") != "switchNotifications":
+                    ws.send(json.dumps({"error": [ERROR_NO_SUCH_METHOD, "No Such Method"], "id": request.get("id")}))
+                    continue
+                wanted = {n["name"] for n in (request.get("params") or [{}])[0].get("enabled", [])}
+                ws.enabled = wanted & NOTIFICATIONS
+                ws.send(json.dumps({"result": [{
+                    "enabled": [{"name": name, "version": "1.0"} for name in sorted(ws.enabled)],
+                    "disabled": [{"name": name, "version": "1.0"}
+                                 for name in sorted(NOTIFICATIONS - ws.enabled)],
+                }], "id": request.get("id")}))
+
+    return EmulatorHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--psk", default="1234")
+    parser.add_argument("--latency", help="answer delay in ms: 5, 5-20, exp:10 or lognormal:10:0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reset-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)5s %(name)s %(message)s')
+    rnd = random.Random(args.seed)
+    emulator = BraviaEmulator(
+        args.psk, args.host, args.port, parse_latency(args.latency, rnd),
+        args.error_rate, args.reset_rate, args.seed).start()
+    print(f"Emulating a Bravia TV at {emulator.url}, press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    emulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+
+from urllib.parse import urlsplit
+
+log = logging.getLogger("tv.notify")
+
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xa
+
+
+class WebSocket(object):
+    """Minimal RFC 6455 client, only what the Bravia notification channel needs
+
+    `wss://` URLs are connected over TLS with the default certificate
+    checks, like the REST calls.
+    """
+
+    def __init__(self, url, headers=None, timeout=10):
+        self.url = url
+        self.headers = headers or {}
+        self.timeout = timeout
+        self._sock = None
+        self._buffer = bytearray()
+
+    def connect(self):
+        parts = urlsplit(self.url)
+        secure = parts.scheme == "wss"
+        self._sock = socket.create_connection((parts.hostname, parts.port or (443 if secure else 80)), self.timeout)
+        if secure:
+            import ssl
+            try:
+                self._sock = ssl.create_default_context().wrap_socket(self._sock, server_hostname=parts.hostname)
+            except OSError:
+                self._sock.close()
+                self._sock = None
+                raise
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = [
+            f"GET {parts.path or '/'} HTTP/1.1",
+            f"Host: {parts.netloc}",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            f"Sec-WebSocket-Key: {key}",
+            "Sec-WebSocket-Version: 13",
+        ] + [f"{name}: {value}" for name, value in self.headers.items()]
+        self._sock.sendall(("\r\n".join(request) + "\r\n\r\n").encode())
+
+        status = self._read_line().split()
+        if len(status) < 2 or status[1] != "101":
+            raise ConnectionError(f"WebSocket handshake failed: {' '.join(status)}")
+
+        accept = None
+        while True:
+            line = self._read_line().strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "sec-websocket-accept":
+                accept = value.strip()
+
+        expected = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        if accept != expected:
+            raise ConnectionError("WebSocket handshake failed: invalid Sec-WebSocket-Accept")
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._send_frame(OP_CLOSE, b"")
+            except OSError:
+                pass
+            self._sock.close()
+            self._sock = None
+
+    def _send_frame(self, opcode, payload):
+        header = bytearray([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < (1 << 16):
+            header.append(0x80 | 126)
+            header += struct.pack("!H", length)
+        else:
+            header.append(0x80 | 127)
+            header += struct.pack("!Q", length)
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self._sock.sendall(bytes(header) + mask + masked)
+
+    def send(self, text):
+        self._send_frame(OP_TEXT, text.encode())
+
+    def ping(self):
+        self._send_frame(OP_PING, b"")
+
+    def _fill(self):
+        data = self._sock.recv(4096)
+        if not data:
+            raise ConnectionError("WebSocket connection closed")
+        self._buffer += data
+
+    def _read_line(self):
+        while b"\r\n" not in self._buffer:
+            self._fill()
+        line, _, rest = bytes(self._buffer).partition(b"\r\n")
+        self._buffer = bytearray(rest)
+        return line.decode(errors="replace")
+
+    def _read_exactly(self, size):
+        while len(self._buffer) < size:
+            self._fill()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def wait(self, timeout):
+        """Wait until data is available, False on timeout"""
+        if self._buffer or getattr(self._sock, "pending", lambda: 0)():
+            return True
+        r, _, _ = select.select([self._sock], [], [], timeout)
+        return bool(r)
+
+    def _read_frame(self):
+        b0, b1 = self._read_exactly(2)
+        opcode = b0 & 0x0f
+        length = b1 & 0x7f
+        if length == 126:
+            length, = struct.unpack("!H", self._read_exactly(2))
+        elif length == 127:
+            length, = struct.unpack("!Q", self._read_exactly(8))
+        mask = self._read_exactly(4) if b1 & 0x80 else None
+        payload = self._read_exactly(length)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return bool(b0 & 0x80), opcode, payload
+
+    def recv(self):
+        """Return the next text message, None when the server closed the connection
+
+        Returns an empty string after handling a control frame.
+        """
+        message = b""
+        while True:
+            fin, opcode, payload = self._read_frame()
+            if opcode == OP_CLOSE:
+                return None
+            if opcode == OP_PING:
+                self._send_frame(OP_PONG, payload)
+                return ""
+            if opcode == OP_PONG:
+                return ""
+            if opcode in (OP_TEXT, OP_CONTINUATION):
+                message += payload
+                if fin:
+                    return message.decode()
+
+
+class PowerNotifier(object):
+    """Subscribe to `notifyPowerStatus` on the Bravia notification channel
+
+    Runs on its own thread and reconnects with backoff. `on_power_status`
+    is called from that thread. If the TV does not offer the notification
+    `supported` becomes False and the thread exits. With `on_volume` the
+    speaker volume changes are subscribed to as well, when the TV has them
+    `volume_enabled` is True while connected.
+    """
+
+    NOTIFICATION = "notifyPowerStatus"
+    VOLUME_NOTIFICATION = "notifyVolumeInformation"
+
+    def __init__(self, url, auth_psk, on_power_status, keepalive=60, on_volume=None):
+        parts = urlsplit(url)
+        scheme = "wss" if parts.scheme == "https" else "ws"
+        self.ws_url = f"{scheme}://{parts.netloc}{parts.path}/system"
+        self._psk = auth_psk
+        self._on_power_status = on_power_status
+        self._on_volume = on_volume
+        self._keepalive = keepalive
+        self._stop = threading.Event()
+        self._thread = None
+        self.connected = False
+        self.volume_enabled = False
+        self.supported = True
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="bravia-notify", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        delay = 1
+        while not self._stop.is_set() and self.supported:
+            try:
+                self._listen()
+            except (OSError, ValueError) as err:
+                log.debug(f"Notification channel error: {err}")
+            except Exception:
+                # Keep the thread alive, the power status would silently
+                # fall back to polling otherwise
+                log.warning("Unexpected notification channel error", exc_info=True)
+            finally:
+                if self.connected:
+                    delay = 1  # The channel worked, start the backoff over
+                self.connected = False
+                self.volume_enabled = False
+            if self.supported:
+                self._stop.wait(delay)
+                delay = min(delay * 2, 60)
+
+    def _listen(self):
+        ws = WebSocket(self.ws_url, headers={"X-Auth-PSK": self._psk})
+        ws.connect()
+        names = [self.NOTIFICATION] + ([self.VOLUME_NOTIFICATION] if self._on_volume else [])
+        try:
+            ws.send(json.dumps({
+                "method": "switchNotifications",
+                "id": 1,
+                "params": [{"enabled": [{"name": name, "version": "1.0"} for name in names]}],
+                "version": "1.0"
+            }))
+
+            waiting_pong = False
+            while not self._stop.is_set():
+                if not ws.wait(self._keepalive):
+                    if waiting_pong:
+                        raise ConnectionError("Notification channel timed out")
+                    ws.ping()
+                    waiting_pong = True
+                    continue
+                waiting_pong = False
+                message = ws.recv()
+                if message is None:
+                    return
+                if not message:
+                    continue
+                try:
+                    self._handle_message(json.loads(message))
+                except (ValueError, LookupError, TypeError, AttributeError) as err:
+                    log.warning(f"Ignoring malformed notification message {message[:200]!r}: {err!r}")
+                    continue
+                if not self.supported:
+                    return
+        finally:
+            ws.close()
+
+    def _handle_message(self, message):
+        if not isinstance(message, dict):
+            raise TypeError("not an object")
+        if message.get("id") == 1:
+            if "error" in message:
+                raise ConnectionError(f"Subscribing failed: {message['error']}")
+            enabled = [n["name"] for n in message["result"][0].get("enabled", [])]
+            if self.NOTIFICATION not in enabled:
+                log.info("TV does not support power notifications")
+                self.supported = False
+                return
+            self.volume_enabled = self._on_volume is not None and self.VOLUME_NOTIFICATION in enabled
+            log.info("Subscribed to TV power" + (" and volume" if self.volume_enabled else "") + " notifications")
+            self.connected = True
+        elif message.get("method") == self.NOTIFICATION:
+            status = message["params"][0]["status"]
+            log.debug(f"Power status notification: {status}")
+            self._on_power_status(status)
+        elif message.get("method") == self.VOLUME_NOTIFICATION and self._on_volume is not None:
+            for info in message["params"]:
+                log.debug(f"Volume notification: {info}")
+                self._on_volume(info)
@@ -0,0 +1,75 @@
+import logging
+
+log = logging.getLogger("volume")
+
+
+# Presses within this time of the first one are sent as one call
+COALESCE_WINDOW = 0.08
+
+
+class VolumeAction(object):
+    """Keymap action moving the TV volume by `steps`, may auto-repeat"""
+    __slots__ = ("steps", "repeat")
+
+    def __init__(self, steps, repeat=None):
+        self.steps = steps
+        self.repeat = repeat
+
+    def __repr__(self):
+        return f"VolumeAction({self.steps:+d})"
+
+
+class VolumeController(object):
+    """Turns bursts of volume presses into absolute setAudioVolume calls
+
+    Steps are summed for `window` seconds after the first press and sent as
+    one `change_volume()` call through `dispatcher`. Only one call is in
+    flight, presses arriving meanwhile go into the next one. When the REST
+    API cannot be used the steps are handed to `fallback(steps)`, which
+    sends them as volume keys.
+    """
+
+    def __init__(self, loop, dispatcher, tv, fallback, window=COALESCE_WINDOW):
+        self.loop = loop
+        self.tasks = loop.tasks
+        self.dispatcher = dispatcher
+        self.tv = tv
+        self.fallback = fallback
+        self.window = window
+        self.volume = None  # Last level the TV confirmed
+        self.calls = 0
+        self._steps = 0
+        self._task = None
+        self._busy = False
+
+    def change(self, steps):
+        if not self.tv or not self.tv.is_available:
+            self.fallback(steps)
+            return
+        self._steps += steps
+        if self._task is None and not self._busy:
+            self._task = self.tasks.call_later(self.window, self._flush)
+
+    def _flush(self):
+        self._task = None
+        steps, self._steps = self._steps, 0
+        if not steps:
+            return
+        self._busy = True
+        self.calls += 1
+
+        def on_done(volume, error):
+            self.loop.call_soon_threadsafe(self._done, steps, volume, error)
+
+        self.dispatcher.submit(self.tv.change_volume, steps, callback=on_done)
+
+    def _done(self, steps, volume, error):
+        self._busy = False
+        if error is None:
+            self.volume = volume
+            log.debug(f"Volume {steps:+d} -> {volume}")
+        else:
+            log.info(f"Volume change through the TV failed ({error}), sending {steps:+d} as keys")
+            self.fallback(steps)
+        if self._steps:
+            self._flush()